@@ -0,0 +1,335 @@
+"""
+Approximate nearest-neighbour matching with an IVF (inverted file) index.
+
+Embeddings are clustered with spherical k-means; each user sits in the list of
+its nearest centroid. A query scores only the nprobe closest lists instead of
+the whole population. Enabled with MATCH_MODE=ann.
+
+Profile events arrive on the database writer thread, so the expensive work
+they trigger (re-clustering as the community grows, snapshots to disk) runs on
+a background thread instead; rows changed meanwhile are re-assigned when the
+new clustering is swapped in.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from db import add_profile_listener, get_embeddings_fingerprint
+from match_engine import MatchEngine, MATCH_THRESHOLD, load_candidates, normalize
+from matching import MODEL_VERSION
+from skill_index import get_skill_index
+
+ANN_INDEX_PATH = os.getenv("ANN_INDEX_PATH", "ann_index.npz")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0")) # 0 = about sqrt(n) lists
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_MIN_SIZE = int(os.getenv("ANN_MIN_SIZE", "1000")) # below this, queries use an exact scan
+ANN_SAVE_INTERVAL = int(os.getenv("ANN_SAVE_INTERVAL", "300")) # seconds between snapshots
+
+ASSIGN_CHUNK = 8192
+
+# Training and snapshots, off the database writer thread
+_background = ThreadPoolExecutor(1, thread_name_prefix="ann-index")
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_CHUNK):
+        chunk = data[start:start + ASSIGN_CHUNK]
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+def spherical_kmeans(data: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Clusters L2-normalized rows by cosine similarity. Returns normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = data[rng.choice(len(data), empty.size, replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class IVFIndex(MatchEngine):
+    """
+    MatchEngine that additionally keeps every row in one inverted list, so
+    top_k only scores the rows of the nprobe lists closest to the query.
+    Until it is trained (ANN_MIN_SIZE rows), queries fall back to the exact scan.
+    """
+
+    def __init__(self, nprobe: int = ANN_NPROBE, lexical=None, model_version: Optional[str] = MODEL_VERSION):
+        super().__init__(lexical=lexical, model_version=model_version)
+        self.nprobe = nprobe
+        self.centroids = None
+        self.trained_size = 0
+        self._labels = np.empty(0, dtype=np.int32)
+        self._lists = []
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # Newest last_updated among the indexed profiles, tracked from events
+        # so a snapshot and its fingerprint always describe the same rows
+        self._last_updated: Optional[str] = None
+        # Rows changed while a training run is in progress, or None
+        self._changed: Optional[set] = None
+        self._scheduled = set()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, nlist: int = ANN_NLIST, iterations: int = 10):
+        """
+        Clusters the current rows. Queries and updates carry on meanwhile,
+        against the previous clustering; the lock is only held to copy the
+        rows and to swap the result in.
+        """
+        with self._lock:
+            if self._size == 0 or self._changed is not None:
+                return
+            data = self._matrix[:self._size].copy()
+            self._changed = set()
+        try:
+            started = time.perf_counter()
+            nlist = min(nlist or max(1, int(np.sqrt(len(data)))), len(data))
+            # k-means on a sample is enough to place the centroids
+            sample_size = min(len(data), nlist * 64)
+            sample = data[np.random.default_rng(0).choice(len(data), sample_size, replace=False)]
+            centroids = spherical_kmeans(sample, nlist, iterations)
+            labels = _nearest(data, centroids)
+        except BaseException:
+            with self._lock:
+                self._changed = None
+            raise
+
+        with self._lock:
+            # Rows updated, moved or added since the copy are assigned afresh
+            stale = {row for row in self._changed if row < self._size}
+            stale.update(range(len(data), self._size))
+            self._changed = None
+            self.centroids = centroids
+            self.trained_size = len(data)
+            self._labels = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+            self._labels[:min(len(data), self._size)] = labels[:self._size]
+            for row in stale:
+                self._labels[row] = int(np.argmax(centroids @ self._matrix[row]))
+            self._lists = [set() for _ in range(nlist)]
+            for row, label in enumerate(self._labels[:self._size].tolist()):
+                self._lists[label].add(row)
+            self._dirty = True
+        logging.info(f"IVF index trained: {nlist} lists over {len(data)} rows in {time.perf_counter() - started:.2f}s")
+
+    def _rows_reset(self):
+        self._labels = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+        if not self.trained:
+            self._lists = []
+            return
+        self._lists = [set() for _ in range(len(self.centroids))]
+        if self._size:
+            labels = _nearest(self._matrix[:self._size], self.centroids)
+            self._labels[:self._size] = labels
+            for row, label in enumerate(labels.tolist()):
+                self._lists[label].add(row)
+
+    def _row_updated(self, row: int):
+        self._dirty = True
+        if self._changed is not None:
+            self._changed.add(row)
+        if row >= len(self._labels):
+            labels = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+            labels[:len(self._labels)] = self._labels
+            self._labels = labels
+        if not self.trained:
+            return
+        old = self._labels[row]
+        new = int(np.argmax(self.centroids @ self._matrix[row]))
+        if old != new:
+            if old >= 0:
+                self._lists[old].discard(row)
+            self._lists[new].add(row)
+            self._labels[row] = new
+
+    def _row_removed(self, row: int, last: int):
+        self._dirty = True
+        if self._changed is not None:
+            self._changed.update((row, last))
+        if not self.trained:
+            return
+        self._lists[self._labels[row]].discard(row)
+        if row != last:
+            label = self._labels[last]
+            self._lists[label].discard(last)
+            self._lists[label].add(row)
+            self._labels[row] = label
+        self._labels[last] = -1
+
+    def top_k(self, query: np.ndarray, k: int, threshold: float = MATCH_THRESHOLD,
+              exclude: Iterable[int] = (), user_id: Optional[int] = None,
+              nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        if not self.trained:
+            return super().top_k(query, k, threshold, exclude, user_id)
+        query = normalize(query)
+        if query is None or k <= 0:
+            return []
+
+        with self._lock:
+            if self._size == 0 or query.shape[0] != self.dim:
+                return []
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            centroid_scores = self.centroids @ query
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            rows = np.fromiter((row for label in probe.tolist() for row in self._lists[label]), dtype=np.int64)
+            if rows.size == 0:
+                return []
+            scores = self._blend(rows, self._matrix[rows] @ query, user_id)
+            self._exclude(rows, scores, exclude)
+            return self._select(rows, scores, k, threshold)
+
+    def on_profile_event(self, event: str, user_id: int, profile=None):
+        super().on_profile_event(event, user_id, profile)
+        if profile is not None and profile.last_updated:
+            with self._lock:
+                self._last_updated = max(self._last_updated or "", profile.last_updated)
+        if not self.trained and self._size >= ANN_MIN_SIZE:
+            self._in_background(self.train)
+        elif self.trained and self._size > 4 * self.trained_size:
+            # Lists drift as the community grows; re-cluster before they get too long
+            self._in_background(self.train)
+        if time.monotonic() - self._last_save >= ANN_SAVE_INTERVAL:
+            self._in_background(self.save)
+
+    def _in_background(self, fn):
+        """Runs fn on the background thread, unless a run of it is already waiting."""
+        with self._lock:
+            if fn.__name__ in self._scheduled:
+                return
+            self._scheduled.add(fn.__name__)
+
+        def run():
+            with self._lock:
+                self._scheduled.discard(fn.__name__)
+            try:
+                fn()
+            except Exception as e:
+                logging.error(f"IVF index {fn.__name__} failed: {e}")
+        _background.submit(run)
+
+    def fingerprint(self) -> List[str]:
+        """(row count, newest last_updated), comparable with db.get_embeddings_fingerprint."""
+        return [str(self._size), self._last_updated or ""]
+
+    def save(self, path: str = ANN_INDEX_PATH):
+        """
+        Writes a snapshot of the index next to the database. The write goes to a
+        temporary file first, so a crash never leaves a truncated index behind.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                "ids": self._ids[:self._size].copy(),
+                "matrix": self._matrix[:self._size].copy(),
+                "labels": self._labels[:self._size].copy(),
+                "centroids": self.centroids if self.trained else np.empty((0, 0), dtype=np.float32),
+                "trained_size": np.int64(self.trained_size),
+                "fingerprint": np.array(self.fingerprint()),
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, path)
+        logging.info(f"IVF index saved to {path} ({len(snapshot['ids'])} rows)")
+
+    def build(self):
+        """Loads every candidate from the database."""
+        # Read first: a save landing in between makes the snapshot look stale, never current
+        self._last_updated = get_embeddings_fingerprint(self.model_version)[1]
+        self.load_arrays(*load_candidates(self.model_version))
+
+    def load_file(self, path: str = ANN_INDEX_PATH) -> bool:
+        """
+        Loads a snapshot written by save(). Returns False if it is missing or
+        no longer matches the database, in which case the caller rebuilds.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                count, last_updated = get_embeddings_fingerprint(self.model_version)
+                if list(data["fingerprint"]) != [str(count), last_updated or ""]:
+                    logging.info("IVF index on disk is stale, rebuilding")
+                    return False
+                ids = data["ids"]
+                with self._lock:
+                    self._last_updated = last_updated
+                    self._matrix = np.ascontiguousarray(data["matrix"], dtype=np.float32)
+                    self._ids = ids.astype(np.int64)
+                    self._rows = {user_id: row for row, user_id in enumerate(ids.tolist())}
+                    self._size = len(ids)
+                    self.dim = self._matrix.shape[1] if self._size else None
+                    centroids = data["centroids"]
+                    self.centroids = centroids if centroids.size else None
+                    self.trained_size = int(data["trained_size"])
+                    self._labels = data["labels"].astype(np.int32)
+                    self._lists = [set() for _ in range(len(self.centroids))] if self.trained else []
+                    if self.trained:
+                        for row, label in enumerate(self._labels.tolist()):
+                            self._lists[label].add(row)
+        except Exception as e:
+            logging.error(f"Failed to load IVF index from {path}: {e}")
+            return False
+        logging.info(f"IVF index loaded from {path} ({self._size} rows)")
+        return True
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_ann_index() -> IVFIndex:
+    """
+    Returns the process-wide IVF index, restoring it from ANN_INDEX_PATH when
+    the snapshot is current and rebuilding it from the database otherwise.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = IVFIndex(lexical=get_skill_index())
+                if not index.load_file():
+                    index.build()
+                    if len(index) >= ANN_MIN_SIZE:
+                        index.train()
+                    index._dirty = True
+                    index.save()
+                add_profile_listener(index.on_profile_event)
+                _index = index
+    return _index
+
+def save_ann_index():
+    """Waits for background work and persists pending index changes; called on shutdown."""
+    _background.submit(lambda: None).result()
+    if _index is not None:
+        _index.save()
+
+def rebuild_ann_index():
+    index = IVFIndex()
+    index.build()
+    index.train()
+    index._dirty = True
+    index.save()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    rebuild_ann_index()
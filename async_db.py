@@ -0,0 +1,328 @@
+"""
+Non-blocking access to db.py for aiogram handlers.
+
+Reads run on a small thread pool (each worker has its own WAL connection, see
+db.get_connection). Writes made through this module go through a single writer
+thread, so they don't contend with each other for the SQLite write lock; the
+embedding cache (embedding_cache.py) is the exception and commits its own
+batches from the embedding thread, waiting on the lock if the writer holds it.
+Profile listeners (match engine, neighbour lists, indexes) run on the writer
+thread, off the event loop.
+
+Profile, language, report, rate-limit and FSM session writes are queued and group
+committed: writes that queue up while a commit runs (up to DB_WRITE_BATCH_SIZE)
+share the next transaction and commit. A lone write commits at once; a nonzero
+DB_WRITE_BATCH_WAIT_MS holds a batch open that long for more writes, which only
+paid off in benchmarks/write_throughput.py past a few hundred concurrent
+writers. DB_WRITE_DURABILITY chooses when a write call returns:
+    commit  once its batch is committed (default)
+    queued  as soon as it is queued; a crash can lose the last batch
+Either way, reads through this module see the pending writes.
+
+Profile and language reads are served from in-process LRU/TTL caches
+(USER_CACHE_SIZE entries, USER_CACHE_TTL seconds). Every write through this
+module invalidates the user's entries, so the caches only go stale on writes
+made behind its back (e.g. scripts writing to the database directly). Other
+processes sharing the database learn of commits through commit listeners and
+call invalidate() (see supervisor.py).
+"""
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import db
+from db import UserProfile
+from ttl_cache import TTLCache
+
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "256"))
+DB_WRITE_BATCH_WAIT_MS = float(os.getenv("DB_WRITE_BATCH_WAIT_MS", "0"))
+DB_WRITE_DURABILITY = os.getenv("DB_WRITE_DURABILITY", "commit")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+_read_executor = ThreadPoolExecutor(DB_READ_WORKERS, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+
+_write_queue: Optional[asyncio.Queue] = None
+_writer_task: Optional[asyncio.Task] = None
+
+# State of queued, uncommitted writes, laid over reads until all of a user's
+# writes are committed. A pending profile of None is a pending delete.
+_in_flight: Dict[int, int] = {}
+_pending_profiles: Dict[int, Optional[UserProfile]] = {}
+_pending_languages: Dict[int, str] = {}
+_pending_blocks = set()
+
+_profile_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL) # user_id -> UserProfile or None
+_language_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# Bumped on every invalidation; a read that overlapped one is not cached,
+# since it may have returned the row from before the write
+_write_seq = 0
+_MISSING = object()
+# Callables invoked as listener(user_id) on the event loop once a write to the user is committed
+_commit_listeners: List[Callable] = []
+
+async def run_read(fn: Callable, *args, **kwargs):
+    """Runs a blocking read (or CPU-bound query work) on the reader pool."""
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, partial(fn, *args, **kwargs))
+
+async def run_write(fn: Callable, *args, **kwargs):
+    """Runs a blocking write on the writer thread; resolves once it is committed."""
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, partial(fn, *args, **kwargs))
+
+def on_writer_thread() -> bool:
+    return threading.current_thread().name.startswith("db-write")
+
+def submit_write(fn: Callable, *args, **kwargs):
+    """
+    Runs a blocking write on the writer thread from any thread, including
+    reader threads, without waiting. Returns a concurrent.futures.Future.
+    """
+    return _write_executor.submit(partial(fn, *args, **kwargs))
+
+def write_now(fn: Callable, *args, **kwargs):
+    """
+    Runs a blocking write on the writer thread and returns its result. Called
+    on the writer thread itself, it runs inline instead of waiting on itself.
+    """
+    if on_writer_thread():
+        return fn(*args, **kwargs)
+    return submit_write(fn, *args, **kwargs).result()
+
+async def queue_write(write_fn: Callable, *args, user_id: Optional[int] = None):
+    """
+    Queues a db write function (see db.run_writes) for the next group commit.
+    Waits for the commit unless DB_WRITE_DURABILITY is "queued".
+    """
+    global _write_queue, _writer_task
+    if _write_queue is None:
+        _write_queue = asyncio.Queue()
+        _writer_task = asyncio.create_task(_write_loop())
+    if user_id is not None:
+        _in_flight[user_id] = _in_flight.get(user_id, 0) + 1
+
+    wait = DB_WRITE_DURABILITY != "queued"
+    future = asyncio.get_running_loop().create_future() if wait else None
+    _write_queue.put_nowait((write_fn, args, user_id, future))
+    if wait:
+        await future
+
+async def _write_loop():
+    loop = asyncio.get_running_loop()
+    max_wait = DB_WRITE_BATCH_WAIT_MS / 1000
+    stopping = False
+    while not stopping:
+        item = await _write_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = loop.time() + max_wait
+        while len(batch) < DB_WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            try:
+                # A lone write commits at once; waiting for company only pays off
+                # once writes are already queueing up behind each other
+                if timeout <= 0 or len(batch) == 1:
+                    item = _write_queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(_write_queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        try:
+            errors = await loop.run_in_executor(_write_executor, db.run_writes, [(fn, args) for fn, args, _, _ in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+
+        for (fn, _, user_id, future), error in zip(batch, errors):
+            if user_id is not None:
+                _write_done(user_id, error is None)
+            if future is None:
+                if error is not None:
+                    logging.error(f"Queued write {fn.__name__} failed: {error}")
+            elif not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+def _invalidate(user_id: int):
+    global _write_seq
+    _write_seq += 1
+    _profile_cache.pop(user_id)
+    _language_cache.pop(user_id)
+
+def invalidate(user_id: int):
+    """Drops the cached entries of a user another process has written to."""
+    _invalidate(user_id)
+
+def add_commit_listener(listener: Callable):
+    if listener not in _commit_listeners:
+        _commit_listeners.append(listener)
+
+def _notify_commit_listeners(user_id: int):
+    for listener in _commit_listeners:
+        try:
+            listener(user_id)
+        except Exception as e:
+            logging.error(f"Commit listener {listener} failed for {user_id}: {e}")
+
+def _write_done(user_id: int, committed: bool = True):
+    left = _in_flight.get(user_id, 1) - 1
+    if left > 0:
+        _in_flight[user_id] = left
+        return
+    # All of this user's writes are committed; the database is current again
+    _invalidate(user_id)
+    if committed:
+        _notify_commit_listeners(user_id)
+        if user_id in _pending_languages:
+            _language_cache.set(user_id, _pending_languages[user_id])
+    _in_flight.pop(user_id, None)
+    _pending_profiles.pop(user_id, None)
+    _pending_languages.pop(user_id, None)
+    _pending_blocks.discard(user_id)
+
+def _with_pending(user_id: int, profile: Optional[UserProfile]) -> Optional[UserProfile]:
+    if user_id not in _in_flight:
+        return profile
+    if user_id in _pending_profiles:
+        profile = _pending_profiles[user_id]
+    if profile is None:
+        return None
+    if user_id in _pending_languages and profile.language != _pending_languages[user_id]:
+        profile = replace(profile, language=_pending_languages[user_id])
+    if user_id in _pending_blocks and not profile.is_blocked:
+        profile = replace(profile, is_blocked=True)
+    return profile
+
+async def get_user_profile(user_id: int) -> Optional[UserProfile]:
+    if user_id in _pending_profiles:
+        return _with_pending(user_id, None)
+    profile = _profile_cache.get(user_id, _MISSING)
+    if profile is _MISSING:
+        seq = _write_seq
+        profile = await run_read(db.get_user_profile, user_id)
+        if seq == _write_seq:
+            _profile_cache.set(user_id, profile)
+            if profile is not None:
+                _language_cache.set(user_id, profile.language)
+    return _with_pending(user_id, profile)
+
+async def get_user_language(user_id: int) -> str:
+    if user_id in _pending_languages:
+        return _pending_languages[user_id]
+    lang = _language_cache.get(user_id)
+    if lang is None:
+        seq = _write_seq
+        lang = await run_read(db.get_user_language, user_id)
+        if seq == _write_seq:
+            _language_cache.set(user_id, lang)
+    return lang
+
+def cache_stats() -> Dict[str, dict]:
+    """Size and hit/miss counters of the profile and language caches."""
+    return {"profile": _profile_cache.stats(), "language": _language_cache.stats()}
+
+async def get_profiles_by_ids(user_ids: List[int]) -> Dict[int, UserProfile]:
+    profiles = await run_read(db.get_profiles_by_ids, user_ids)
+    for user_id in user_ids:
+        if user_id in _in_flight:
+            profile = _with_pending(user_id, profiles.get(user_id))
+            if profile is None:
+                profiles.pop(user_id, None)
+            else:
+                profiles[user_id] = profile
+    return profiles
+
+async def get_all_profiles_except(user_id: int) -> List[UserProfile]:
+    return await run_read(db.get_all_profiles_except, user_id)
+
+async def get_stats():
+    return await run_read(db.get_stats)
+
+async def get_users_with_term(term: str, kind: str = "skills") -> List[int]:
+    return await run_read(db.get_users_with_term, term, kind)
+
+async def init_db():
+    await run_write(db.init_db)
+
+async def save_user_profile(profile: UserProfile):
+    _invalidate(profile.user_id)
+    _pending_profiles[profile.user_id] = profile
+    _pending_languages[profile.user_id] = profile.language
+    _pending_blocks.discard(profile.user_id)
+    await queue_write(db._save_user_profile, profile, user_id=profile.user_id)
+
+async def delete_user_profile(user_id: int):
+    _invalidate(user_id)
+    _pending_profiles[user_id] = None
+    _pending_languages[user_id] = "en"
+    await queue_write(db._delete_user_profile, user_id, user_id=user_id)
+
+async def report_user(user_id: int):
+    _invalidate(user_id)
+    _pending_blocks.add(user_id)
+    await queue_write(db._report_user, user_id, user_id=user_id)
+
+async def set_user_language(user_id: int, lang: str):
+    _invalidate(user_id)
+    _pending_languages[user_id] = lang
+    await queue_write(db._set_user_language, user_id, lang, user_id=user_id)
+
+async def swap_embeddings(updates: List[Tuple[int, bytes, str, str]]):
+    """
+    Queues replacement embeddings (see db._swap_embeddings) and waits until
+    they are committed, so the users' cached profiles are refreshed.
+    """
+    for user_id, *_ in updates:
+        _invalidate(user_id)
+    await queue_write(db._swap_embeddings, updates)
+    if DB_WRITE_DURABILITY == "queued":
+        await flush()
+    for user_id, *_ in updates:
+        _invalidate(user_id)
+        _notify_commit_listeners(user_id)
+
+async def save_rate_limits(rows: List[Tuple[int, str, float, float]]):
+    await queue_write(db._save_rate_limits, rows)
+
+async def get_fsm_session(key: str):
+    return await run_read(db.get_fsm_session, key)
+
+async def save_fsm_session(key: str, state: Optional[str], data: Optional[bytes], updated_at: float):
+    await queue_write(db._save_fsm_session, key, state, data, updated_at)
+
+async def delete_stale_fsm_sessions(before: float) -> int:
+    return await run_write(db.delete_stale_fsm_sessions, before)
+
+def _flush_marker(conn):
+    return None
+
+async def flush():
+    """Waits until every write queued so far is committed, whatever the durability."""
+    if _write_queue is not None:
+        future = asyncio.get_running_loop().create_future()
+        _write_queue.put_nowait((_flush_marker, (), None, future))
+        await future
+
+async def shutdown():
+    """Commits every queued write, then stops both executors."""
+    global _write_queue, _writer_task
+    if _writer_task is not None:
+        _write_queue.put_nowait(None)
+        await _writer_task
+        _write_queue, _writer_task = None, None
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _write_executor.shutdown, True)
+    await loop.run_in_executor(None, _read_executor.shutdown, True)
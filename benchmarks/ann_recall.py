@@ -0,0 +1,91 @@
+"""
+Recall vs latency of the matching paths: the original per-profile
+compute_similarity loop, the exact MatchEngine scan and the IVF index.
+
+    python -m benchmarks.ann_recall --users 100000 --queries 200
+    python -m benchmarks.ann_recall --from-db
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from db import get_all_embeddings
+from match_engine import MatchEngine
+from matching import compute_similarity, decode_embedding
+from vector_format import encode_vector
+
+def synthetic_embeddings(n: int, dim: int, topics: int, seed: int = 0):
+    """Clustered unit vectors, roughly what sentence embeddings of profiles look like."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, topics, n)] + 0.8 * rng.normal(size=(n, dim)).astype(np.float32)
+    return [(user_id, encode_vector(vector)) for user_id, vector in enumerate(vectors, 1)]
+
+def timed(fn, queries):
+    results, latencies = [], []
+    for user_id, query in queries:
+        started = time.perf_counter()
+        results.append(fn(user_id, query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, np.array(latencies)
+
+def recall(results, truth, k):
+    hits = [len({i for i, _ in got} & {i for i, _ in want}) / max(1, min(k, len(want)))
+            for got, want in zip(results, truth)]
+    return float(np.mean(hits))
+
+def report(name, results, latencies, truth, k):
+    print(f"{name:<28} recall@{k}={recall(results, truth, k):.3f}  "
+          f"mean={latencies.mean():8.2f}ms  p95={np.percentile(latencies, 95):8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--loop-queries", type=int, default=5, help="queries for the slow per-profile loop")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--from-db", action="store_true", help="use users.embedding instead of synthetic data")
+    args = parser.parse_args()
+
+    rows = get_all_embeddings() if args.from_db else synthetic_embeddings(args.users, args.dim, args.topics)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(rows), min(args.queries, len(rows)), replace=False)
+    queries = [(rows[i][0], decode_embedding(rows[i][1])) for i in picks]
+    print(f"{len(rows)} embeddings, {len(queries)} queries, k={args.k}, threshold=0.1")
+
+    started = time.perf_counter()
+    engine = MatchEngine()
+    engine.load(rows)
+    print(f"exact engine load: {time.perf_counter() - started:.2f}s")
+
+    truth, latencies = timed(lambda uid, q: engine.top_k(q, args.k, exclude={uid}), queries)
+
+    loop_queries = queries[:args.loop_queries]
+    blobs = {user_id: blob for user_id, blob in rows}
+    def per_profile_loop(user_id, query):
+        scored = [(other_id, compute_similarity(blobs[user_id], blob))
+                  for other_id, blob in rows if other_id != user_id]
+        scored = [m for m in scored if m[1] > 0.1]
+        scored.sort(key=lambda m: m[1], reverse=True)
+        return scored[:args.k]
+    loop_results, loop_latencies = timed(per_profile_loop, loop_queries)
+    report("per-profile loop (baseline)", loop_results, loop_latencies, truth[:len(loop_queries)], args.k)
+    report("exact engine", truth, latencies, truth, args.k)
+
+    index = IVFIndex()
+    index.load(rows)
+    started = time.perf_counter()
+    index.train()
+    print(f"IVF train: {time.perf_counter() - started:.2f}s, {len(index.centroids)} lists")
+    for nprobe in (1, 2, 4, 8, 16, 32):
+        if nprobe > len(index.centroids):
+            break
+        results, latencies = timed(lambda uid, q: index.top_k(q, args.k, exclude={uid}, nprobe=nprobe), queries)
+        report(f"ivf nprobe={nprobe}", results, latencies, truth, args.k)
+
+if __name__ == "__main__":
+    main()
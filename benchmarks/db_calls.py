@@ -0,0 +1,55 @@
+"""
+Per-call latency of the db.py functions handlers use on every update.
+Only the public db API is used, so the same script can time older trees.
+
+    python -m benchmarks.db_calls --db /tmp/bench.db --users 2000 --calls 2000
+"""
+import argparse
+import os
+import time
+
+import db
+from db import UserProfile
+
+def timed(name, fn, calls):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22} {elapsed / calls * 1e6:9.1f} us/call")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench_db_calls.db")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    db.init_db()
+    for user_id in range(args.users):
+        db.save_user_profile(UserProfile(
+            user_id=user_id, username=f"user{user_id}", university="MSU", year_course="2nd Year",
+            skills=["Python", "SQL"], interests=["AI"], goals="Networking", last_updated="",
+            embedding=os.urandom(1548),
+        ))
+
+    users = args.users
+    timed("get_user_language", lambda i: db.get_user_language(i % users), args.calls)
+    timed("get_user_profile", lambda i: db.get_user_profile(i % users), args.calls)
+    if hasattr(db, "check_rate_limit"):
+        timed("check_rate_limit", lambda i: db.check_rate_limit(i % users, "matches", 3600), args.calls)
+        timed("update_rate_limit", lambda i: db.update_rate_limit(i % users, "matches"), args.calls)
+    else:
+        import rate_limiter
+        limiter = rate_limiter.RateLimiter(rate_limiter.parse_limits("matches=bucket:1000000/3600"))
+        timed("rate_limiter.hit", lambda i: limiter.hit(i % users, "matches"), args.calls)
+        timed("save_rate_limits (batch)", lambda i: db.save_rate_limits(limiter.take_dirty()), 1)
+    timed("set_user_language", lambda i: db.set_user_language(i % users, "en"), args.calls)
+    timed("get_stats", lambda i: db.get_stats(), max(1, args.calls // 100))
+
+if __name__ == "__main__":
+    main()
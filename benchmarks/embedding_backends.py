@@ -0,0 +1,119 @@
+"""
+Encode latency, memory use and match quality of the embedding backends.
+
+Each backend runs in its own process, so load time and resident memory are
+measured from a cold start. Quality is measured on a synthetic cohort (see
+import_profiles.synthetic_records): the mean skill/interest Jaccard overlap
+between each profile and its top-k neighbours, next to the overlap of random
+pairs, and the top-k agreement with the plain transformer where it is
+available. Backends whose dependencies are missing are reported and skipped.
+
+    python -m benchmarks.embedding_backends --profiles 2000
+    python -m benchmarks.embedding_backends --backends hashing transformer
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from embedding_backends import BACKENDS
+from import_profiles import synthetic_records, to_profile
+from matching import build_profile_text
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def cohort(count: int):
+    profiles = [to_profile(record) for record in synthetic_records(count, seed=7)]
+    return profiles, [build_profile_text(p.university, p.skills, p.interests, p.goals) for p in profiles]
+
+def neighbours(vectors: np.ndarray, k: int) -> np.ndarray:
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    scores = vectors @ vectors.T
+    np.fill_diagonal(scores, -np.inf)
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def measure(name: str, count: int, k: int, singles: int) -> dict:
+    """Runs in the child process."""
+    profiles, texts = cohort(count)
+    backend = BACKENDS[name]()
+    base = rss_mb()
+    started = time.perf_counter()
+    backend.load()
+    backend.encode(["warm-up"])
+    load_s = time.perf_counter() - started
+
+    latencies = []
+    for text in texts[:singles]:
+        started = time.perf_counter()
+        backend.encode([text])
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    vectors = np.concatenate([backend.encode(texts[i:i + 64]) for i in range(0, len(texts), 64)])
+    batch_rate = len(texts) / (time.perf_counter() - started)
+
+    return {
+        "backend": name, "version": backend.version, "dim": int(vectors.shape[1]),
+        "load_s": load_s, "single_ms": statistics.median(latencies), "batch_per_s": batch_rate,
+        "rss_mb": rss_mb() - base, "neighbours": neighbours(vectors, k).tolist(),
+    }
+
+def jaccard(a, b) -> float:
+    a, b = {t.casefold() for t in a}, {t.casefold() for t in b}
+    return len(a & b) / max(1, len(a | b))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--singles", type=int, default=50, help="single-text encodes for the latency median")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.profiles, args.k, args.singles)))
+        return
+
+    results = {}
+    for name in args.backends:
+        command = [sys.executable, "-m", "benchmarks.embedding_backends", "--child", name,
+                   "--profiles", str(args.profiles), "--singles", str(args.singles), "-k", str(args.k)]
+        run = subprocess.run(command, capture_output=True, text=True)
+        if run.returncode != 0:
+            print(f"{name:<22} unavailable: {run.stderr.strip().splitlines()[-1] if run.stderr.strip() else run.returncode}")
+            continue
+        results[name] = json.loads(run.stdout.strip().splitlines()[-1])
+
+    profiles, _ = cohort(args.profiles)
+    terms = [p.skills + p.interests for p in profiles]
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, len(profiles), size=(5000, 2))
+    baseline = np.mean([jaccard(terms[i], terms[j]) for i, j in pairs if i != j])
+    reference = results.get("transformer")
+
+    print(f"\n{args.profiles} synthetic profiles, k={args.k}, random-pair overlap {baseline:.3f}")
+    print(f"{'backend':<22} {'dim':>5} {'load':>7} {'1 text':>9} {'batched':>10} {'memory':>9} {'overlap':>8} {'agree':>6}")
+    for name, result in results.items():
+        overlap = np.mean([jaccard(terms[i], terms[j]) for i, row in enumerate(result["neighbours"]) for j in row])
+        agree = "-"
+        if reference is not None:
+            agree = f"{np.mean([len(set(a) & set(b)) / args.k for a, b in zip(result['neighbours'], reference['neighbours'])]):.2f}"
+        print(f"{name:<22} {result['dim']:>5} {result['load_s']:>6.2f}s {result['single_ms']:>7.2f}ms "
+              f"{result['batch_per_s']:>7.0f}/s {result['rss_mb']:>7.0f}MB {overlap:>8.3f} {agree:>6}")
+
+if __name__ == "__main__":
+    main()
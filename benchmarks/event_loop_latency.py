@@ -0,0 +1,81 @@
+"""
+Event-loop responsiveness and throughput of handler-style DB access, calling
+db.py directly on the loop versus awaiting async_db.
+
+Each simulated update does what a typical button press does: language lookup,
+profile lookup and a rate-limit check. A ticker task measures how late the
+loop wakes it up while the updates run.
+
+    python -m benchmarks.event_loop_latency --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+
+import async_db
+import db
+import rate_limiter
+from db import UserProfile
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append((time.perf_counter() - started - 0.001) * 1000)
+
+async def sync_update(user_id):
+    db.get_user_language(user_id)
+    db.get_user_profile(user_id)
+    rate_limiter.hit(user_id, "matches")
+
+async def async_update(user_id):
+    await async_db.get_user_language(user_id)
+    await async_db.get_user_profile(user_id)
+    rate_limiter.hit(user_id, "matches")
+
+async def run(name, update, updates, concurrency, users):
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await update(i % users)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    lags = np.array(lags or [0.0])
+    print(f"{name:<6} {updates / elapsed:8.0f} updates/s   loop lag p50={np.percentile(lags, 50):6.2f}ms "
+          f"p99={np.percentile(lags, 99):6.2f}ms max={lags.max():6.2f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench_event_loop.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    db.init_db()
+    for user_id in range(args.users):
+        db.save_user_profile(UserProfile(
+            user_id=user_id, username=f"user{user_id}", university="MSU", year_course="2nd Year",
+            skills=["Python"], interests=["AI"], goals="Networking", last_updated="",
+        ))
+
+    await run("sync", sync_update, args.updates, args.concurrency, args.users)
+    await run("async", async_update, args.updates, args.concurrency, args.users)
+    await async_db.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Memory held for half-finished profile wizards: aiogram's MemoryStorage versus
+fsm_storage.SQLiteStorage. Each simulated user stopped somewhere in the wizard
+with the answers given so far. Python heap growth is measured with tracemalloc
+once every session is written (and, for SQLite, committed). SQLite allocates
+its page cache outside the Python heap; db.PRAGMAS caps it (cache_size) per
+connection, however many sessions are stored.
+
+    python -m benchmarks.fsm_memory --sessions 200000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import async_db
+import db
+from fsm_storage import SQLiteStorage
+
+STEPS = ["waiting_for_year", "waiting_for_skills", "waiting_for_interests", "waiting_for_goals"]
+ANSWERS = [("university", "Moscow State Technological University STANKIN"), ("year_course", "3rd Year"),
+           ("skills", ["Python", "SQL", "Docker", "Machine Learning"]), ("interests", ["Startups", "Robotics"])]
+
+async def fill(storage, sessions: int):
+    for user_id in range(sessions):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        step = user_id % len(STEPS)
+        await storage.set_state(key, f"ProfileStates:{STEPS[step]}")
+        await storage.set_data(key, {"lang": "ru", **dict(ANSWERS[:step + 1])})
+
+async def measure(name: str, storage, sessions: int):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await fill(storage, sessions)
+    await async_db.flush()
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<14} {held / 2**20:8.1f}MB for {sessions} sessions ({time.perf_counter() - started:.1f}s)")
+    return held
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench_fsm.db")
+    parser.add_argument("--sessions", type=int, default=200000)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    db.init_db()
+    async_db.DB_WRITE_DURABILITY = "queued" # the wizard's writes don't wait on commits either
+
+    memory = MemoryStorage()
+    await measure("MemoryStorage", memory, args.sessions)
+    del memory
+    sqlite = SQLiteStorage(sweep_interval=0)
+    await measure("SQLiteStorage", sqlite, args.sessions)
+    await sqlite.close()
+    await async_db.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Throughput of the supervisor with 1..N worker processes on the same traffic.
+
+A database of synthetic profiles (embedded with the hashing backend, so no
+model download is needed) is prepared once and copied fresh for every run,
+so each worker count starts from identical state. Updates (recorded JSONL,
+or a synthetic command mix from --users users) are fed through a stubbed
+getUpdates, once every worker has warmed up, as fast as the supervisor
+routes them; throughput counts from the first update until every worker has
+handled its share.
+
+    python -m benchmarks.scale_out --workers 1 2 4 --updates 5000
+"""
+import argparse
+import asyncio
+import os
+import shutil
+
+# Workers inherit the environment; the hashing backend needs no model files
+os.environ["EMBEDDING_BACKEND"] = "hashing"
+
+import db
+import supervisor
+from import_profiles import import_profiles, synthetic_records
+
+def prepare(path: str, users: int):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.DB_PATH = path
+    db.init_db()
+    # Profiles for the senders of the synthetic updates (see telegram_stub.recorded_updates)
+    import_profiles(synthetic_records(users, seed=1, start_id=1_000_000), "scale_out", embeddings="model", resume=False)
+    db.close_connections()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--replay", help="JSONL file of recorded updates")
+    parser.add_argument("--rtt-ms", type=float, default=30, help="simulated Bot API round trip")
+    parser.add_argument("--db", default="bench_scale_out.db")
+    args = parser.parse_args()
+
+    template = args.db + ".template"
+    prepare(template, args.users)
+    print(f"{args.updates} updates from {args.users} users, Bot API round trip {args.rtt_ms:.0f}ms, {os.cpu_count()} CPUs")
+    results = []
+    for workers in args.workers:
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        shutil.copy(template, args.db)
+        shutil.rmtree(args.db + ".embeddings", ignore_errors=True)
+        run = argparse.Namespace(workers=workers, updates=args.updates, users=args.users, replay=args.replay,
+                                 rtt_ms=args.rtt_ms, db=args.db)
+        result = asyncio.run(supervisor.run_stub(run))
+        results.append(result)
+        print(f"{workers:>2} workers {result['per_second']:8.0f} updates/s "
+              f"({result['updates']} in {result['seconds']:.1f}s, x{result['per_second'] / results[0]['per_second']:.2f})")
+
+if __name__ == "__main__":
+    main()
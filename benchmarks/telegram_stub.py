@@ -0,0 +1,93 @@
+"""
+A local stand-in for the Telegram Bot API, for replaying traffic through the
+real dispatcher without a network or a bot token.
+
+StubSession answers the Bot API methods the handlers use after a simulated
+round trip of rtt_ms. getUpdates serves updates pushed with feed(), so
+Dispatcher.start_polling runs unchanged. recorded_updates() loads update JSON
+(one object per line, e.g. captured from a webhook) or generates a
+synthetic mix of commands from many users.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import Iterator, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, GetUpdates, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, Update, User
+
+STUB_TOKEN = "42:stub-token-for-local-replay"
+COMMANDS = ["/start", "/help", "/rules", "/myprofile", "/matches", "/stats"]
+
+class StubSession(BaseSession):
+    def __init__(self, rtt_ms: float = 0.0):
+        super().__init__()
+        self.rtt = rtt_ms / 1000
+        self.calls = 0
+        self.sent = 0
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+
+    def feed(self, updates: List[dict]):
+        """Makes updates available to getUpdates."""
+        for update in updates:
+            self._updates.put_nowait(update)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.calls += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        if isinstance(method, GetUpdates):
+            return await self._get_updates(method)
+        if isinstance(method, GetMe):
+            return User(id=42, is_bot=True, first_name="Stub", username="stub_bot")
+        if isinstance(method, SendMessage):
+            self.sent += 1
+            return Message(message_id=next(self._message_ids), date=int(time.time()),
+                           chat=Chat(id=int(method.chat_id), type="private"), text=method.text)
+        return True
+
+    async def _get_updates(self, method: GetUpdates) -> List[Update]:
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self._updates.get(), method.timeout or 0.1))
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < (method.limit or 100) and not self._updates.empty():
+            batch.append(self._updates.get_nowait())
+        return [Update.model_validate(update) for update in batch]
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+def stub_bot(rtt_ms: float = 0.0) -> Bot:
+    return Bot(token=STUB_TOKEN, session=StubSession(rtt_ms))
+
+def recorded_updates(path: Optional[str] = None, count: int = 1000, users: int = 200, seed: int = 0) -> Iterator[dict]:
+    """
+    Updates from a JSONL file, renumbered in order, or count synthetic
+    command messages from `users` different users.
+    """
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for update_id, line in enumerate(filter(str.strip, f), 1):
+                yield {**json.loads(line), "update_id": update_id}
+        return
+    rng = random.Random(seed)
+    for update_id in range(1, count + 1):
+        user_id = 1_000_000 + rng.randrange(users)
+        sender = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": rng.choice(COMMANDS),
+                "chat": {"id": user_id, "type": "private"}, "from": sender,
+            },
+        }
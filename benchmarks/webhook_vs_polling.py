@@ -0,0 +1,133 @@
+"""
+Long polling versus the webhook server on the same replayed traffic.
+
+Updates (recorded JSONL, or a synthetic command mix) are released at --rate
+per second through the real dispatcher and handlers, with a StubSession in
+place of Telegram (--rtt-ms simulates the Bot API round trip). For polling,
+released updates wait for the next getUpdates; for the webhook, they are
+POSTed to a local server with the secret header. Latency runs from release
+until the dispatcher finished handling the update.
+
+    python -m benchmarks.webhook_vs_polling --updates 3000 --rate 500
+    python -m benchmarks.webhook_vs_polling --replay updates.jsonl
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+import numpy as np
+
+import db
+import webhook
+from benchmarks.telegram_stub import recorded_updates, stub_bot
+
+class Recorder:
+    """Outer middleware timing each update from release to handled."""
+
+    def __init__(self):
+        self.released = {}
+        self.latencies = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            released = self.released.pop(event.update_id, None)
+            if released is not None:
+                self.latencies.append(time.perf_counter() - released)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+async def release(updates, rate, send, recorder):
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        recorder.released[update["update_id"]] = time.perf_counter()
+        await send(update)
+
+def report(name, recorder, elapsed):
+    latencies = np.array(recorder.latencies) * 1000
+    print(f"{name:<10} {len(latencies) / elapsed:8.0f} updates/s  p50={np.percentile(latencies, 50):7.1f}ms  "
+          f"p99={np.percentile(latencies, 99):7.1f}ms  max={latencies.max():7.1f}ms")
+
+async def run_polling(dp, recorder, updates, args):
+    bot = stub_bot(args.rtt_ms)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False, polling_timeout=1))
+    async def send(update):
+        bot.session.feed([update])
+
+    started = time.perf_counter()
+    await release(updates, args.rate, send, recorder)
+    await asyncio.wait_for(recorder.done.wait(), 120)
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    report("polling", recorder, elapsed)
+
+async def run_webhook(dp, recorder, updates, args):
+    bot = stub_bot(args.rtt_ms)
+    stop = asyncio.Event()
+    server = asyncio.create_task(webhook.run_webhook(dp, bot, host="127.0.0.1", port=args.port, secret="bench", stop=stop))
+    await asyncio.sleep(0.5)
+    url = f"http://127.0.0.1:{args.port}{webhook.WEBHOOK_PATH}"
+    rejected = 0
+    async with aiohttp.ClientSession(headers={webhook.SECRET_HEADER: "bench"}) as session:
+        async def post(update):
+            nonlocal rejected
+            async with session.post(url, json=update) as response:
+                if response.status != 200:
+                    rejected += 1
+                    recorder.expected -= 1
+
+        pending = set()
+        async def send(update):
+            task = asyncio.create_task(post(update))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        started = time.perf_counter()
+        await release(updates, args.rate, send, recorder)
+        await asyncio.gather(*pending)
+        await asyncio.wait_for(recorder.done.wait(), 120)
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await server
+    report("webhook", recorder, elapsed)
+    if rejected:
+        print(f"           {rejected} updates rejected with 503 (queue full)")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=500, help="updates released per second")
+    parser.add_argument("--rtt-ms", type=float, default=30, help="simulated Bot API round trip")
+    parser.add_argument("--replay", help="JSONL file of recorded updates")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--db", default="bench_webhook.db")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    db.init_db()
+    from main import dp # handlers and middlewares exactly as the bot registers them
+
+    updates = list(recorded_updates(args.replay, args.updates, args.users))
+    print(f"{len(updates)} updates at {args.rate:.0f}/s, Bot API round trip {args.rtt_ms:.0f}ms")
+    for name, run in (("polling", run_polling), ("webhook", run_webhook)):
+        recorder = Recorder()
+        recorder.expected = len(updates)
+        dp.update.outer_middleware(recorder)
+        await run(dp, recorder, updates, args)
+        dp.update.outer_middleware.unregister(recorder)
+
+if __name__ == "__main__":
+    asyncio.run(main())
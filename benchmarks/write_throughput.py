@@ -0,0 +1,70 @@
+"""
+Write throughput of a signup burst: one commit per write (each call on the
+writer thread, as before group commit) versus the async_db group-commit queue.
+
+Each simulated user saves a profile and sets a language, with `--concurrency`
+users writing at once. `--synchronous FULL` makes every commit fsync, which is
+where merging commits matters most.
+
+    python -m benchmarks.write_throughput --users 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import async_db
+import db
+from db import UserProfile
+
+def profile(user_id: int) -> UserProfile:
+    return UserProfile(
+        user_id=user_id, username=f"user{user_id}", university="MSU", year_course="2nd Year",
+        skills=["Python", "SQL"], interests=["AI"], goals="Networking", last_updated="",
+        embedding=os.urandom(780),
+    )
+
+async def per_write_commit(user_id: int):
+    await async_db.run_write(db.save_user_profile, profile(user_id))
+    await async_db.run_write(db.set_user_language, user_id, "ru")
+
+async def group_commit(user_id: int):
+    await async_db.save_user_profile(profile(user_id))
+    await async_db.set_user_language(user_id, "ru")
+
+async def run(name, write, offset, users, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            await write(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(offset + i) for i in range(users)))
+    await async_db.flush() # queued writes count once they are committed
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22} {users * 2 / elapsed:9.0f} writes/s  ({elapsed:.2f}s for {users * 2} writes)")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench_writes.db")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--synchronous", choices=("NORMAL", "FULL"), default="NORMAL")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.DB_PATH = args.db
+    db.PRAGMAS = tuple(p for p in db.PRAGMAS if "synchronous" not in p) + (f"PRAGMA synchronous={args.synchronous}",)
+    db.init_db()
+
+    await run("per-write commit", per_write_commit, 0, args.users, args.concurrency)
+    await run("group commit", group_commit, args.users, args.users, args.concurrency)
+    async_db.DB_WRITE_DURABILITY = "queued"
+    await run("group commit (queued)", group_commit, 2 * args.users, args.users, args.concurrency)
+    await async_db.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
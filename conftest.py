@@ -0,0 +1,16 @@
+import pytest
+
+import async_db
+import db
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh database file; async_db starts a new write loop in each asyncio.run."""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(async_db, "_write_queue", None)
+    monkeypatch.setattr(async_db, "_writer_task", None)
+    async_db._profile_cache.clear()
+    async_db._language_cache.clear()
+    db.init_db()
+    yield db.DB_PATH
+    db.close_connections()
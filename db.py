@@ -1,9 +1,11 @@
 import sqlite3
 import json
 import logging
+import threading
+import unicodedata
 from datetime import datetime
-from dataclasses import dataclass, asdict
-from typing import List, Optional
+from dataclasses import dataclass, asdict, replace
+from typing import Callable, Dict, List, Optional, Tuple
 
 @dataclass
 class UserProfile:
@@ -18,11 +20,70 @@ class UserProfile:
     embedding: Optional[bytes] = None
     is_blocked: bool = False
     language: str = "en"
+    model_version: Optional[str] = None # model that produced embedding
 
 DB_PATH = "bot_database.db"
 
+# Applied to every connection. WAL lets readers run alongside the writer;
+# synchronous=NORMAL is durable in WAL mode except for the last commits on power loss.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000", # 16 MB page cache
+    "PRAGMA mmap_size=268435456", # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's long-lived connection to DB_PATH, opening it on
+    first use. Each thread (event loop or executor worker) gets its own
+    connection, so they are safe to use from a thread pool. Prepared
+    statements are reused through the connection's statement cache.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn, _local.path = conn, DB_PATH
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Closes every connection opened by get_connection; called on shutdown."""
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to close database connection: {e}")
+        _connections.clear()
+    _local.__dict__.clear()
+
+# Callables invoked as listener(event, user_id, profile) after a profile write.
+# Events are "save", "delete" and "block"; profile is only set for "save".
+_profile_listeners: List[Callable] = []
+
+def add_profile_listener(listener: Callable):
+    if listener not in _profile_listeners:
+        _profile_listeners.append(listener)
+
+def _notify_profile_listeners(event: str, user_id: int, profile: Optional["UserProfile"] = None):
+    for listener in _profile_listeners:
+        try:
+            listener(event, user_id, profile)
+        except Exception as e:
+            logging.error(f"Profile listener {listener} failed on {event} for {user_id}: {e}")
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -36,173 +97,461 @@ def init_db():
             last_updated TEXT,
             embedding BLOB,
             is_blocked BOOLEAN DEFAULT 0,
-            language TEXT DEFAULT 'en'
+            language TEXT DEFAULT 'en',
+            model_version TEXT
         )
     ''')
+    # Databases from before embeddings were versioned lack model_version; their
+    # rows read as stale (NULL) until the background re-embedding converts them
+    if "model_version" not in {row[1] for row in cursor.execute('PRAGMA table_info(users)')}:
+        cursor.execute('ALTER TABLE users ADD COLUMN model_version TEXT')
+        logging.info("Added users.model_version; existing embeddings will be re-embedded")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_model_version ON users (model_version)')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS rate_limits (
             user_id INTEGER,
             command TEXT,
             last_used_at TEXT,
+            used REAL,
+            since REAL,
             PRIMARY KEY (user_id, command)
         )
     ''')
+    # Wizard (FSM) sessions, see fsm_storage.py; data is packed JSON
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_sessions (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data BLOB,
+            updated_at REAL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fsm_sessions_updated ON fsm_sessions (updated_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key TEXT PRIMARY KEY,
+            embedding BLOB,
+            last_used REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_neighbors (
+            user_id INTEGER,
+            neighbor_id INTEGER,
+            score REAL,
+            PRIMARY KEY (user_id, neighbor_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_neighbors_score ON user_neighbors (user_id, score DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_neighbors_neighbor ON user_neighbors (neighbor_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS neighbor_state (
+            user_id INTEGER PRIMARY KEY,
+            updated_at TEXT
+        )
+    ''')
+    # Normalized skills/interests; users.skills and users.interests keep the
+    # JSON lists as entered, these tables make them queryable by term
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS terms (
+            term_id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            label TEXT NOT NULL,
+            UNIQUE (kind, name)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_terms (
+            user_id INTEGER NOT NULL,
+            term_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, term_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_terms_term ON user_terms (term_id, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_university ON users (university)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_progress (
+            source TEXT PRIMARY KEY,
+            records INTEGER,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS neighbor_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
     conn.commit()
-    conn.close()
     logging.info("Database initialized with reporting and rate limiting support")
 
+def run_writes(writes: List[Tuple[Callable, tuple]]) -> List[Optional[Exception]]:
+    """
+    Applies (write_fn, args) pairs in one transaction, so the whole batch costs
+    a single commit. Each write_fn(conn, *args) runs its statements and returns
+    the profile event to announce, a list of them, or None; listeners are
+    notified after the commit. If the batch fails it is replayed one write per transaction, so a
+    bad write fails alone. Returns the exception of each write, or None.
+    """
+    conn = get_connection()
+    events = []
+    try:
+        with conn:
+            for write_fn, args in writes:
+                events.append(write_fn(conn, *args))
+        errors = [None] * len(writes)
+    except Exception:
+        if len(writes) == 1:
+            raise
+        events, errors = [], []
+        for write_fn, args in writes:
+            try:
+                with conn:
+                    events.append(write_fn(conn, *args))
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+
+    for event in events:
+        for profile_event in (event if isinstance(event, list) else [event] if event else []):
+            _notify_profile_listeners(*profile_event)
+    return errors
+
+def _report_user(conn: sqlite3.Connection, user_id: int):
+    conn.execute('UPDATE users SET is_blocked = 1 WHERE user_id = ?', (user_id,))
+    return "block", user_id, None
+
 def report_user(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_blocked = 1 WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    run_writes([(_report_user, (user_id,))])
 
-def check_rate_limit(user_id: int, command: str, limit_seconds: int) -> Optional[int]:
-    """Returns seconds remaining if limited, else None."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT last_used_at FROM rate_limits WHERE user_id = ? AND command = ?', (user_id, command))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        last_used = datetime.fromisoformat(row[0])
-        elapsed = (datetime.now() - last_used).total_seconds()
-        if elapsed < limit_seconds:
-            return int(limit_seconds - elapsed)
-    return None
-
-def update_rate_limit(user_id: int, command: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO rate_limits (user_id, command, last_used_at)
-        VALUES (?, ?, ?)
-    ''', (user_id, command, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+def load_rate_limits() -> List[Tuple[int, str, float, float]]:
+    """
+    Returns saved limiter state as (user_id, command, used, since). Rows written
+    before the limiter kept state count as one use at last_used_at.
+    """
+    rows = get_connection().execute('SELECT user_id, command, used, since, last_used_at FROM rate_limits').fetchall()
+    state = []
+    for user_id, command, used, since, last_used_at in rows:
+        if since is None and last_used_at:
+            used, since = 1.0, datetime.fromisoformat(last_used_at).timestamp()
+        state.append((user_id, command, used, since))
+    return state
+
+def _save_rate_limits(conn: sqlite3.Connection, rows: List[Tuple[int, str, float, float]]):
+    conn.executemany('''
+        INSERT OR REPLACE INTO rate_limits (user_id, command, last_used_at, used, since)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(user_id, command, datetime.fromtimestamp(since).isoformat(), used, since) for user_id, command, used, since in rows])
+
+def save_rate_limits(rows: List[Tuple[int, str, float, float]]):
+    """Stores (user_id, command, used, since) limiter state in one transaction."""
+    run_writes([(_save_rate_limits, (rows,))])
+
+def get_fsm_session(key: str) -> Optional[Tuple[Optional[str], bytes, float]]:
+    """Returns the stored (state, packed data, updated_at) of an FSM key, or None."""
+    return get_connection().execute('SELECT state, data, updated_at FROM fsm_sessions WHERE key = ?', (key,)).fetchone()
+
+def _save_fsm_session(conn: sqlite3.Connection, key: str, state: Optional[str], data: Optional[bytes], updated_at: float):
+    # An empty session (no state, no data) is stored as no row
+    if state is None and data is None:
+        conn.execute('DELETE FROM fsm_sessions WHERE key = ?', (key,))
+    else:
+        conn.execute('INSERT OR REPLACE INTO fsm_sessions (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+                     (key, state, data, updated_at))
+
+def delete_stale_fsm_sessions(before: float) -> int:
+    """Deletes FSM sessions last changed before the given time; returns how many."""
+    conn = get_connection()
+    with conn:
+        return conn.execute('DELETE FROM fsm_sessions WHERE updated_at < ?', (before,)).rowcount
+
+def canonical_term(term: str) -> str:
+    """Case- and whitespace-insensitive form of a skill or interest."""
+    return " ".join(unicodedata.normalize("NFKC", term).casefold().split())
+
+def sync_user_terms(conn: sqlite3.Connection, user_id: int, skills: List[str], interests: List[str]):
+    """
+    Replaces the user's rows in user_terms. Runs inside the caller's transaction.
+    """
+    conn.execute('DELETE FROM user_terms WHERE user_id = ?', (user_id,))
+    terms = {}
+    for kind, values in (("skills", skills), ("interests", interests)):
+        for value in values or []:
+            name = canonical_term(value)
+            if name:
+                terms.setdefault((kind, name), value.strip())
+    if not terms:
+        return
+    conn.executemany('INSERT OR IGNORE INTO terms (kind, name, label) VALUES (?, ?, ?)',
+                     [(kind, name, label) for (kind, name), label in terms.items()])
+    conn.executemany('''
+        INSERT OR IGNORE INTO user_terms (user_id, term_id)
+        SELECT ?, term_id FROM terms WHERE kind = ? AND name = ?
+    ''', [(user_id, kind, name) for kind, name in terms])
 
 def get_stats():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT skills FROM users')
-    all_skills = cursor.fetchall()
-    
-    skill_counts = {}
-    for row in all_skills:
-        skills = json.loads(row[0])
-        for skill in skills:
-            skill_counts[skill] = skill_counts.get(skill, 0) + 1
-            
-    top_skill = max(skill_counts, key=skill_counts.get) if skill_counts else "None"
-    
-    conn.close()
+    conn = get_connection()
+    total_users = conn.execute('SELECT COUNT(*) FROM users WHERE skills IS NOT NULL').fetchone()[0]
+
+    row = conn.execute('''
+        SELECT t.label FROM user_terms ut JOIN terms t ON t.term_id = ut.term_id
+        WHERE t.kind = 'skills'
+        GROUP BY ut.term_id ORDER BY COUNT(*) DESC, t.label LIMIT 1
+    ''').fetchone()
+    top_skill = row[0] if row else "None"
+
+    universities = conn.execute('''
+        SELECT university, COUNT(*) FROM users
+        WHERE university IS NOT NULL
+        GROUP BY university ORDER BY COUNT(*) DESC, university
+    ''').fetchall()
+
     return {
         "total_users": total_users,
-        "top_skill": top_skill
+        "top_skill": top_skill,
+        "universities": universities
     }
 
-def save_user_profile(profile: UserProfile):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Convert lists to JSON strings
-    skills_json = json.dumps(profile.skills)
-    interests_json = json.dumps(profile.interests)
-    
-    cursor.execute('''
+def get_users_with_term(term: str, kind: str = "skills") -> List[int]:
+    """Ids of unblocked users listing the given skill (or interest), matched case-insensitively."""
+    rows = get_connection().execute('''
+        SELECT ut.user_id FROM terms t
+        JOIN user_terms ut ON ut.term_id = t.term_id
+        JOIN users u ON u.user_id = ut.user_id
+        WHERE t.kind = ? AND t.name = ? AND u.is_blocked = 0
+    ''', (kind, canonical_term(term))).fetchall()
+    return [row[0] for row in rows]
+
+def _save_user_profiles(conn: sqlite3.Connection, profiles: List[UserProfile]):
+    now = datetime.now().isoformat()
+    conn.executemany('''
         INSERT OR REPLACE INTO users 
-        (user_id, username, university, year_course, skills, interests, goals, last_updated, embedding, is_blocked, language)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+        (user_id, username, university, year_course, skills, interests, goals, last_updated, embedding, is_blocked, language, model_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
         profile.user_id,
         profile.username,
         profile.university,
         profile.year_course,
-        skills_json,
-        interests_json,
+        # Convert lists to JSON strings
+        json.dumps(profile.skills),
+        json.dumps(profile.interests),
         profile.goals,
-        datetime.now().isoformat(),
+        now,
         profile.embedding,
         profile.is_blocked,
-        profile.language
-    ))
-    
-    conn.commit()
-    conn.close()
+        profile.language,
+        profile.model_version if profile.embedding else None
+    ) for profile in profiles])
+    for profile in profiles:
+        sync_user_terms(conn, profile.user_id, profile.skills, profile.interests)
+    # Listeners get the stored timestamp (the embedding store logs it)
+    return [("save", profile.user_id, replace(profile, last_updated=now)) for profile in profiles]
+
+def _save_user_profile(conn: sqlite3.Connection, profile: UserProfile):
+    return _save_user_profiles(conn, [profile])
+
+def save_user_profile(profile: UserProfile):
+    run_writes([(_save_user_profile, (profile,))])
+
+def save_user_profiles(profiles: List[UserProfile], progress: Optional[Tuple[str, int]] = None):
+    """
+    Saves many profiles with one executemany in a single transaction. If
+    progress is given as (source, records), the import checkpoint is stored
+    in the same transaction.
+    """
+    writes = [(_save_user_profiles, (profiles,))]
+    if progress:
+        writes.append((_set_import_progress, progress))
+    for error in run_writes(writes):
+        if error is not None:
+            raise error
+
+def _import_user_profiles(conn: sqlite3.Connection, profiles: List[UserProfile]):
+    """
+    Upserts imported profiles. Unlike _save_user_profiles it keeps an existing
+    user's is_blocked flag, and their language unless the profile sets one
+    (language None), so re-importing a source undoes no reports or choices.
+    """
+    now = datetime.now().isoformat()
+    conn.executemany('''
+        INSERT INTO users
+        (user_id, username, university, year_course, skills, interests, goals, last_updated, embedding, language, model_version)
+        VALUES (:user_id, :username, :university, :year_course, :skills, :interests, :goals, :now, :embedding,
+                COALESCE(:language, 'en'), :model_version)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username, university = excluded.university, year_course = excluded.year_course,
+            skills = excluded.skills, interests = excluded.interests, goals = excluded.goals,
+            last_updated = excluded.last_updated, embedding = excluded.embedding,
+            language = COALESCE(:language, users.language), model_version = excluded.model_version
+    ''', [dict(
+        user_id=profile.user_id,
+        username=profile.username,
+        university=profile.university,
+        year_course=profile.year_course,
+        skills=json.dumps(profile.skills),
+        interests=json.dumps(profile.interests),
+        goals=profile.goals,
+        now=now,
+        embedding=profile.embedding,
+        language=profile.language,
+        model_version=profile.model_version if profile.embedding else None,
+    ) for profile in profiles])
+    for profile in profiles:
+        sync_user_terms(conn, profile.user_id, profile.skills, profile.interests)
+    # Listeners need the kept flags, so they get the stored rows
+    events = []
+    for start in range(0, len(profiles), 500):
+        ids = [profile.user_id for profile in profiles[start:start + 500]]
+        rows = conn.execute(f'SELECT {PROFILE_COLUMNS} FROM users WHERE user_id IN ({",".join("?" * len(ids))})', ids).fetchall()
+        events.extend(("save", row[0], _row_to_profile(row)) for row in rows)
+    return events
+
+def import_user_profiles(profiles: List[UserProfile], progress: Optional[Tuple[str, int]] = None):
+    """Like save_user_profiles, through _import_user_profiles."""
+    writes = [(_import_user_profiles, (profiles,))]
+    if progress:
+        writes.append((_set_import_progress, progress))
+    for error in run_writes(writes):
+        if error is not None:
+            raise error
+
+def _set_import_progress(conn: sqlite3.Connection, source: str, records: int):
+    conn.execute('INSERT OR REPLACE INTO import_progress (source, records, updated_at) VALUES (?, ?, ?)',
+                 (source, records, datetime.now().isoformat()))
+
+def get_import_progress(source: str) -> int:
+    """Number of records of source already imported (see import_profiles.py)."""
+    row = get_connection().execute('SELECT records FROM import_progress WHERE source = ?', (source,)).fetchone()
+    return row[0] if row else 0
+
+# Explicit column list so rows can be decoded positionally by _row_to_profile
+PROFILE_COLUMNS = "user_id, username, university, year_course, skills, interests, goals, last_updated, embedding, is_blocked, language, model_version"
+# Same positions, without the embedding blob, for profiles that are only displayed
+DISPLAY_COLUMNS = PROFILE_COLUMNS.replace("embedding", "NULL")
+
+def _row_to_profile(row) -> UserProfile:
+    return UserProfile(
+        user_id=row[0],
+        username=row[1],
+        university=row[2],
+        year_course=row[3],
+        skills=json.loads(row[4] or "[]"),
+        interests=json.loads(row[5] or "[]"),
+        goals=row[6],
+        last_updated=row[7],
+        embedding=row[8],
+        is_blocked=bool(row[9]),
+        language=row[10] or "en",
+        model_version=row[11]
+    )
 
 def get_user_profile(user_id: int) -> Optional[UserProfile]:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return UserProfile(
-            user_id=row[0],
-            username=row[1],
-            university=row[2],
-            year_course=row[3],
-            skills=json.loads(row[4]),
-            interests=json.loads(row[5]),
-            goals=row[6],
-            last_updated=row[7],
-            embedding=row[8],
-            is_blocked=bool(row[9]),
-            language=row[10] if len(row) > 10 else "en"
-        )
-    return None
+    # Rows created by set_user_language alone hold no profile yet
+    row = get_connection().execute(f'SELECT {PROFILE_COLUMNS} FROM users WHERE user_id = ? AND skills IS NOT NULL', (user_id,)).fetchone()
+    return _row_to_profile(row) if row else None
 
-def get_all_profiles_except(user_id: int) -> List[UserProfile]:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id != ? AND is_blocked = 0', (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    
-    profiles = []
-    for row in rows:
-        profiles.append(UserProfile(
-            user_id=row[0],
-            username=row[1],
-            university=row[2],
-            year_course=row[3],
-            skills=json.loads(row[4]),
-            interests=json.loads(row[5]),
-            goals=row[6],
-            last_updated=row[7],
-            embedding=row[8],
-            is_blocked=bool(row[9]),
-            language=row[10] if len(row) > 10 else "en"
-        ))
+def get_profiles_by_ids(user_ids: List[int]) -> Dict[int, UserProfile]:
+    """
+    Hydrates the given users in one query, e.g. the page of matches being shown.
+    Embeddings are not loaded. Users without a profile are left out.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    profiles = {}
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        rows = get_connection().execute(
+            f'SELECT {DISPLAY_COLUMNS} FROM users '
+            f'WHERE user_id IN ({",".join("?" * len(chunk))}) AND skills IS NOT NULL', chunk
+        ).fetchall()
+        profiles.update((row[0], _row_to_profile(row)) for row in rows)
     return profiles
 
+def get_all_profiles_except(user_id: int) -> List[UserProfile]:
+    rows = get_connection().execute(f'SELECT {PROFILE_COLUMNS} FROM users WHERE user_id != ? AND is_blocked = 0 AND skills IS NOT NULL', (user_id,)).fetchall()
+    return [_row_to_profile(row) for row in rows]
+
+def get_all_embeddings(model_version: Optional[str] = None) -> List[Tuple[int, bytes]]:
+    """
+    Returns (user_id, embedding) for every unblocked user that has an
+    embedding, only those produced by model_version if it is given.
+    """
+    if model_version is None:
+        return get_connection().execute('SELECT user_id, embedding FROM users WHERE is_blocked = 0 AND embedding IS NOT NULL').fetchall()
+    return get_connection().execute('SELECT user_id, embedding FROM users WHERE is_blocked = 0 AND embedding IS NOT NULL AND model_version = ?', (model_version,)).fetchall()
+
+def get_all_terms() -> List[Tuple[int, List[str], List[str]]]:
+    """Returns (user_id, skills, interests) for every unblocked user with a profile."""
+    rows = get_connection().execute('SELECT user_id, skills, interests FROM users WHERE is_blocked = 0 AND skills IS NOT NULL').fetchall()
+    return [(user_id, json.loads(skills), json.loads(interests or "[]")) for user_id, skills, interests in rows]
+
+def get_embeddings_fingerprint(model_version: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """Cheap summary of the matchable embeddings, used to detect stale on-disk indexes."""
+    if model_version is None:
+        row = get_connection().execute(
+            'SELECT COUNT(*), MAX(last_updated) FROM users WHERE is_blocked = 0 AND embedding IS NOT NULL').fetchone()
+    else:
+        # Only reads that version's rows (idx_users_model_version)
+        row = get_connection().execute(
+            'SELECT COUNT(*), MAX(last_updated) FROM users WHERE model_version = ? AND is_blocked = 0 AND embedding IS NOT NULL',
+            (model_version,)).fetchone()
+    return row[0], row[1]
+
+# Stand-in vectors from `import_profiles.py --embeddings random` are tagged random-<dim>
+_STALE_WHERE = "skills IS NOT NULL AND model_version IS NOT ? AND (? OR model_version IS NULL OR model_version NOT LIKE 'random-%')"
+
+def get_stale_profiles(model_version: str, after_id: int, limit: int, include_random: bool = False) -> List[UserProfile]:
+    """
+    Profiles whose embedding is missing or from another model, in user_id
+    order after after_id. Random stand-ins only with include_random.
+    """
+    rows = get_connection().execute(f'''
+        SELECT {PROFILE_COLUMNS} FROM users
+        WHERE user_id > ? AND {_STALE_WHERE}
+        ORDER BY user_id LIMIT ?
+    ''', (after_id, model_version, include_random, limit)).fetchall()
+    return [_row_to_profile(row) for row in rows]
+
+def count_stale_profiles(model_version: str, include_random: bool = False) -> int:
+    return get_connection().execute(f'SELECT COUNT(*) FROM users WHERE {_STALE_WHERE}',
+                                    (model_version, include_random)).fetchone()[0]
+
+def _swap_embeddings(conn: sqlite3.Connection, updates: List[Tuple[int, bytes, str, str]]):
+    """
+    Replaces (user_id, embedding, model_version, last_updated) embeddings,
+    skipping users whose profile changed since last_updated was read.
+    """
+    swapped = []
+    for user_id, embedding, model_version, last_updated in updates:
+        cursor = conn.execute('UPDATE users SET embedding = ?, model_version = ? WHERE user_id = ? AND last_updated IS ?',
+                              (embedding, model_version, user_id, last_updated))
+        if cursor.rowcount:
+            swapped.append(user_id)
+    if not swapped:
+        return None
+    rows = conn.execute(f'SELECT {PROFILE_COLUMNS} FROM users WHERE user_id IN ({",".join("?" * len(swapped))})', swapped).fetchall()
+    return [("save", row[0], _row_to_profile(row)) for row in rows]
+
+def _delete_user_profile(conn: sqlite3.Connection, user_id: int):
+    conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM rate_limits WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM user_terms WHERE user_id = ?', (user_id,))
+    return "delete", user_id, None
+
 def delete_user_profile(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM rate_limits WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    run_writes([(_delete_user_profile, (user_id,))])
 
-def set_user_language(user_id: int, lang: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _set_user_language(conn: sqlite3.Connection, user_id: int, lang: str):
     # Use INSERT OR IGNORE to create a minimal entry if user doesn't exist yet
-    cursor.execute('INSERT OR IGNORE INTO users (user_id, language) VALUES (?, ?)', (user_id, lang))
-    cursor.execute('UPDATE users SET language = ? WHERE user_id = ?', (lang, user_id))
-    conn.commit()
-    conn.close()
+    conn.execute('INSERT OR IGNORE INTO users (user_id, language) VALUES (?, ?)', (user_id, lang))
+    conn.execute('UPDATE users SET language = ? WHERE user_id = ?', (lang, user_id))
+
+def set_user_language(user_id: int, lang: str):
+    run_writes([(_set_user_language, (user_id, lang))])
 
 def get_user_language(user_id: int) -> str:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
-    row = cursor.fetchone()
-    conn.close()
+    row = get_connection().execute('SELECT language FROM users WHERE user_id = ?', (user_id,)).fetchone()
     return row[0] if row else "en"
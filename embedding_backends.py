@@ -0,0 +1,133 @@
+"""
+Text encoders behind matching.get_embeddings, chosen with EMBEDDING_BACKEND:
+
+    transformer            sentence-transformers EMBEDDING_MODEL (default)
+    transformer-quantized  the same model with int8 dynamic quantization of its
+                           linear layers and EMBED_TORCH_THREADS torch threads
+    hashing                scikit-learn HashingVectorizer over words and word
+                           pairs; no torch or model download, and well under
+                           a millisecond per text. For low-resource or test
+                           deployments.
+
+Each backend has a version naming its vector space. It is stored with every
+embedding, so switching backends makes reembed.py convert old profiles and
+matching never compares vectors from two backends.
+
+    python -m benchmarks.embedding_backends
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Type
+
+import numpy as np
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "transformer")
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "1"))
+EMBED_HASHING_DIM = int(os.getenv("EMBED_HASHING_DIM", "1024"))
+
+class EmbeddingBackend:
+    """Encodes texts into float32 vectors of one fixed vector space."""
+    version = ""
+
+    def __init__(self):
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.timings: Dict[str, float] = {} # load phases in seconds, for startup logs
+
+    def load(self):
+        """Loads the encoder once; encode() calls it, but it can be called early."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._load()
+                    self.timings["load"] = time.perf_counter() - started - self.timings.get("import", 0.0)
+                    self._loaded = True
+
+    def _load(self):
+        pass
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        self.load()
+        return np.asarray(self._encode(texts), dtype=np.float32)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class TransformerBackend(EmbeddingBackend):
+    def __init__(self, model_name: str = MODEL_NAME):
+        super().__init__()
+        self.model_name = model_name
+        # Plain model name, as stored before backends existed
+        self.version = model_name
+        self.model = None
+
+    def _load(self):
+        started = time.perf_counter()
+        # Imports torch; kept out of module import so startup stays fast
+        from sentence_transformers import SentenceTransformer
+        self.timings["import"] = time.perf_counter() - started
+        logging.info(f"Loading sentence-transformer model: {self.model_name}")
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True)
+
+class QuantizedTransformerBackend(TransformerBackend):
+    def __init__(self, model_name: str = MODEL_NAME, threads: int = EMBED_TORCH_THREADS):
+        super().__init__(model_name)
+        self.threads = threads
+        self.version = f"{model_name}:qint8"
+
+    def _load(self):
+        super()._load()
+        import torch
+        torch.set_num_threads(self.threads)
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class HashingBackend(EmbeddingBackend):
+    # Labels of build_profile_text, which every profile shares
+    PROFILE_LABELS = ["university", "skills", "interests", "goals"]
+
+    def __init__(self, dim: int = EMBED_HASHING_DIM):
+        super().__init__()
+        self.dim = dim
+        self.version = f"hashing-{dim}"
+        self.vectorizer = None
+
+    def _load(self):
+        started = time.perf_counter()
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer
+        self.timings["import"] = time.perf_counter() - started
+        # No IDF weighting: fitted document frequencies would drift as the
+        # community grows, silently changing the meaning of stored vectors
+        self.vectorizer = HashingVectorizer(
+            n_features=self.dim, ngram_range=(1, 2), alternate_sign=False, binary=True, norm="l2",
+            stop_words=sorted(ENGLISH_STOP_WORDS.union(self.PROFILE_LABELS)),
+        )
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.vectorizer.transform(texts).toarray()
+
+BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    "transformer": TransformerBackend,
+    "transformer-quantized": QuantizedTransformerBackend,
+    "hashing": HashingBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> EmbeddingBackend:
+    """The process-wide backend selected by EMBEDDING_BACKEND (not loaded yet)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if EMBEDDING_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown EMBEDDING_BACKEND {EMBEDDING_BACKEND!r}, expected one of {', '.join(BACKENDS)}")
+                _backend = BACKENDS[EMBEDDING_BACKEND]()
+    return _backend
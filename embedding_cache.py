@@ -0,0 +1,107 @@
+"""
+Persistent content-addressed embedding cache.
+
+Entries are keyed by a hash of the model identifier, storage dtype and the
+normalized text sent to the model, so unchanged or duplicate profile texts
+never reach the model twice. The table is bounded to EMBED_CACHE_SIZE entries
+and evicts the least recently used ones.
+
+Lookups only read. Their last-used times are collected in memory and written
+in one transaction once TOUCH_BATCH_SIZE keys or TOUCH_INTERVAL seconds have
+accumulated, or with the next put_many, so cache hits don't each commit.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Tuple
+
+import db
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000")) # 0 disables the cache
+
+TOUCH_BATCH_SIZE = 256
+TOUCH_INTERVAL = 60.0
+
+# Guards the counters and pending touches; lookups run on several threads
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+_touched: Dict[str, float] = {} # key -> last used, not yet written
+_touched_since = 0.0
+
+def normalize_text(text: str) -> str:
+    """Canonical form of an embedding input: NFKC with collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def cache_key(model_id: str, dtype: str, normalized_text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{dtype}\0{normalized_text}".encode("utf-8")).hexdigest()
+
+def get_many(keys: Iterable[str]) -> Dict[str, bytes]:
+    """Returns the cached embeddings among keys and marks them as recently used."""
+    global _hits, _misses, _touched_since
+    keys = list(dict.fromkeys(keys))
+    if not keys or EMBED_CACHE_SIZE <= 0:
+        return {}
+
+    conn = db.get_connection()
+    found = {}
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        found.update(conn.execute(f'SELECT key, embedding FROM embedding_cache WHERE key IN ({",".join("?" * len(chunk))})', chunk).fetchall())
+
+    now = time.time()
+    with _lock:
+        _hits += len(found)
+        _misses += len(keys) - len(found)
+        if found and not _touched:
+            _touched_since = now
+        _touched.update((key, now) for key in found)
+        due = len(_touched) >= TOUCH_BATCH_SIZE or (_touched and now - _touched_since >= TOUCH_INTERVAL)
+    if due:
+        flush_touches()
+    return found
+
+def _take_touches() -> List[Tuple[float, str]]:
+    with _lock:
+        rows = [(last_used, key) for key, last_used in _touched.items()]
+        _touched.clear()
+    return rows
+
+def flush_touches():
+    """Writes the collected last-used times in one transaction."""
+    rows = _take_touches()
+    if rows:
+        conn = db.get_connection()
+        with conn:
+            conn.executemany('UPDATE embedding_cache SET last_used = ? WHERE key = ?', rows)
+
+def stats() -> dict:
+    with _lock:
+        return {"hits": _hits, "misses": _misses, "pending_touches": len(_touched)}
+
+def put_many(items: List[Tuple[str, bytes]]):
+    """
+    Stores (key, embedding) pairs, with the pending last-used times, then
+    evicts least recently used entries over the bound.
+    """
+    if not items or EMBED_CACHE_SIZE <= 0:
+        return
+    conn = db.get_connection()
+    now = time.time()
+    touches = _take_touches()
+    with conn:
+        conn.executemany('UPDATE embedding_cache SET last_used = ? WHERE key = ?', touches)
+        conn.executemany('INSERT OR REPLACE INTO embedding_cache (key, embedding, last_used) VALUES (?, ?, ?)',
+                         [(key, embedding, now) for key, embedding in items])
+        excess = conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0] - EMBED_CACHE_SIZE
+        if excess > 0:
+            conn.execute('''
+                DELETE FROM embedding_cache WHERE key IN (
+                    SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?
+                )
+            ''', (excess,))
+            logging.info(f"Embedding cache evicted {excess} entries")
@@ -0,0 +1,147 @@
+"""
+Micro-batching embedding service.
+
+Handlers await embed_text() instead of calling the model directly. Requests
+that arrive within EMBED_MAX_WAIT_MS of each other are encoded together in one
+model call on a worker thread, so the event loop never blocks on encoding.
+
+warm_up() loads the backend and runs a first encode in the background at
+startup. Until it finishes, is_ready() is False and texts queue behind it.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import embedding_cache
+from embedding_backends import get_backend
+from matching import get_embeddings
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = int(os.getenv("EMBED_MAX_WAIT_MS", "20"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+class EmbeddingService:
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, max_wait_ms: int = EMBED_MAX_WAIT_MS,
+                 workers: int = EMBED_WORKERS, encode=get_embeddings):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.workers = max(1, workers)
+        self._encode = encode
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._collectors: List[asyncio.Task] = []
+        self._ready = asyncio.Event()
+        self._ready.set() # cleared while warm_up() runs
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="embed")
+        # One collector per worker, so up to `workers` batches encode in parallel
+        self._collectors = [asyncio.create_task(self._collect()) for _ in range(self.workers)]
+        logging.info(f"Embedding service started: batch_size={self.batch_size}, "
+                     f"max_wait={self.max_wait * 1000:.0f}ms, workers={self.workers}")
+
+    def is_ready(self) -> bool:
+        """False while the backend is still loading; embed() calls then wait for it."""
+        return self._ready.is_set()
+
+    async def warm_up(self) -> dict:
+        """
+        Loads the backend and encodes a dummy text on a worker thread. Returns
+        the phase timings in seconds; failures are logged, and encoding then
+        retries the load as before.
+        """
+        self.start()
+        self._ready.clear()
+        backend = get_backend()
+        started = time.perf_counter()
+        timings = {}
+        try:
+            timings = await asyncio.get_running_loop().run_in_executor(self._executor, self._warm, backend)
+            logging.info(f"Embedding backend {backend.version} ready in {time.perf_counter() - started:.2f}s ("
+                         + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()) + ")")
+        except Exception as e:
+            logging.error(f"Embedding backend warm-up failed after {time.perf_counter() - started:.2f}s: {e}")
+        finally:
+            self._ready.set()
+        return timings
+
+    @staticmethod
+    def _warm(backend) -> dict:
+        backend.load()
+        started = time.perf_counter()
+        backend.encode(["warm-up"])
+        return {**backend.timings, "first encode": time.perf_counter() - started}
+
+    async def embed(self, text: str) -> Optional[bytes]:
+        """Returns the encoded embedding for text, or None on failure."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            await self._ready.wait()
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self._encode, texts)
+            except Exception as e:
+                logging.error(f"Embedding batch failed: {e}")
+                results = [None] * len(batch)
+            logging.info(f"Encoded batch of {len(batch)} in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def close(self):
+        """Waits for queued texts to be encoded, then stops the workers."""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for task in self._collectors:
+            task.cancel()
+        await asyncio.gather(*self._collectors, return_exceptions=True)
+        # Last-used times of cache hits are written in batches; write the rest
+        await asyncio.get_running_loop().run_in_executor(self._executor, embedding_cache.flush_touches)
+        self._executor.shutdown(wait=True)
+        self._queue, self._executor, self._collectors = None, None, []
+
+_service: Optional[EmbeddingService] = None
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        _service = EmbeddingService()
+    return _service
+
+async def embed_text(text: str) -> Optional[bytes]:
+    return await get_embedding_service().embed(text)
+
+def embeddings_ready() -> bool:
+    return get_embedding_service().is_ready()
+
+async def close_embedding_service():
+    if _service is not None:
+        await _service.close()
@@ -0,0 +1,268 @@
+"""
+Shared on-disk embedding matrix for running several bot processes.
+
+Without it, every process decodes all of users.embedding into its own private
+matrix on startup. With EMBEDDING_STORE_DIR set, the current model's
+normalized embeddings live in a directory shared by all processes on a host:
+
+    meta.json        generation, dimension, row count, newest last_updated
+    ids-<gen>.npy    user ids, one per row, with spare rows at the end
+    matrix-<gen>.npy float32 rows in the same order
+    log-<gen>        upserts and deletes since the generation was written
+
+Each process memory-maps the .npy files copy-on-write, so the rows are shared
+through the page cache and only rows a process changes become private. Profile
+events are appended to the log (under a file lock), and every process replays
+the log before matching, so all of them see every save, delete and block.
+Once the log outgrows EMBEDDING_STORE_COMPACT_RATIO of the matrix, the process
+that appended last writes the next generation and the others remap it.
+
+On startup the store is checked against the database; it is rebuilt from the
+users table if it is missing, from another model, or older than the table
+(e.g. after an offline import). Inspect or maintain it with:
+
+    python embedding_store.py info|compact|rebuild
+
+Cross-process locking uses fcntl, so on platforms without it the store only
+supports a single process.
+"""
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import numpy as np
+
+from db import get_embeddings_fingerprint
+from matching import decode_embedding, MODEL_VERSION
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "")
+EMBEDDING_STORE_COMPACT_RATIO = float(os.getenv("EMBEDDING_STORE_COMPACT_RATIO", "0.25"))
+SPARE_ROWS = 1024 # upserts a process can take before its copy of the arrays has to grow
+
+# op (1 upsert, 0 delete), user_id, vector dimension, last_updated; then the vector
+RECORD = struct.Struct("<BqI32s")
+UPSERT, DELETE = 1, 0
+
+class EmbeddingStore:
+    def __init__(self, path: str, model_version: str = MODEL_VERSION):
+        self.path = path
+        self.model_version = model_version
+        self.engine = None
+        self.generation = 0
+        self.last_updated = ""
+        self._offset = 0 # bytes of the log already applied
+        self._meta_mtime = None
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, name: str, generation: Optional[int] = None) -> str:
+        return os.path.join(self.path, name if generation is None else f"{name}-{generation}{'.npy' if name != 'log' else ''}")
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock, open(self._file("lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def attach(self, engine, load: Callable[[], None]):
+        """
+        Maps the store into engine and replays the log. load fills engine
+        from the database; it is only called when the store must be rebuilt.
+        """
+        with self._file_lock():
+            self.engine = engine
+            meta = self._read_meta()
+            self.generation = meta["generation"] if meta else 0
+            if meta is None or meta.get("model_version") != self.model_version:
+                logging.info("Embedding store missing or from another model, building it")
+                self._rebuild(load)
+                return
+            self._map(meta)
+            self._replay()
+            count, last_updated = get_embeddings_fingerprint(self.model_version)
+            if count != len(engine) or (last_updated or "") > self.last_updated:
+                logging.info(f"Embedding store is stale ({len(engine)} rows, database has {count}), rebuilding")
+                self._rebuild(load)
+
+    def _rebuild(self, load: Callable[[], None]):
+        load()
+        _, last_updated = get_embeddings_fingerprint(self.model_version)
+        self.last_updated = last_updated or ""
+        self._write_generation()
+
+    def _map(self, meta: dict):
+        generation = meta["generation"]
+        ids = np.load(self._file("ids", generation), mmap_mode="c")
+        matrix = np.load(self._file("matrix", generation), mmap_mode="c")
+        self.engine.load_mapped(ids, matrix, meta["count"])
+        self.generation = generation
+        self.last_updated = meta["last_updated"]
+        self._offset = 0
+        self._meta_mtime = os.stat(self._file("meta.json")).st_mtime_ns
+
+    def _write_generation(self):
+        """Writes the engine's rows as the next generation and switches to it."""
+        ids, matrix = self.engine.arrays()
+        count = len(ids)
+        dim = self.engine.dim or 0
+        generation = self.generation + 1
+        capacity = count + max(SPARE_ROWS, count // 4)
+
+        # Written under temporary names: a leftover file of this generation
+        # may still be mapped by another process and must not be truncated
+        for name, dtype, shape, rows in (("ids", np.int64, (capacity,), ids), ("matrix", np.float32, (capacity, dim), matrix)):
+            path = self._file(name, generation)
+            out = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=shape)
+            out[:count] = rows
+            out.flush()
+            del out
+            os.replace(path + ".tmp", path)
+        open(self._file("log", generation), "wb").close()
+
+        meta = {"generation": generation, "model_version": self.model_version, "dim": dim,
+                "count": count, "last_updated": self.last_updated}
+        tmp_path = self._file("meta.json") + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._file("meta.json"))
+        self._map(meta)
+
+        # Other processes switch on their next sync; the previous generation
+        # is kept for any that are reading it right now
+        for name in os.listdir(self.path):
+            stem, _, rest = name.partition("-")
+            if stem in ("ids", "matrix", "log") and rest.split(".")[0].isdigit() and int(rest.split(".")[0]) < generation - 1:
+                os.remove(os.path.join(self.path, name))
+        logging.info(f"Embedding store generation {generation} written ({count} rows)")
+
+    def _check_generation(self):
+        """Remaps if another process compacted since the last check."""
+        try:
+            mtime = os.stat(self._file("meta.json")).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        meta = self._read_meta()
+        if meta is not None and meta["generation"] != self.generation:
+            self._map(meta)
+        else:
+            self._meta_mtime = mtime
+
+    def _replay(self):
+        """Applies log records written since the last replay."""
+        log_path = self._file("log", self.generation)
+        try:
+            if os.path.getsize(log_path) <= self._offset:
+                return
+            with open(log_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+
+        position = 0
+        # A record still being appended is left for the next replay
+        while position + RECORD.size <= len(data):
+            op, user_id, dim, last_updated = RECORD.unpack_from(data, position)
+            end = position + RECORD.size + 4 * dim
+            if end > len(data):
+                break
+            if op == UPSERT:
+                self.engine.upsert(user_id, np.frombuffer(data, dtype=np.float32, count=dim, offset=position + RECORD.size))
+                self.last_updated = max(self.last_updated, last_updated.rstrip(b"\0").decode())
+            else:
+                self.engine.remove(user_id)
+            position = end
+        self._offset += position
+
+    def sync(self):
+        """Brings the engine up to date with other processes; two stat calls if nothing changed."""
+        with self._lock:
+            self._check_generation()
+            self._replay()
+
+    def on_profile_event(self, event: str, user_id: int, profile=None):
+        vector = None
+        if (event == "save" and profile is not None and profile.embedding and not profile.is_blocked
+                and profile.model_version == self.model_version):
+            vector = decode_embedding(profile.embedding)
+        if vector is None:
+            record = RECORD.pack(DELETE, user_id, 0, b"")
+        else:
+            vector = np.ascontiguousarray(vector, dtype=np.float32)
+            record = RECORD.pack(UPSERT, user_id, len(vector), (profile.last_updated or "").encode()) + vector.tobytes()
+
+        with self._file_lock():
+            self._check_generation()
+            with open(self._file("log", self.generation), "ab") as f:
+                f.write(record)
+            self._replay()
+            if self._offset > EMBEDDING_STORE_COMPACT_RATIO * len(self.engine) * 4 * (self.engine.dim or 0) + 1_000_000:
+                self._write_generation()
+
+    def rebuild(self, engine, load: Callable[[], None]):
+        """Attaches engine to a fresh generation built from the database."""
+        with self._file_lock():
+            self.engine = engine
+            self.generation = (self._read_meta() or {}).get("generation", 0)
+            self._rebuild(load)
+
+    def compact(self):
+        """Folds the log into a new generation."""
+        with self._file_lock():
+            self._check_generation()
+            self._replay()
+            self._write_generation()
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """The process-wide store, or None unless EMBEDDING_STORE_DIR is set."""
+    global _store
+    if not EMBEDDING_STORE_DIR:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore(EMBEDDING_STORE_DIR)
+    return _store
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from match_engine import MatchEngine, load_candidates
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    store = EmbeddingStore(EMBEDDING_STORE_DIR or "embedding_store")
+    engine = MatchEngine()
+    load = lambda: engine.load_arrays(*load_candidates())
+    if command == "rebuild":
+        store.rebuild(engine, load)
+    else:
+        store.attach(engine, load)
+        if command == "compact":
+            store.compact()
+    print(f"generation {store.generation}: {len(engine)} rows, {store._offset} log bytes, model {store.model_version}")
@@ -0,0 +1,134 @@
+"""
+FSM storage for the dispatcher, kept in the bot's SQLite database.
+
+aiogram's default MemoryStorage keeps every session forever and loses them
+all on restart. SQLiteStorage writes each state or data change through the
+async_db group commit to the fsm_sessions table, so a user halfway through
+the profile wizard picks up where they left off after a restart.
+
+- Data is stored as compact JSON, zlib-compressed above FSM_COMPRESS_MIN
+  bytes; an empty session is no row at all.
+- Recently used sessions are kept, packed, in a small LRU hot layer
+  (FSM_HOT_SIZE entries), including users without a session, so the state
+  checks made on every message rarely touch the database. Everything else
+  lives only on disk, so memory stays bounded however many signups are
+  abandoned.
+- Sessions untouched for FSM_SESSION_TTL seconds count as abandoned: they
+  read as empty and are deleted every FSM_SWEEP_INTERVAL seconds.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage, StateType, StorageKey
+
+import async_db
+from ttl_cache import TTLCache
+
+FSM_SESSION_TTL = float(os.getenv("FSM_SESSION_TTL", "604800")) # 7 days
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "3600"))
+FSM_HOT_SIZE = int(os.getenv("FSM_HOT_SIZE", "2000"))
+FSM_HOT_TTL = float(os.getenv("FSM_HOT_TTL", "900"))
+FSM_COMPRESS_MIN = 256
+
+_ZLIB = b"\x01" # prefix of compressed data; JSON objects start with "{"
+
+def pack(data: Mapping[str, Any]) -> Optional[bytes]:
+    """Serializes session data; None for empty data."""
+    if not data:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= FSM_COMPRESS_MIN:
+        compressed = _ZLIB + zlib.compress(raw, 6)
+        if len(compressed) < len(raw):
+            return compressed
+    return raw
+
+def unpack(blob: Optional[bytes]) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    if blob[:1] == _ZLIB:
+        blob = zlib.decompress(blob[1:])
+    return json.loads(blob)
+
+def storage_key(key: StorageKey) -> str:
+    """"bot:chat:user", plus thread, business connection and destiny when set."""
+    text = f"{key.bot_id}:{key.chat_id}:{key.user_id}"
+    if key.thread_id is not None or key.business_connection_id is not None or key.destiny != DEFAULT_DESTINY:
+        text += f":{key.thread_id or ''}:{key.business_connection_id or ''}:{key.destiny}"
+    return text
+
+# (state, packed data, updated_at) of a key without a session
+_EMPTY = (None, None, 0.0)
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl: float = FSM_SESSION_TTL, sweep_interval: float = FSM_SWEEP_INTERVAL,
+                 hot_size: int = FSM_HOT_SIZE, hot_ttl: float = FSM_HOT_TTL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._hot = TTLCache(hot_size, hot_ttl) # key -> (state, packed data, updated_at)
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def _load(self, key: StorageKey) -> Tuple[Optional[str], Optional[bytes], float]:
+        if self._sweeper is None and self.sweep_interval > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+        name = storage_key(key)
+        session = self._hot.get(name)
+        if session is None:
+            if async_db.DB_WRITE_DURABILITY == "queued":
+                # An evicted session may still be waiting for its commit
+                await async_db.flush()
+            session = await async_db.get_fsm_session(name) or _EMPTY
+            self._hot.set(name, session)
+        if session[2] and session[2] < time.time() - self.ttl:
+            return _EMPTY
+        return session
+
+    async def _store(self, key: StorageKey, state: Optional[str], data: Optional[bytes]):
+        name = storage_key(key)
+        session = (state, data, time.time()) if state is not None or data is not None else _EMPTY
+        self._hot.set(name, session)
+        await async_db.save_fsm_session(name, *session)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        _, data, _ = await self._load(key)
+        await self._store(key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        state, _, _ = await self._load(key)
+        await self._store(key, state, pack(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        # Unpacked per call, so callers can't change the stored data in place
+        return unpack((await self._load(key))[1])
+
+    async def evict_stale(self) -> int:
+        """Deletes sessions untouched for longer than the TTL; returns how many."""
+        evicted = await async_db.delete_stale_fsm_sessions(time.time() - self.ttl)
+        if evicted:
+            logging.info(f"Evicted {evicted} abandoned FSM sessions")
+        return evicted
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.evict_stale()
+            except Exception as e:
+                logging.error(f"FSM session sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def close(self) -> None:
+        """Stops the sweeper; the sessions themselves are already committed or queued."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
@@ -1,8 +1,13 @@
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
-from db import get_stats
+import math
+
+import rate_limiter
+from async_db import get_stats, get_users_with_term
+from strings import STRINGS
+from user_context import UserContext
 
 router = Router()
 
@@ -16,12 +21,25 @@ async def cmd_report(message: Message):
     )
 
 @router.message(Command("stats"))
-async def cmd_stats(message: Message):
-    stats = get_stats()
+async def cmd_stats(message: Message, command: CommandObject, user: UserContext):
+    wait = rate_limiter.hit(user.user_id, "stats")
+    if wait:
+        lang = await user.language()
+        return await message.answer(STRINGS[lang]["rate_limited"].format(minutes=math.ceil(wait / 60)))
+
+    # "/stats Python" counts the users listing that skill
+    if command.args:
+        user_ids = await get_users_with_term(command.args)
+        await message.answer(f"🔎 {command.args.strip()}: {len(user_ids)} users")
+        return
+
+    stats = await get_stats()
+    universities = "\n".join(f"   • {university}: {count}" for university, count in stats["universities"][:5])
     response = (
         "📊 *Bot Statistics*\n\n"
         f"👥 *Total Users:* {stats['total_users']}\n"
         f"🔥 *Top Skill:* {stats['top_skill']}\n"
+        f"🏛 *Universities:*\n{universities}\n"
         "🚀 *Goal:* Connecting 100+ students by Demo Day!"
     )
     await message.answer(response, parse_mode="Markdown")
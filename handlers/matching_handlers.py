@@ -2,14 +2,34 @@ from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 import logging
+import math
+from typing import List, Tuple
 
-from db import get_user_profile, get_all_profiles_except, check_rate_limit, update_rate_limit, report_user, get_user_language
-from matching import compute_similarity
+import rate_limiter
+from async_db import get_profiles_by_ids, report_user, run_read
+from db import canonical_term
+from matching import decode_embedding
+from match_engine import find_matches
 from strings import STRINGS
+from ttl_cache import TTLCache
+from user_context import UserContext
 
 router = Router()
 
-RATE_LIMIT_SECONDS = 3600 # 1 hour
+MAX_MATCHES = 50 # Upper bound on matches ranked per request
+MATCHES_PAGE_SIZE = 5
+MATCHES_CURSOR_TTL = 600 # Seconds a ranking stays pageable before it is recomputed
+
+# user_id -> ranked [(match_id, score)] for the pages of the last /matches
+_ranked_matches = TTLCache(maxsize=10000, ttl=MATCHES_CURSOR_TTL)
+
+def shared_terms(own: List[str], other: List[str]) -> List[str]:
+    """Terms both lists contain, as the first one wrote them."""
+    other = {canonical_term(term) for term in other}
+    shared = {}
+    for term in own:
+        shared.setdefault(canonical_term(term), term)
+    return [term for key, term in shared.items() if key in other]
 
 def get_match_reason(user, match, lang: str):
     s = STRINGS[lang]
@@ -17,13 +37,14 @@ def get_match_reason(user, match, lang: str):
     if user.university.lower() == match.university.lower():
         reasons.append(s["match_reason_uni"].format(uni=user.university))
     
-    shared_skills = set(user.skills) & set(match.skills)
+    # From the profiles themselves, which are current in every worker process
+    shared_skills = shared_terms(user.skills, match.skills)
     if shared_skills:
-        reasons.append(s["match_reason_skills"].format(skills=', '.join(list(shared_skills)[:2])))
+        reasons.append(s["match_reason_skills"].format(skills=', '.join(shared_skills[:2])))
         
-    shared_interests = set(user.interests) & set(match.interests)
+    shared_interests = shared_terms(user.interests, match.interests)
     if shared_interests:
-        reasons.append(s["match_reason_interests"].format(interests=', '.join(list(shared_interests)[:2])))
+        reasons.append(s["match_reason_interests"].format(interests=', '.join(shared_interests[:2])))
         
     if not reasons:
         reasons.append(s["match_reason_default"])
@@ -31,53 +52,125 @@ def get_match_reason(user, match, lang: str):
     return " and ".join(reasons).capitalize()
 
 @router.message(Command("matches"))
-async def cmd_matches(message: Message):
-    await run_matches(message, message.from_user.id)
+async def cmd_matches(message: Message, user: UserContext):
+    await run_matches(message, user)
 
-async def run_matches(event_message: Message, user_id: int):
-    user_profile = get_user_profile(user_id)
-    lang = user_profile.language if user_profile else get_user_language(user_id)
+async def rank_matches(user_profile) -> List[Tuple[int, float]]:
+    """
+    Ranks matches for a user once and caches the ranked ids as a cursor that
+    page buttons read from.
+    """
+    query = decode_embedding(user_profile.embedding)
+    # Scoring and neighbour reads are blocking; keep them off the event loop
+    ranked = await run_read(find_matches, user_profile.user_id, query, MAX_MATCHES,
+                            model_version=user_profile.model_version) if query is not None else []
+    logging.info(f"Ranked {len(ranked)} matches for user_id: {user_profile.user_id}")
+    _ranked_matches.set(user_profile.user_id, ranked)
+    return ranked
+
+async def render_matches_page(user_profile, ranked: List[Tuple[int, float]], page: int, lang: str):
     s = STRINGS[lang]
+    pages = max(1, math.ceil(len(ranked) / MATCHES_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * MATCHES_PAGE_SIZE
 
-    if not user_profile or not user_profile.embedding:
-        return await event_message.answer(s["no_profile"])
-    
-    other_profiles = get_all_profiles_except(user_id)
-    matches = []
-    
-    for other in other_profiles:
-        if other.embedding:
-            score = compute_similarity(user_profile.embedding, other.embedding)
-            logging.info(f"Similarity score for {other.username}: {score}")
-            if score > 0.1: # Threshold for matches
-                matches.append((other, score))
-    
-    matches.sort(key=lambda x: x[1], reverse=True)
-    
-    if not matches:
-        return await event_message.answer(s["no_matches"])
-    
-    await event_message.answer(s["matches_found"].format(count=len(matches)), parse_mode="Markdown")
-    
-    for i, (match_profile, score) in enumerate(matches, 1):
+    # Ranking stops at MAX_MATCHES, so a full list is a top-N, not a total
+    header = s["matches_top"] if len(ranked) >= MAX_MATCHES else s["matches_found"]
+    blocks = [header.format(count=len(ranked))]
+    report_buttons = []
+    page_matches = ranked[start:start + MATCHES_PAGE_SIZE]
+    # Only the shown matches are hydrated, in a single query
+    profiles = await get_profiles_by_ids([match_id for match_id, _ in page_matches])
+    for i, (match_id, score) in enumerate(page_matches, start + 1):
+        match_profile = profiles.get(match_id)
+        if not match_profile or match_profile.is_blocked:
+            continue
         username = f"@{match_profile.username}" if match_profile.username else "Anonymous"
         reason = get_match_reason(user_profile, match_profile, lang)
-        
-        text = (
+        blocks.append(
             f"*Match #{i}:* {username} (similarity {score:.2f})\n"
             f"💡 _Reason:_ {reason}."
         )
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=s["report_user"], callback_data=f"report_{match_profile.user_id}")]
-        ])
-        
-        await event_message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+        report_buttons.append(InlineKeyboardButton(text=f"{s['report_user']} #{i}", callback_data=f"report_{match_id}_{page}"))
+    if pages > 1:
+        blocks.append(s["matches_page"].format(page=page + 1, pages=pages))
+
+    rows = [[button] for button in report_buttons]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text=s["page_prev"], callback_data=f"matches_page_{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(text=s["page_next"], callback_data=f"matches_page_{page + 1}"))
+    if nav:
+        rows.append(nav)
+    return "\n\n".join(blocks), InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def run_matches(event_message: Message, user: UserContext):
+    user_profile = await user.profile()
+    lang = await user.language()
+    s = STRINGS[lang]
+
+    if not user_profile or not user_profile.embedding:
+        return await event_message.answer(s["no_profile"])
+
+    wait = rate_limiter.check(user.user_id, "matches")
+    if wait:
+        return await event_message.answer(s["rate_limited"].format(minutes=math.ceil(wait / 60)))
+    
+    ranked = await rank_matches(user_profile)
+    if not ranked:
+        return await event_message.answer(s["no_matches"])
+    rate_limiter.charge(user.user_id, "matches")
+    
+    text, keyboard = await render_matches_page(user_profile, ranked, 0, lang)
+    await event_message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+@router.callback_query(F.data.startswith("matches_page_"))
+async def cb_matches_page(callback: CallbackQuery, user: UserContext):
+    page = int(callback.data.split("_")[2])
+    user_profile = await user.profile()
+    lang = await user.language()
+    await callback.answer()
+
+    if not user_profile or not user_profile.embedding:
+        return await callback.message.edit_text(STRINGS[lang]["no_profile"])
+
+    # Pages read the cached ranking; only an expired cursor is ranked again,
+    # which costs a /matches like the command itself
+    ranked = _ranked_matches.get(user.user_id)
+    if ranked is None:
+        wait = rate_limiter.check(user.user_id, "matches")
+        if wait:
+            return await callback.message.edit_text(STRINGS[lang]["rate_limited"].format(minutes=math.ceil(wait / 60)))
+        ranked = await rank_matches(user_profile)
+        if ranked:
+            rate_limiter.charge(user.user_id, "matches")
+    if not ranked:
+        return await callback.message.edit_text(STRINGS[lang]["no_matches"])
+
+    text, keyboard = await render_matches_page(user_profile, ranked, page, lang)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
 
 @router.callback_query(F.data.startswith("report_"))
-async def process_report(callback: CallbackQuery):
-    target_id = int(callback.data.split("_")[1])
-    report_user(target_id)
-    lang = get_user_language(callback.from_user.id)
+async def process_report(callback: CallbackQuery, user: UserContext):
+    parts = callback.data.split("_")
+    target_id = int(parts[1])
+    page = int(parts[2]) if len(parts) > 2 else 0
+    await report_user(target_id)
+    lang = await user.language()
     await callback.answer(STRINGS[lang]["user_reported"])
-    await callback.message.edit_text(callback.message.text + f"\n\n({STRINGS[lang]['report_user']})")
+
+    # The reported user leaves the cursor, and the page is shown again without them
+    ranked = _ranked_matches.get(user.user_id)
+    if ranked is not None:
+        ranked[:] = [(match_id, score) for match_id, score in ranked if match_id != target_id]
+        user_profile = await user.profile()
+        if ranked and user_profile:
+            text, keyboard = await render_matches_page(user_profile, ranked, page, lang)
+            return await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
+    # Without a cursor only the reported user's button is taken off the message
+    markup = callback.message.reply_markup
+    if markup:
+        rows = [[button for button in row if button.callback_data != callback.data] for row in markup.inline_keyboard]
+        await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[row for row in rows if row]))
@@ -3,9 +3,11 @@ from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from db import get_user_profile, delete_user_profile, get_user_language
+import rate_limiter
+from async_db import delete_user_profile
 from handlers.profile_wizard import ProfileStates
 from strings import STRINGS
+from user_context import UserContext
 
 router = Router()
 
@@ -34,10 +36,9 @@ def get_edit_keyboard(lang: str):
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 @router.message(Command("myprofile"))
-async def cmd_myprofile(message: Message):
-    user_id = message.from_user.id
-    profile = get_user_profile(user_id)
-    lang = profile.language if profile else get_user_language(user_id)
+async def cmd_myprofile(message: Message, user: UserContext):
+    profile = await user.profile()
+    lang = await user.language()
     s = STRINGS[lang]
     
     if not profile:
@@ -51,10 +52,9 @@ async def cmd_myprofile(message: Message):
     await message.answer(format_profile(profile, lang), reply_markup=keyboard, parse_mode="Markdown")
 
 @router.message(Command("edit"))
-async def cmd_edit(message: Message):
-    user_id = message.from_user.id
-    profile = get_user_profile(user_id)
-    lang = profile.language if profile else get_user_language(user_id)
+async def cmd_edit(message: Message, user: UserContext):
+    profile = await user.profile()
+    lang = await user.language()
     s = STRINGS[lang]
     
     if not profile:
@@ -67,8 +67,8 @@ async def cmd_edit(message: Message):
     )
 
 @router.callback_query(F.data == "open_edit_menu")
-async def cb_open_edit(callback: CallbackQuery):
-    lang = get_user_language(callback.from_user.id)
+async def cb_open_edit(callback: CallbackQuery, user: UserContext):
+    lang = await user.language()
     s = STRINGS[lang]
     await callback.answer()
     await callback.message.edit_text(
@@ -78,17 +78,16 @@ async def cb_open_edit(callback: CallbackQuery):
     )
 
 @router.callback_query(F.data == "finish_edit")
-async def cb_finish_edit(callback: CallbackQuery):
-    lang = get_user_language(callback.from_user.id)
+async def cb_finish_edit(callback: CallbackQuery, user: UserContext):
+    lang = await user.language()
     s = STRINGS[lang]
     await callback.answer(s["done"])
     await callback.message.edit_text(s["profile_updated"])
 
 @router.callback_query(F.data.startswith("edit_"))
-async def process_edit_callback(callback: CallbackQuery, state: FSMContext):
+async def process_edit_callback(callback: CallbackQuery, state: FSMContext, user: UserContext):
     field = callback.data.split("_")[1]
-    user_id = callback.from_user.id
-    profile = get_user_profile(user_id)
+    profile = await user.profile()
     
     if profile:
         await state.update_data(
@@ -99,7 +98,7 @@ async def process_edit_callback(callback: CallbackQuery, state: FSMContext):
             goals=profile.goals
         )
     
-    lang = profile.language if profile else get_user_language(user_id)
+    lang = await user.language()
     s = STRINGS[lang]
     await state.update_data(lang=lang)
     
@@ -131,8 +130,8 @@ async def process_edit_callback(callback: CallbackQuery, state: FSMContext):
         await state.update_data(editing_single=True)
 
 @router.callback_query(F.data == "confirm_delete")
-async def cb_confirm_delete(callback: CallbackQuery):
-    lang = get_user_language(callback.from_user.id)
+async def cb_confirm_delete(callback: CallbackQuery, user: UserContext):
+    lang = await user.language()
     s = STRINGS[lang]
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=s["yes_delete"], callback_data="actual_delete")],
@@ -146,9 +145,10 @@ async def cb_confirm_delete(callback: CallbackQuery):
     )
 
 @router.callback_query(F.data == "actual_delete")
-async def cb_actual_delete(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    lang = get_user_language(user_id)
-    delete_user_profile(user_id)
+async def cb_actual_delete(callback: CallbackQuery, user: UserContext):
+    lang = await user.language()
+    await delete_user_profile(user.user_id)
+    rate_limiter.forget(user.user_id)
+    user.forget()
     await callback.answer(STRINGS[lang]["done"])
     await callback.message.edit_text(STRINGS[lang]["profile_deleted"], parse_mode="Markdown")
@@ -4,10 +4,15 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 
-from db import save_user_profile, get_user_profile, UserProfile, get_user_language
-from matching import get_embedding
+import rate_limiter
+from async_db import save_user_profile
+from db import UserProfile
+from embedding_service import embed_text, embeddings_ready
+from matching import build_profile_text, MODEL_VERSION
 from strings import STRINGS
+from user_context import UserContext
 import logging
+import math
 
 router = Router()
 
@@ -19,12 +24,12 @@ class ProfileStates(StatesGroup):
     waiting_for_goals = State()
 
 @router.message(Command("profile"))
-async def cmd_profile(message: Message, state: FSMContext):
-    await run_profile_wizard(message, message.from_user.id, state)
+async def cmd_profile(message: Message, state: FSMContext, user: UserContext):
+    await run_profile_wizard(message, user, state)
 
-async def run_profile_wizard(event_message: Message, user_id: int, state: FSMContext):
-    existing_profile = get_user_profile(user_id)
-    lang = existing_profile.language if existing_profile else get_user_language(user_id)
+async def run_profile_wizard(event_message: Message, user: UserContext, state: FSMContext):
+    existing_profile = await user.profile()
+    lang = await user.language()
     await state.update_data(lang=lang)
     s = STRINGS[lang]
     
@@ -40,6 +45,11 @@ async def run_profile_wizard(event_message: Message, user_id: int, state: FSMCon
 async def save_and_finish(message: Message, user_id: int, state: FSMContext):
     data = await state.get_data()
     username = message.from_user.username
+
+    # Saving re-embeds the profile; the wizard state is kept so the user can retry
+    wait = rate_limiter.check(user_id, "profile_save")
+    if wait:
+        return await message.answer(STRINGS[data.get("lang", "en")]["rate_limited"].format(minutes=math.ceil(wait / 60)))
     
     # In case of single field edit, we might be getting goals from state or message
     goals = data.get('goals')
@@ -47,16 +57,15 @@ async def save_and_finish(message: Message, user_id: int, state: FSMContext):
         goals = message.text
 
     logging.info(f"Saving profile for user_id: {user_id}")
-    profile_text = (
-        f"University: {data['university']}. "
-        f"Skills: {', '.join(data.get('skills', []))}. "
-        f"Interests: {', '.join(data.get('interests', []))}. "
-        f"Goals: {goals or ''}."
-    )
+    profile_text = build_profile_text(data['university'], data.get('skills', []), data.get('interests', []), goals)
     logging.info(f"Profile text for embedding: {profile_text}")
     
-    # Compute embedding
-    embedding = get_embedding(profile_text)
+    # Compute embedding off the event loop, batched with concurrent saves.
+    # Right after a restart the model may still be warming up; the text
+    # queues behind it, so tell the user why this one is slow.
+    if not embeddings_ready():
+        await message.answer(STRINGS[data.get("lang", "en")]["model_warming_up"])
+    embedding = await embed_text(profile_text)
     if embedding:
         logging.info(f"Successfully generated embedding for user_id: {user_id} (size: {len(embedding)} bytes)")
     else:
@@ -75,10 +84,12 @@ async def save_and_finish(message: Message, user_id: int, state: FSMContext):
         goals=goals or "",
         last_updated="", # Set in db.py
         embedding=embedding,
-        language=lang
+        language=lang,
+        model_version=MODEL_VERSION
     )
     
-    save_user_profile(profile)
+    await save_user_profile(profile)
+    rate_limiter.charge(user_id, "profile_save")
     logging.info(f"Profile saved to database for user_id: {user_id}")
     await state.clear()
     
@@ -0,0 +1,241 @@
+"""
+Bulk profile import.
+
+Streams records from a CSV or JSONL export (or generates synthetic ones),
+embeds them in large batched model calls and writes each chunk with one
+executemany transaction. Encoding of the next chunk overlaps the write of the
+previous one. The number of imported records is checkpointed in the same
+transaction as each chunk, so an interrupted import resumes where it stopped
+when run again with the same source.
+
+    python import_profiles.py cohort.csv
+    python import_profiles.py cohort.jsonl --chunk-size 5000 --batch-size 512
+    python import_profiles.py --synthetic 100000 --embeddings random
+
+CSV columns / JSONL keys: user_id, username, university, year_course, skills,
+interests, goals and optionally language (one of STRINGS, else "en"). skills and interests are lists in
+JSONL and comma-separated in CSV, as typed in the profile wizard. Re-importing a
+user keeps their block flag and, unless the record sets one, their language.
+
+Restart the bot (or run `python neighbors.py rebuild`) afterwards so the
+matching indexes pick up the imported profiles.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from db import UserProfile, init_db, import_user_profiles, get_import_progress
+from matching import build_profile_text, get_embeddings, EMBEDDING_DTYPE, MODEL_VERSION
+from strings import STRINGS
+from vector_format import encode_vector
+
+logging.basicConfig(level=logging.INFO)
+
+def read_csv(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def _terms(value) -> List[str]:
+    if isinstance(value, str):
+        value = value.split(",")
+    return [term.strip() for term in value or [] if term and term.strip()]
+
+def to_profile(record: dict) -> Optional[UserProfile]:
+    """Builds a profile from an import record, or None if it lacks user_id or university."""
+    try:
+        user_id = int(record["user_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not record.get("university"):
+        return None
+    language = (record.get("language") or "").strip().lower()
+    return UserProfile(
+        user_id=user_id,
+        username=record.get("username") or None,
+        university=record["university"].strip(),
+        year_course=(record.get("year_course") or "").strip(),
+        skills=_terms(record.get("skills")),
+        interests=_terms(record.get("interests")),
+        goals=(record.get("goals") or "").strip(),
+        last_updated="",
+        language=language if language in STRINGS else None, # None keeps an existing user's choice
+    )
+
+# Synthetic cohort: each student picks a field, draws most skills and
+# interests from it and a few from anywhere, so profiles cluster like real ones
+UNIVERSITIES = ["MSU", "STANKIN", "HSE", "ITMO", "SPbU", "MIPT", "Bauman MSTU", "MEPhI", "RUDN", "Skoltech"]
+YEARS = ["1st Year", "2nd Year", "3rd Year", "4th Year", "Master's", "PhD"]
+FIELDS = {
+    "software": (["Python", "Java", "C++", "Go", "JavaScript", "React", "SQL", "Docker", "Linux", "Algorithms", "Git", "Kotlin"],
+                 ["Startups", "Open Source", "Hackathons", "Competitive Programming", "Gaming", "Back-end"]),
+    "data": (["Python", "Machine Learning", "Statistics", "R", "Data Analysis", "PyTorch", "SQL", "Pandas", "Deep Learning"],
+             ["AI Research", "Kaggle", "Computer Vision", "NLP", "Chess", "Science"]),
+    "engineering": (["CAD", "SolidWorks", "MATLAB", "CNC Machining", "Electronics", "Arduino", "3D Printing", "Mechanics"],
+                    ["Robotics", "Drones", "Cars", "Manufacturing", "Space", "DIY"]),
+    "design": (["Figma", "UI Design", "Photoshop", "Illustration", "UX Research", "Blender", "Typography"],
+               ["Photography", "Art", "Web Design", "Animation", "Fashion", "Travel"]),
+    "business": (["Marketing", "Excel", "Finance", "Public Speaking", "Project Management", "Sales", "Accounting"],
+                 ["Entrepreneurship", "Investing", "Startups", "Networking", "Economics", "Tennis"]),
+    "humanities": (["Writing", "Research", "English", "Translation", "Editing", "History", "Philosophy"],
+                   ["Reading", "Languages", "Theatre", "Music", "Travel", "Debating"]),
+}
+GOALS = [
+    "Find a co-founder for {interest} project.",
+    "Looking for a study partner in {skill}.",
+    "Want to join a hackathon team working on {interest}.",
+    "Get help with an internship application in {skill}.",
+    "Meet people interested in {interest}.",
+    "Build a portfolio project using {skill}.",
+]
+
+def synthetic_records(count: int, seed: int = 0, start_id: int = 10_000_000) -> Iterator[dict]:
+    """Deterministic realistic-looking profiles; the same arguments give the same records."""
+    rng = random.Random(seed)
+    all_skills = sorted({skill for skills, _ in FIELDS.values() for skill in skills})
+    all_interests = sorted({interest for _, interests in FIELDS.values() for interest in interests})
+    for i in range(count):
+        field_skills, field_interests = FIELDS[rng.choice(sorted(FIELDS))]
+        skills = rng.sample(field_skills, rng.randint(2, 4)) + rng.sample(all_skills, rng.randint(0, 1))
+        interests = rng.sample(field_interests, rng.randint(1, 3)) + rng.sample(all_interests, rng.randint(0, 1))
+        yield {
+            "user_id": start_id + i,
+            "username": f"student{start_id + i}",
+            "university": rng.choice(UNIVERSITIES),
+            "year_course": rng.choice(YEARS),
+            "skills": list(dict.fromkeys(skills)),
+            "interests": list(dict.fromkeys(interests)),
+            "goals": rng.choice(GOALS).format(skill=rng.choice(skills), interest=rng.choice(interests).lower()),
+            "language": "ru" if rng.random() < 0.6 else "en",
+        }
+
+_term_vectors: Dict[str, np.ndarray] = {}
+
+def random_embeddings(profiles: List[UserProfile], dim: int = 384) -> List[bytes]:
+    """
+    Model-free stand-in embeddings for load tests: a sum of fixed random
+    vectors per skill, interest and university plus noise, so profiles that
+    share terms are similar the way real embeddings would be.
+    """
+    def term_vector(term: str) -> np.ndarray:
+        if term not in _term_vectors:
+            _term_vectors[term] = np.random.default_rng(zlib.crc32(term.casefold().encode())).normal(size=dim).astype(np.float32)
+        return _term_vectors[term]
+
+    encoded = []
+    for profile in profiles:
+        vector = 0.5 * term_vector(profile.university) + np.random.default_rng(profile.user_id).normal(size=dim).astype(np.float32)
+        for term in profile.skills + profile.interests:
+            vector += term_vector(term)
+        encoded.append(encode_vector(vector, EMBEDDING_DTYPE))
+    return encoded
+
+def embed_profiles(profiles: List[UserProfile], batch_size: int, mode: str, dim: int = 384):
+    if mode == "none":
+        return
+    for start in range(0, len(profiles), batch_size):
+        batch = profiles[start:start + batch_size]
+        if mode == "random":
+            embeddings = random_embeddings(batch, dim)
+            # Stand-ins never pass for model output: they are matched among
+            # themselves until `reembed.py --include-random` replaces them
+            version = f"random-{dim}"
+        else:
+            embeddings = get_embeddings([build_profile_text(p.university, p.skills, p.interests, p.goals) for p in batch])
+            version = MODEL_VERSION
+        for profile, embedding in zip(batch, embeddings):
+            profile.embedding = embedding
+            profile.model_version = version
+
+def chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+def import_profiles(records: Iterable[dict], source: str, chunk_size: int = 2000, batch_size: int = 256,
+                    embeddings: str = "model", resume: bool = True) -> int:
+    """
+    Imports records in chunks and returns the number of profiles written.
+    Records already checkpointed for source are skipped.
+    """
+    done = get_import_progress(source) if resume else 0
+    if done:
+        logging.info(f"Resuming {source} after {done} records")
+        records = itertools.islice(records, done, None)
+
+    written = skipped = 0
+    started = time.perf_counter()
+    embed_time = 0.0
+    pending_write = None
+    with ThreadPoolExecutor(1, thread_name_prefix="import-write") as writer:
+        for chunk in chunks(records, chunk_size):
+            profiles = [profile for profile in map(to_profile, chunk) if profile is not None]
+            skipped += len(chunk) - len(profiles)
+
+            embed_started = time.perf_counter()
+            embed_profiles(profiles, batch_size, embeddings)
+            embed_time += time.perf_counter() - embed_started
+
+            # One write in flight: checkpoints stay in order
+            if pending_write is not None:
+                pending_write.result()
+            done += len(chunk)
+            pending_write = writer.submit(import_user_profiles, profiles, (source, done))
+            written += len(profiles)
+
+            elapsed = time.perf_counter() - started
+            logging.info(f"Imported {done} records ({written / elapsed:.0f} profiles/s this run, "
+                         f"{embed_time / elapsed:.0%} of time embedding, {skipped} skipped)")
+        if pending_write is not None:
+            pending_write.result()
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"Import of {source} finished: {written} profiles in {elapsed:.1f}s "
+                 f"({written / max(elapsed, 1e-9):.0f}/s), {skipped} records skipped")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="CSV or JSONL file (.csv / .jsonl)")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="generate N synthetic profiles instead of reading a file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start-id", type=int, default=10_000_000, help="first synthetic user_id")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="records per write transaction")
+    parser.add_argument("--batch-size", type=int, default=256, help="texts per model call")
+    parser.add_argument("--embeddings", choices=("model", "random", "none"), default="model",
+                        help="random: model-free stand-in vectors for load tests")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        records = synthetic_records(args.synthetic, args.seed, args.start_id)
+        source = f"synthetic:{args.seed}:{args.start_id}:{args.synthetic}:{args.embeddings}"
+    elif args.path:
+        records = read_jsonl(args.path) if args.path.endswith((".jsonl", ".ndjson")) else read_csv(args.path)
+        source = f"{os.path.abspath(args.path)}:{os.path.getsize(args.path)}"
+    else:
+        parser.error("give a file to import or --synthetic N")
+
+    init_db()
+    import_profiles(records, source, args.chunk_size, args.batch_size, args.embeddings, resume=not args.restart)
+
+if __name__ == "__main__":
+    main()
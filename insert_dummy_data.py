@@ -1,7 +1,7 @@
 import asyncio
 import logging
-from db import init_db, save_user_profile, UserProfile
-from matching import get_embedding
+from db import init_db, save_user_profiles, UserProfile
+from matching import get_embeddings, build_profile_text, MODEL_VERSION
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -57,19 +57,17 @@ async def insert_dummy_data():
         }
     ]
     
-    for u in dummy_users:
+    # One batched (and cached) model call for all profiles
+    embeddings = get_embeddings([
+        build_profile_text(u['university'], u['skills'], u['interests'], u['goals'])
+        for u in dummy_users
+    ])
+
+    profiles = []
+    for u, embedding in zip(dummy_users, embeddings):
         logging.info(f"Processing user: {u['username']}")
         
-        profile_text = (
-            f"University: {u['university']}. "
-            f"Skills: {', '.join(u['skills'])}. "
-            f"Interests: {', '.join(u['interests'])}. "
-            f"Goals: {u['goals']}."
-        )
-        
-        embedding = get_embedding(profile_text)
-        
-        profile = UserProfile(
+        profiles.append(UserProfile(
             user_id=u['user_id'],
             username=u['username'],
             university=u['university'],
@@ -79,11 +77,13 @@ async def insert_dummy_data():
             goals=u['goals'],
             last_updated="",
             embedding=embedding,
-            is_blocked=False
-        )
-        
-        save_user_profile(profile)
-        logging.info(f"Saved profile for {u['username']}")
+            is_blocked=False,
+            model_version=MODEL_VERSION
+        ))
+    
+    # One transaction for all profiles; see import_profiles.py for large imports
+    save_user_profiles(profiles)
+    logging.info(f"Saved {len(profiles)} profiles")
 
 if __name__ == "__main__":
     asyncio.run(insert_dummy_data())
@@ -1,20 +1,42 @@
+import time
+STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# Load environment variables before local modules read their settings
+load_dotenv()
+
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-
-from db import init_db, get_user_language, set_user_language
+AIOGRAM_IMPORTED = time.perf_counter()
+
+import async_db
+import outbound
+import rate_limiter
+import reembed
+from async_db import init_db, set_user_language
+from db import close_connections
+from ann_index import save_ann_index
+from embedding_service import close_embedding_service, get_embedding_service
+from fsm_storage import SQLiteStorage
+from match_engine import load_matcher
 from handlers import profile_wizard, profile_view, matching_handlers, admin_handlers
 from strings import STRINGS
+from supervisor import SUPERVISOR_WORKERS, supervise
+from user_context import UserContext, UserContextMiddleware
+from webhook import run_webhook
+MODULES_IMPORTED = time.perf_counter()
 
-# Load environment variables
-load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# "polling" (getUpdates long polling), "webhook" (see webhook.py) or
+# "supervisor" (polling, with handlers in worker processes; see supervisor.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
 # Initialize logging
 logging.basicConfig(
@@ -23,8 +45,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize dispatcher
-dp = Dispatcher()
+# Initialize dispatcher; wizard sessions are kept in SQLite (see fsm_storage.py)
+dp = Dispatcher(storage=SQLiteStorage())
+# Resolves the sender's profile and language once per update, as the `user` argument
+dp.update.outer_middleware(UserContextMiddleware())
 
 # Include routers
 dp.include_router(admin_handlers.router)
@@ -49,16 +73,16 @@ def get_lang_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 @dp.callback_query(F.data == "start_wizard")
-async def cb_start_wizard(callback: types.CallbackQuery, state: FSMContext):
+async def cb_start_wizard(callback: types.CallbackQuery, state: FSMContext, user: UserContext):
     await callback.answer()
     from handlers.profile_wizard import run_profile_wizard
-    await run_profile_wizard(callback.message, callback.from_user.id, state)
+    await run_profile_wizard(callback.message, user, state)
 
 @dp.callback_query(F.data == "start_matching")
-async def cb_start_matching(callback: types.CallbackQuery):
+async def cb_start_matching(callback: types.CallbackQuery, user: UserContext):
     await callback.answer()
     from handlers.matching_handlers import run_matches
-    await run_matches(callback.message, callback.from_user.id)
+    await run_matches(callback.message, user)
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
@@ -69,9 +93,10 @@ async def cmd_start(message: Message, state: FSMContext):
     )
 
 @dp.callback_query(F.data.startswith("lang_"))
-async def cb_set_language(callback: types.CallbackQuery):
+async def cb_set_language(callback: types.CallbackQuery, user: UserContext):
     lang = callback.data.split("_")[1]
-    set_user_language(callback.from_user.id, lang)
+    await set_user_language(user.user_id, lang)
+    user.forget()
     await callback.answer(STRINGS[lang]["lang_changed"])
     
     s = STRINGS[lang]
@@ -89,18 +114,18 @@ async def cmd_language(message: Message):
     )
 
 @dp.callback_query(F.data == "view_rules")
-async def cb_view_rules(callback: types.CallbackQuery):
+async def cb_view_rules(callback: types.CallbackQuery, user: UserContext):
     await callback.answer()
-    await cmd_rules(callback.message)
+    await cmd_rules(callback.message, user)
 
 @dp.callback_query(F.data == "help")
-async def cb_help(callback: types.CallbackQuery):
+async def cb_help(callback: types.CallbackQuery, user: UserContext):
     await callback.answer()
-    await cmd_help(callback.message)
+    await cmd_help(callback.message, user)
 
 @dp.message(Command("help"))
-async def cmd_help(message: Message):
-    lang = get_user_language(message.from_user.id)
+async def cmd_help(message: Message, user: UserContext):
+    lang = await user.language()
     help_text = (
         STRINGS[lang]["welcome"] + "\n\n"
         "📜 *Commands:*\n"
@@ -113,8 +138,8 @@ async def cmd_help(message: Message):
     await message.answer(help_text, parse_mode="Markdown")
 
 @dp.message(Command("rules"))
-async def cmd_rules(message: Message):
-    lang = get_user_language(message.from_user.id)
+async def cmd_rules(message: Message, user: UserContext):
+    lang = await user.language()
     rules_text = (
         "📜 *Rules*\n\n"
         "1. Be respectful\n"
@@ -128,20 +153,78 @@ async def cmd_rules(message: Message):
     )
     await message.answer(rules_text, parse_mode="Markdown")
 
+async def warm_up():
+    """
+    Loads the embedding model and the match indexes while polling already
+    serves lightweight commands. Profile saves queue behind the model.
+    """
+    await get_embedding_service().warm_up()
+    started = time.perf_counter()
+    try:
+        await async_db.run_read(load_matcher)
+        logger.info(f"Matcher loaded in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Matcher warm-up failed: {e}")
+    logger.info(f"Warm-up finished {time.perf_counter() - STARTED:.2f}s after process start")
+
+@asynccontextmanager
+async def serving(bot: Bot, primary: bool = True):
+    """
+    Starts the database, rate limiter and model warm-up around serving
+    updates for bot, and shuts everything down afterwards. Yields the warm-up
+    task. Only the primary process runs re-embedding and saves the ANN index
+    (see supervisor.py).
+    """
+    # Initialize database
+    started = time.perf_counter()
+    await init_db()
+    db_ready = time.perf_counter()
+    await rate_limiter.start()
+    if primary:
+        reembed.start()
+    warm_up_task = asyncio.create_task(warm_up())
+
+    # Paces and merges everything sent to chats (see outbound.py)
+    outbound.install(bot)
+    logger.info(f"Startup: aiogram import {AIOGRAM_IMPORTED - STARTED:.2f}s, bot modules {MODULES_IMPORTED - AIOGRAM_IMPORTED:.2f}s, "
+                f"database {db_ready - started:.2f}s, rate limiter {time.perf_counter() - db_ready:.2f}s; "
+                f"model warming up in the background")
+    try:
+        yield warm_up_task
+    finally:
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+        await outbound.close()
+        await bot.session.close()
+        await rate_limiter.stop()
+        await reembed.stop()
+        await close_embedding_service()
+        await async_db.shutdown()
+        if primary:
+            save_ann_index()
+        close_connections()
+
 async def main():
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN not found in .env file")
         return
 
-    # Initialize database
-    init_db()
-
     bot = Bot(token=BOT_TOKEN)
-    logger.info("Starting bot polling for Demo Day...")
-    try:
-        await dp.start_polling(bot)
-    except Exception as e:
-        logger.exception(f"Critical error during bot polling: {e}")
+    if BOT_MODE == "supervisor":
+        # Polls here and hands updates to worker processes, which run the handlers
+        logger.info(f"Starting bot supervisor with {SUPERVISOR_WORKERS} workers for Demo Day...")
+        return await supervise(bot, SUPERVISOR_WORKERS, allowed_updates=dp.resolve_used_update_types())
+
+    async with serving(bot):
+        try:
+            if BOT_MODE == "webhook":
+                logger.info("Starting bot webhook server for Demo Day...")
+                await run_webhook(dp, bot)
+            else:
+                logger.info("Starting bot polling for Demo Day...")
+                await dp.start_polling(bot, close_bot_session=False)
+        except Exception as e:
+            logger.exception(f"Critical error during bot polling: {e}")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,407 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from db import add_profile_listener, get_all_embeddings, get_embeddings_fingerprint
+from embedding_store import get_embedding_store
+from matching import decode_embedding, decode_embeddings, MODEL_VERSION
+from skill_index import get_skill_index
+
+MATCH_THRESHOLD = 0.1 # Minimum cosine similarity for a match
+# "materialized" neighbour lists (see neighbors), "exact" scan or "ann" (see ann_index)
+MATCH_MODE = os.getenv("MATCH_MODE", "materialized")
+BATCH_QUERIES = 64 # Queries scored per matrix-matrix product in top_k_batch
+
+# Hybrid score = dense weight * embedding cosine + lexical weight * term overlap (see skill_index).
+# Off by default: with a lexical weight, MATCH_THRESHOLD applies to the blended score, not the cosine.
+MATCH_WEIGHT_DENSE = float(os.getenv("MATCH_WEIGHT_DENSE", "1.0"))
+MATCH_WEIGHT_LEXICAL = float(os.getenv("MATCH_WEIGHT_LEXICAL", "0.0"))
+# "all" scores everyone; "lexical" only scores users sharing a skill/interest
+# (falling back to everyone when that leaves fewer than k candidates)
+MATCH_CANDIDATES = os.getenv("MATCH_CANDIDATES", "all")
+
+def normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Returns the vector as L2-normalized float32, or None for a zero vector.
+    """
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    return vector / norm
+
+class MatchEngine:
+    """
+    Keeps pre-normalized embeddings of every matchable user in one contiguous
+    float32 matrix, so the whole population is scored with a single
+    matrix-vector product instead of a Python loop over profiles.
+
+    With a lexical index and a lexical weight, scores of queries made on
+    behalf of a user are blended with skill/interest overlap.
+    """
+
+    def __init__(self, lexical=None, weight_dense: float = MATCH_WEIGHT_DENSE,
+                 weight_lexical: float = MATCH_WEIGHT_LEXICAL, candidates: str = MATCH_CANDIDATES,
+                 model_version: Optional[str] = None):
+        self.lexical = lexical
+        self.model_version = model_version # only embeddings of this model are held, if set
+        self.weight_dense = weight_dense
+        self.weight_lexical = weight_lexical
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._rows = {} # user_id -> row in _matrix
+        self._size = 0
+        self.dim = None
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, user_id: int):
+        return user_id in self._rows
+
+    def load(self, rows: Iterable[Tuple[int, bytes]]):
+        """
+        Replaces the engine contents with (user_id, embedding blob) rows.
+        """
+        user_ids, blobs = [], []
+        for user_id, blob in rows:
+            user_ids.append(user_id)
+            blobs.append(blob)
+        indices, matrix = decode_embeddings(blobs)
+        if len(indices) < len(blobs):
+            logging.warning(f"Skipping {len(blobs) - len(indices)} embeddings that could not be decoded or have a different dimension")
+        self.load_arrays(np.asarray(user_ids, dtype=np.int64)[indices], matrix)
+
+    def load_arrays(self, ids: np.ndarray, matrix: np.ndarray):
+        """
+        Replaces the engine contents with an id array and a matching float32 matrix.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            matrix = np.asarray(matrix, dtype=np.float32).reshape(len(ids), -1)
+            norms = np.linalg.norm(matrix, axis=1)
+            keep = norms > 0
+            matrix = np.ascontiguousarray(matrix[keep] / norms[keep, None], dtype=np.float32)
+            ids = ids[keep]
+
+        with self._lock:
+            if len(ids):
+                self._matrix = matrix
+                self.dim = matrix.shape[1]
+            else:
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+                self.dim = None
+            self._ids = ids
+            self._rows = {user_id: row for row, user_id in enumerate(ids.tolist())}
+            self._size = len(ids)
+            self._rows_reset()
+        logging.info(f"Match engine loaded {self._size} embeddings")
+
+    def load_mapped(self, ids: np.ndarray, matrix: np.ndarray, size: int):
+        """
+        Uses pre-normalized arrays in place, e.g. copy-on-write memory maps
+        (see embedding_store). The first size rows are in use; spare rows
+        after them take upserts before the arrays have to grow.
+        """
+        with self._lock:
+            self._matrix = matrix
+            self._ids = ids
+            self.dim = matrix.shape[1] if size else None
+            self._rows = {user_id: row for row, user_id in enumerate(ids[:size].tolist())}
+            self._size = size
+            self._rows_reset()
+        logging.info(f"Match engine mapped {self._size} embeddings")
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Views of the ids and matrix rows in use. They are only stable while
+        nothing else changes the engine.
+        """
+        with self._lock:
+            return self._ids[:self._size], self._matrix[:self._size]
+
+    def upsert(self, user_id: int, vector: np.ndarray):
+        vector = normalize(vector)
+        if vector is None:
+            self.remove(user_id)
+            return
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vector.shape[0]
+                if self._matrix.ndim != 2 or self._matrix.shape[1] != self.dim:
+                    self._matrix = np.empty((16, self.dim), dtype=np.float32)
+                    self._ids = np.empty(16, dtype=np.int64)
+            elif vector.shape[0] != self.dim:
+                logging.warning(f"Ignoring embedding of user {user_id}: dimension {vector.shape[0]} != {self.dim}")
+                return
+
+            row = self._rows.get(user_id)
+            if row is None:
+                if self._size == self._matrix.shape[0]:
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[user_id] = row
+                self._ids[row] = user_id
+            self._matrix[row] = vector
+            self._row_updated(row)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return
+            # Move the last row into the gap so the matrix stays contiguous
+            last = self._size - 1
+            self._row_removed(row, last)
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+            self._size = last
+
+    def _grow(self):
+        capacity = max(16, self._matrix.shape[0] * 2)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    # Hooks for subclasses that keep per-row state; called with the lock held
+    def _rows_reset(self):
+        pass
+
+    def _row_updated(self, row: int):
+        pass
+
+    def _row_removed(self, row: int, last: int):
+        """Row is going away; unless row == last, the last row moves into it."""
+        pass
+
+    def top_k(self, query: np.ndarray, k: int, threshold: float = MATCH_THRESHOLD,
+              exclude: Iterable[int] = (), user_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Returns up to k (user_id, score) pairs above threshold, best first.
+        user_id, if given, is the user the query is for; it enables hybrid
+        scoring and lexical candidate generation.
+        """
+        query = normalize(query)
+        if query is None or k <= 0:
+            return []
+
+        with self._lock:
+            if self._size == 0:
+                return []
+            if query.shape[0] != self.dim:
+                logging.warning(f"Query dimension {query.shape[0]} != engine dimension {self.dim}")
+                return []
+
+            rows = self._candidate_rows(user_id, k)
+            if rows is None:
+                rows = np.arange(self._size)
+                scores = self._matrix[:self._size] @ query
+            else:
+                scores = self._matrix[rows] @ query
+            scores = self._blend(rows, scores, user_id)
+            self._exclude(rows, scores, exclude)
+            return self._select(rows, scores, k, threshold)
+
+    def _candidate_rows(self, user_id: Optional[int], k: int) -> Optional[np.ndarray]:
+        """Rows of users sharing a term with user_id, or None to score everyone."""
+        if self.lexical is None or user_id is None or self.candidates != "lexical":
+            return None
+        rows = [self._rows[other_id] for other_id in self.lexical.candidates(user_id) if other_id in self._rows]
+        return np.asarray(rows, dtype=np.int64) if len(rows) >= k else None
+
+    def _blend(self, rows: np.ndarray, scores: np.ndarray, user_id: Optional[int]) -> np.ndarray:
+        """
+        Mixes term overlap into dense scores; scores[i] belongs to matrix row rows[i].
+        Without a lexical weight the dense cosine is returned as is.
+        """
+        if self.lexical is None or user_id is None or not self.weight_lexical:
+            return scores
+        scores = scores * np.float32(self.weight_dense)
+        lexical = self.lexical.lexical_scores(user_id)
+        if lexical:
+            position = np.full(self._size, -1, dtype=np.int64)
+            position[rows] = np.arange(len(rows))
+            lexical_rows = np.fromiter((self._rows.get(other_id, -1) for other_id in lexical), dtype=np.int64, count=len(lexical))
+            values = np.fromiter(lexical.values(), dtype=np.float32, count=len(lexical))
+            known = lexical_rows >= 0
+            positions = position[lexical_rows[known]]
+            present = positions >= 0
+            scores[positions[present]] += np.float32(self.weight_lexical) * values[known][present]
+        return scores
+
+    def _exclude(self, rows: np.ndarray, scores: np.ndarray, exclude: Iterable[int]):
+        excluded = [self._rows[user_id] for user_id in exclude if user_id in self._rows]
+        if excluded:
+            scores[np.isin(rows, excluded)] = -np.inf
+
+    def _select(self, rows: np.ndarray, scores: np.ndarray, k: int, threshold: float) -> List[Tuple[int, float]]:
+        """
+        Picks the k best of rows (scored by scores) above threshold with a partial sort.
+        """
+        keep = np.flatnonzero(scores > threshold)
+        if keep.size > k:
+            keep = keep[np.argpartition(-scores[keep], k - 1)[:k]]
+        keep = keep[np.argsort(-scores[keep], kind="stable")]
+        return [(int(self._ids[rows[i]]), float(scores[i])) for i in keep]
+
+    def user_ids(self) -> List[int]:
+        with self._lock:
+            return self._ids[:self._size].tolist()
+
+    def vector(self, user_id: int) -> Optional[np.ndarray]:
+        """Returns a copy of the user's normalized embedding, or None if not indexed."""
+        with self._lock:
+            row = self._rows.get(user_id)
+            return None if row is None else self._matrix[row].copy()
+
+    def score_all(self, query: np.ndarray, user_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (user ids, scores) for every indexed user.
+        """
+        query = normalize(query)
+        with self._lock:
+            if query is None or self._size == 0 or query.shape[0] != self.dim:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            rows = np.arange(self._size)
+            return self._ids[:self._size].copy(), self._blend(rows, self._matrix[:self._size] @ query, user_id)
+
+    def score_pair(self, user_id: int, other_id: int) -> Optional[float]:
+        """Score between two indexed users, or None if either is missing."""
+        with self._lock:
+            row, other_row = self._rows.get(user_id), self._rows.get(other_id)
+            if row is None or other_row is None:
+                return None
+            score = float(self._matrix[row] @ self._matrix[other_row])
+        if self.lexical is not None and self.weight_lexical:
+            score = self.weight_dense * score + self.weight_lexical * self.lexical.lexical_score(user_id, other_id)
+        return score
+
+    def top_k_batch(self, user_ids: Iterable[int], k: int,
+                    threshold: float = MATCH_THRESHOLD) -> Dict[int, List[Tuple[int, float]]]:
+        """
+        Top-k neighbours of many indexed users at once, each excluding itself.
+        Users that are not indexed are left out of the result.
+        """
+        results = {}
+        with self._lock:
+            users = [(user_id, self._rows[user_id]) for user_id in user_ids if user_id in self._rows]
+            everyone = np.arange(self._size)
+            for start in range(0, len(users), BATCH_QUERIES):
+                chunk = users[start:start + BATCH_QUERIES]
+                rows = [row for _, row in chunk]
+                scores = self._matrix[:self._size] @ self._matrix[rows].T
+                for column, (user_id, row) in enumerate(chunk):
+                    column_scores = self._blend(everyone, scores[:, column], user_id)
+                    column_scores[row] = -np.inf
+                    results[user_id] = self._select(everyone, column_scores, k, threshold)
+        return results
+
+    def on_profile_event(self, event: str, user_id: int, profile=None):
+        if (event == "save" and profile is not None and profile.embedding and not profile.is_blocked
+                and (self.model_version is None or profile.model_version == self.model_version)):
+            vector = decode_embedding(profile.embedding)
+            if vector is not None:
+                self.upsert(user_id, vector)
+                return
+        self.remove(user_id)
+
+def load_candidates(model_version: Optional[str] = MODEL_VERSION) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matchable user ids and their embeddings from model_version, as (int64
+    ids, float32 matrix). Only the id and embedding columns are read;
+    profiles are hydrated later, for the matches that are actually shown.
+    """
+    rows = get_all_embeddings(model_version)
+    indices, matrix = decode_embeddings([blob for _, blob in rows])
+    ids = np.fromiter((rows[i][0] for i in indices.tolist()), dtype=np.int64, count=len(indices))
+    return ids, matrix
+
+_engines: Dict[str, MatchEngine] = {}
+_engine_lock = threading.Lock()
+# Database fingerprint each old-version engine was last loaded at (shared store only)
+_engine_fingerprints: Dict[str, Tuple[int, Optional[str]]] = {}
+
+def get_engine(model_version: str = MODEL_VERSION) -> MatchEngine:
+    """
+    Returns the process-wide engine for a model version (the current one by
+    default), loading it from the database on first use. The engine then
+    follows profile saves, deletions and blocks. Engines for older versions
+    only exist while re-embedding is in progress and empty out as it runs.
+    With EMBEDDING_STORE_DIR set, the current engine maps the shared
+    embedding store instead and catches up with other processes on each call;
+    engines for older versions, which the store doesn't hold, are reloaded
+    whenever their rows in the database change.
+    """
+    store = get_embedding_store()
+    shared = store is not None and model_version == MODEL_VERSION
+    if model_version not in _engines:
+        with _engine_lock:
+            if model_version not in _engines:
+                # The skill index registers its listener first, so lexical
+                # scores are current whenever the engine handles an event
+                engine = MatchEngine(lexical=get_skill_index(), model_version=model_version)
+                load = lambda: engine.load_arrays(*load_candidates(model_version))
+                if shared:
+                    # Rows are shared with other processes and updated through the store's log
+                    store.attach(engine, load)
+                    add_profile_listener(store.on_profile_event)
+                else:
+                    if store is not None:
+                        _engine_fingerprints[model_version] = get_embeddings_fingerprint(model_version)
+                    load()
+                    add_profile_listener(engine.on_profile_event)
+                _engines[model_version] = engine
+    elif store is not None and not shared:
+        # Other processes' saves, deletes and blocks of this version never reach our listener
+        fingerprint = get_embeddings_fingerprint(model_version)
+        if fingerprint != _engine_fingerprints.get(model_version):
+            with _engine_lock:
+                _engine_fingerprints[model_version] = fingerprint
+                _engines[model_version].load_arrays(*load_candidates(model_version))
+    if shared:
+        store.sync()
+    return _engines[model_version]
+
+def get_matcher(mode: Optional[str] = None):
+    """
+    Returns the scan-based matcher for the given MATCH_MODE: the approximate
+    IVF index for "ann", the exact engine otherwise. Both expose top_k.
+    """
+    if (mode or MATCH_MODE) == "ann":
+        from ann_index import get_ann_index
+        return get_ann_index()
+    return get_engine()
+
+def load_matcher(mode: Optional[str] = None):
+    """Loads what find_matches uses under mode, so the first query doesn't pay for it."""
+    if (mode or MATCH_MODE) == "materialized":
+        from neighbors import get_neighbor_store
+        return get_neighbor_store()
+    return get_matcher(mode)
+
+def find_matches(user_id: int, query: np.ndarray, k: int, mode: Optional[str] = None,
+                 model_version: str = MODEL_VERSION) -> List[Tuple[int, float]]:
+    """
+    Best matches for a user under the configured MATCH_MODE, as (user_id, score)
+    pairs. model_version is the model of the query embedding; users not yet
+    re-embedded are matched by an exact scan among profiles of their version.
+    """
+    if model_version != MODEL_VERSION:
+        return get_engine(model_version).top_k(query, k, MATCH_THRESHOLD, exclude={user_id}, user_id=user_id)
+    if (mode or MATCH_MODE) == "materialized":
+        from neighbors import get_neighbor_store
+        get_engine() # catches up with the embedding store, if any
+        return get_neighbor_store().get_neighbors(user_id, query, k)
+    return get_matcher(mode).top_k(query, k, MATCH_THRESHOLD, exclude={user_id}, user_id=user_id)
@@ -1,44 +1,110 @@
 import numpy as np
 import logging
+import os
 import pickle
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
-# Global model variable to cache the model
-_model = None
+import embedding_cache
+from embedding_backends import get_backend
+from vector_format import encode_vector, decode_vector, decode_matrix, is_encoded
 
-def get_model():
-    global _model
-    if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-            logging.info("Loading sentence-transformer model: all-MiniLM-L6-v2")
-            _model = SentenceTransformer('all-MiniLM-L6-v2')
-        except Exception as e:
-            logging.error(f"Failed to load sentence-transformer model: {e}")
-            return None
-    return _model
+# Stored with every embedding; vectors are only compared within one version.
+# Changing EMBEDDING_MODEL or EMBEDDING_BACKEND changes the version and makes
+# reembed.py refresh old rows.
+MODEL_VERSION = get_backend().version
+
+# Storage dtype for new embeddings: float32, float16 or int8
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
 
 def get_embedding(text: str) -> Optional[bytes]:
     """
     Computes vector embedding for the given text.
-    Returns bytes (pickled numpy array) or None on failure.
+    Returns bytes (see vector_format) or None on failure.
+    """
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts: List[str]) -> List[Optional[bytes]]:
+    """
+    Computes embeddings for many texts with one batched model call.
+    Texts already in the embedding cache (after normalization) are not
+    re-encoded, and duplicates within the batch are encoded once.
+    Returns one entry per text, None where encoding failed.
     """
-    model = get_model()
-    if model:
+    if not texts:
+        return []
+    normalized = [embedding_cache.normalize_text(text) for text in texts]
+    keys = [embedding_cache.cache_key(MODEL_VERSION, EMBEDDING_DTYPE, text) for text in normalized]
+    try:
+        found = embedding_cache.get_many(keys)
+    except Exception as e:
+        logging.error(f"Embedding cache lookup failed: {e}")
+        found = {}
+
+    pending = {key: text for key, text in zip(keys, normalized) if key not in found}
+    if pending:
         try:
-            embedding = model.encode(text)
-            return pickle.dumps(embedding)
+            embeddings = get_backend().encode(list(pending.values()))
+            computed = [(key, encode_vector(embedding, EMBEDDING_DTYPE)) for key, embedding in zip(pending, embeddings)]
+            found.update(computed)
+            embedding_cache.put_many(computed)
         except Exception as e:
-            logging.error(f"Error computing embedding: {e}")
-    return None
+            logging.error(f"Error computing embeddings with {MODEL_VERSION}: {e}")
+    return [found.get(key) for key in keys]
+
+def build_profile_text(university: str, skills: List[str], interests: List[str], goals: str) -> str:
+    """
+    The text a profile is embedded from. Year/course is deliberately left
+    out, so editing it does not change the embedding.
+    """
+    return (
+        f"University: {university}. "
+        f"Skills: {', '.join(skills)}. "
+        f"Interests: {', '.join(interests)}. "
+        f"Goals: {goals or ''}."
+    )
+
+def decode_embedding(embedding_bytes: bytes) -> Optional[np.ndarray]:
+    """
+    Decodes a stored embedding blob back into a float32 numpy vector.
+    Blobs written before vector_format existed are pickled arrays.
+    Returns None if the blob cannot be decoded.
+    """
+    try:
+        if is_encoded(embedding_bytes):
+            return decode_vector(embedding_bytes)
+        return np.asarray(pickle.loads(embedding_bytes), dtype=np.float32)
+    except Exception as e:
+        logging.error(f"Error decoding embedding: {e}")
+        return None
+
+def decode_embeddings(blobs: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes many stored blobs into one float32 matrix in a single pass.
+    Legacy pickled blobs are decoded one by one. Rows whose dimension differs
+    from the majority are dropped. Returns (indices into blobs, matrix).
+    """
+    indices, matrix = decode_matrix(blobs)
+    legacy = [i for i, blob in enumerate(blobs) if blob and not is_encoded(blob)]
+    if not legacy:
+        return indices, matrix
+
+    vectors = [(i, decode_embedding(blobs[i])) for i in legacy]
+    dim = matrix.shape[1] if len(indices) else next((v.shape[0] for _, v in vectors if v is not None), 0)
+    vectors = [(i, v.ravel()) for i, v in vectors if v is not None and v.size == dim]
+    if vectors:
+        indices = np.concatenate([indices, np.array([i for i, _ in vectors], dtype=np.int64)])
+        matrix = np.vstack([matrix.reshape(-1, dim), np.stack([v for _, v in vectors])]).astype(np.float32, copy=False)
+    return indices, matrix
 
 def compute_similarity(vector1_bytes: bytes, vector2_bytes: bytes) -> float:
     """
-    Computes cosine similarity between two pickled vectors.
+    Computes cosine similarity between two stored vectors.
     """
     try:
-        v1 = pickle.loads(vector1_bytes)
-        v2 = pickle.loads(vector2_bytes)
+        v1 = decode_embedding(vector1_bytes)
+        v2 = decode_embedding(vector2_bytes)
+        if v1 is None or v2 is None:
+            return 0.0
         
         # Manual cosine similarity for speed and to avoid sklearn dependency if not needed
         dot_product = np.dot(v1, v2)
@@ -1,16 +1,24 @@
+import argparse
+import json
 import sqlite3
 import logging
 
+from db import DB_PATH, init_db, sync_user_terms
+from matching import decode_embedding, EMBEDDING_DTYPE
+from vector_format import encode_vector, is_encoded, read_header, DTYPE_CODES
+
 logging.basicConfig(level=logging.INFO)
 
+LEGACY_MODEL_VERSION = "all-MiniLM-L6-v2"
+
 def migrate():
-    conn = sqlite3.connect('bot_database.db')
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    
+
     # Check current columns
     cursor.execute('PRAGMA table_info(users)')
     columns = [col[1] for col in cursor.fetchall()]
-    
+
     if 'language' not in columns:
         logging.info("Adding 'language' column to 'users' table...")
         cursor.execute("ALTER TABLE users ADD COLUMN language TEXT DEFAULT 'en'")
@@ -18,8 +26,104 @@ def migrate():
         logging.info("Column added successfully.")
     else:
         logging.info("'language' column already exists.")
-        
+
+    # Model of each embedding; everything stored before versioning came from
+    # the original model, which reembed.py replaces if EMBEDDING_MODEL changed
+    if 'model_version' not in columns:
+        logging.info("Adding 'model_version' column to 'users' table...")
+        cursor.execute("ALTER TABLE users ADD COLUMN model_version TEXT")
+        cursor.execute("UPDATE users SET model_version = ? WHERE embedding IS NOT NULL", (LEGACY_MODEL_VERSION,))
+        conn.commit()
+
+    # Token-bucket / window state of rate_limiter.py
+    cursor.execute('PRAGMA table_info(rate_limits)')
+    columns = [col[1] for col in cursor.fetchall()]
+    for column in ("used", "since"):
+        if columns and column not in columns:
+            logging.info(f"Adding '{column}' column to 'rate_limits' table...")
+            cursor.execute(f"ALTER TABLE rate_limits ADD COLUMN {column} REAL")
+            conn.commit()
+
+    conn.close()
+
+def migrate_embeddings(dtype: str = EMBEDDING_DTYPE, batch_size: int = 500, vacuum: bool = False):
+    """
+    Rewrites users.embedding in place into the vector_format layout with the
+    given dtype. Works in user_id order, one transaction per batch, so it can
+    be interrupted and re-run; rows already in the target dtype are skipped.
+    """
+    target_code = DTYPE_CODES[dtype]
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    last_id = None
+    converted = skipped = failed = 0
+    while True:
+        if last_id is None:
+            cursor.execute('SELECT user_id, embedding FROM users WHERE embedding IS NOT NULL ORDER BY user_id LIMIT ?', (batch_size,))
+        else:
+            cursor.execute('SELECT user_id, embedding FROM users WHERE embedding IS NOT NULL AND user_id > ? ORDER BY user_id LIMIT ?', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for user_id, blob in rows:
+            if is_encoded(blob) and read_header(blob)[1] == target_code:
+                skipped += 1
+                continue
+            vector = decode_embedding(blob)
+            if vector is None:
+                failed += 1
+                continue
+            updates.append((encode_vector(vector, dtype), user_id))
+
+        if updates:
+            cursor.executemany('UPDATE users SET embedding = ? WHERE user_id = ?', updates)
+            conn.commit()
+            converted += len(updates)
+        logging.info(f"Embeddings: {converted} converted, {skipped} already {dtype}, {failed} unreadable")
+
+    if vacuum:
+        logging.info("Reclaiming free pages with VACUUM...")
+        cursor.execute('VACUUM')
+    conn.close()
+
+def migrate_terms(batch_size: int = 500):
+    """
+    Backfills the terms/user_terms tables from the JSON skills and interests
+    columns, one transaction per batch in user_id order. Re-running is safe:
+    each user's links are replaced, not appended.
+    """
+    init_db() # creates the normalized tables on older databases
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    last_id = -1
+    migrated = 0
+    while True:
+        cursor.execute('SELECT user_id, skills, interests FROM users WHERE skills IS NOT NULL AND user_id > ? ORDER BY user_id LIMIT ?', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        with conn:
+            for user_id, skills, interests in rows:
+                sync_user_terms(conn, user_id, json.loads(skills), json.loads(interests or "[]"))
+        migrated += len(rows)
+        logging.info(f"Terms: {migrated} users backfilled")
+
     conn.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade the bot database schema and stored data.")
+    parser.add_argument("--embedding-dtype", choices=sorted(DTYPE_CODES), default=EMBEDDING_DTYPE,
+                        help="storage dtype for embeddings (default: EMBEDDING_DTYPE or float32)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true", help="run VACUUM afterwards to shrink the file")
+    args = parser.parse_args()
+
     migrate()
+    migrate_terms(args.batch_size)
+    migrate_embeddings(args.embedding_dtype, args.batch_size, args.vacuum)
@@ -0,0 +1,272 @@
+"""
+Materialized per-user neighbour lists.
+
+user_neighbors keeps each user's top NEIGHBORS_K matches, so /matches is a
+single indexed read. Lists are maintained incrementally from profile events:
+a save scores the changed user against everyone once and only touches the
+lists it enters or drops out of; a delete or block refills only the full lists
+that contained the user. All writes happen on the async_db writer thread:
+events already arrive there, and a list missing at read time is answered from
+a scan and materialized by the writer in the background. Rebuild everything
+offline with:
+
+    python neighbors.py rebuild
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import async_db
+import db
+from db import add_profile_listener, get_embeddings_fingerprint
+from match_engine import MatchEngine, MATCH_THRESHOLD, get_engine
+
+NEIGHBORS_K = int(os.getenv("NEIGHBORS_K", "50"))
+REBUILD_CHUNK = 1024
+
+class NeighborStore:
+    def __init__(self, engine: MatchEngine, k: int = NEIGHBORS_K):
+        self.engine = engine
+        self.k = k
+        self._lock = threading.RLock()
+        # user_id -> (list length, lowest score) for every materialized list
+        self._bounds: Dict[int, Tuple[int, Optional[float]]] = {}
+        # Newest last_updated among the engine's profiles, kept up to date from
+        # events so the stored fingerprint doesn't need a table scan per save
+        self._last_updated: Optional[str] = None
+        self._materializing = set()
+
+    def load(self):
+        """
+        Restores list bounds from the database. Lists written while another
+        process changed profiles without maintaining them are discarded and
+        recomputed lazily on the next read.
+        """
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        self._last_updated = get_embeddings_fingerprint(self.engine.model_version)[1]
+        cursor.execute('SELECT value FROM neighbor_meta WHERE key = ?', ('fingerprint',))
+        row = cursor.fetchone()
+        if not row or row[0] != self._fingerprint():
+            logging.info("Neighbour lists are out of date, clearing them")
+            async_db.write_now(self._clear)
+        cursor.execute('''
+            SELECT s.user_id, COUNT(n.neighbor_id), MIN(n.score)
+            FROM neighbor_state s LEFT JOIN user_neighbors n ON n.user_id = s.user_id
+            GROUP BY s.user_id
+        ''')
+        with self._lock:
+            self._bounds = {user_id: (count, min_score) for user_id, count, min_score in cursor.fetchall()}
+        logging.info(f"Loaded {len(self._bounds)} materialized neighbour lists")
+
+    def _clear(self):
+        conn = db.get_connection()
+        with self._lock, conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM user_neighbors')
+            cursor.execute('DELETE FROM neighbor_state')
+            self._bounds = {}
+            self._store_fingerprint(cursor)
+
+    def get_neighbors(self, user_id: int, query: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        """
+        Returns up to limit (neighbor_id, score) pairs, best first. A missing
+        list is computed by a scan here and stored by the writer thread;
+        users outside the engine (e.g. blocked ones) always get a direct scan.
+        """
+        if user_id not in self._bounds:
+            if user_id not in self.engine:
+                return self.engine.top_k(query, limit, MATCH_THRESHOLD, exclude={user_id}, user_id=user_id)
+            with self._lock:
+                if user_id not in self._materializing:
+                    self._materializing.add(user_id)
+                    async_db.submit_write(self._materialize_missing, user_id)
+            return self.engine.top_k_batch([user_id], self.k).get(user_id, [])[:limit]
+
+        return db.get_connection().execute(
+            'SELECT neighbor_id, score FROM user_neighbors WHERE user_id = ? ORDER BY score DESC LIMIT ?', (user_id, limit)
+        ).fetchall()
+
+    def _materialize_missing(self, user_id: int):
+        """Runs on the writer thread; the list may have been stored by an event meanwhile."""
+        conn = db.get_connection()
+        try:
+            with self._lock, conn:
+                if user_id not in self._bounds and user_id in self.engine:
+                    self._materialize(conn.cursor(), [user_id])
+        except Exception as e:
+            logging.error(f"Materializing neighbour list of {user_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._materializing.discard(user_id)
+
+    def on_profile_event(self, event: str, user_id: int, profile=None):
+        # The engine listener runs first, so membership reflects the new state
+        conn = db.get_connection()
+        with self._lock, conn:
+            cursor = conn.cursor()
+            if profile is not None and profile.last_updated:
+                self._last_updated = max(self._last_updated or "", profile.last_updated)
+            if user_id in self.engine:
+                self._on_saved(cursor, user_id)
+            else:
+                self._on_removed(cursor, user_id)
+            self._store_fingerprint(cursor)
+
+    def _is_full(self, user_id: int) -> bool:
+        return self._bounds[user_id][0] >= self.k
+
+    def _floor(self, user_id: int) -> float:
+        """Score a newcomer must beat to enter the list; inf if not materialized."""
+        bounds = self._bounds.get(user_id)
+        if bounds is None:
+            return np.inf
+        count, min_score = bounds
+        return min_score if count >= self.k else MATCH_THRESHOLD
+
+    def _on_saved(self, cursor, user_id: int):
+        vector = self.engine.vector(user_id)
+        ids, scores = self.engine.score_all(vector, user_id)
+
+        # Lists that already hold the user: keep the entry if the score rose
+        # or the list is short (it then holds every match anyway); otherwise
+        # a user outside the list may now beat it, so recompute that list.
+        cursor.execute('SELECT user_id, score FROM user_neighbors WHERE neighbor_id = ?', (user_id,))
+        holders = dict(cursor.fetchall())
+        refill, touched = [], set()
+        for holder_id, old_score in holders.items():
+            new_score = self.engine.score_pair(holder_id, user_id)
+            if new_score is None or holder_id not in self._bounds:
+                refill.append(holder_id)
+                continue
+            if new_score > MATCH_THRESHOLD and (new_score >= old_score or not self._is_full(holder_id)):
+                cursor.execute('UPDATE user_neighbors SET score = ? WHERE user_id = ? AND neighbor_id = ?', (new_score, holder_id, user_id))
+                touched.add(holder_id)
+            elif not self._is_full(holder_id):
+                cursor.execute('DELETE FROM user_neighbors WHERE user_id = ? AND neighbor_id = ?', (holder_id, user_id))
+                touched.add(holder_id)
+            else:
+                refill.append(holder_id)
+
+        # Lists the user now enters: evict their weakest entry if they are full
+        floors = np.fromiter((self._floor(other_id) for other_id in ids.tolist()), dtype=np.float64, count=len(ids))
+        for i in np.flatnonzero(scores > floors).tolist():
+            other_id = int(ids[i])
+            if other_id == user_id or other_id in holders:
+                continue
+            if self._is_full(other_id):
+                cursor.execute('''
+                    DELETE FROM user_neighbors WHERE rowid = (
+                        SELECT rowid FROM user_neighbors WHERE user_id = ? ORDER BY score LIMIT 1
+                    )
+                ''', (other_id,))
+            cursor.execute('INSERT OR REPLACE INTO user_neighbors (user_id, neighbor_id, score) VALUES (?, ?, ?)',
+                           (other_id, user_id, float(scores[i])))
+            touched.add(other_id)
+
+        self._materialize(cursor, [user_id] + refill)
+        self._refresh_bounds(cursor, touched.difference(refill, {user_id}))
+        logging.info(f"Neighbour lists for {user_id}: {len(touched)} updated, {len(refill)} recomputed")
+
+    def _on_removed(self, cursor, user_id: int):
+        cursor.execute('SELECT user_id FROM user_neighbors WHERE neighbor_id = ?', (user_id,))
+        holders = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM user_neighbors WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM user_neighbors WHERE neighbor_id = ?', (user_id,))
+        cursor.execute('DELETE FROM neighbor_state WHERE user_id = ?', (user_id,))
+        self._bounds.pop(user_id, None)
+
+        # Short lists already hold every match; only full ones need a refill
+        full = [holder_id for holder_id in holders if holder_id in self._bounds and self._is_full(holder_id)]
+        self._materialize(cursor, full)
+        self._refresh_bounds(cursor, set(holders).difference(full))
+
+    def _materialize(self, cursor, user_ids: Iterable[int]):
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return
+        lists = self.engine.top_k_batch(user_ids, self.k)
+        now = datetime.now().isoformat()
+        cursor.executemany('DELETE FROM user_neighbors WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+        cursor.executemany('INSERT INTO user_neighbors (user_id, neighbor_id, score) VALUES (?, ?, ?)',
+                           [(user_id, neighbor_id, score) for user_id, ranked in lists.items() for neighbor_id, score in ranked])
+        cursor.executemany('INSERT OR REPLACE INTO neighbor_state (user_id, updated_at) VALUES (?, ?)',
+                           [(user_id, now) for user_id in lists])
+        missing = [user_id for user_id in user_ids if user_id not in lists]
+        cursor.executemany('DELETE FROM neighbor_state WHERE user_id = ?', [(user_id,) for user_id in missing])
+
+        for user_id, ranked in lists.items():
+            self._bounds[user_id] = (len(ranked), ranked[-1][1] if ranked else None)
+        for user_id in missing:
+            self._bounds.pop(user_id, None)
+
+    def _refresh_bounds(self, cursor, user_ids: Iterable[int]):
+        user_ids = [user_id for user_id in user_ids if user_id in self._bounds]
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            for user_id in chunk:
+                self._bounds[user_id] = (0, None)
+            cursor.execute(f'''
+                SELECT user_id, COUNT(*), MIN(score) FROM user_neighbors
+                WHERE user_id IN ({",".join("?" * len(chunk))}) GROUP BY user_id
+            ''', chunk)
+            for user_id, count, min_score in cursor.fetchall():
+                self._bounds[user_id] = (count, min_score)
+
+    def _fingerprint(self) -> str:
+        """(matchable users, newest last_updated); read from the engine and events, not the table."""
+        return json.dumps([len(self.engine), self._last_updated])
+
+    def _store_fingerprint(self, cursor):
+        cursor.execute('INSERT OR REPLACE INTO neighbor_meta (key, value) VALUES (?, ?)', ('fingerprint', self._fingerprint()))
+
+    def rebuild(self):
+        """Recomputes every list from scratch, one transaction per chunk of users."""
+        with self._lock:
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            with conn:
+                cursor.execute('DELETE FROM user_neighbors')
+                cursor.execute('DELETE FROM neighbor_state')
+            self._bounds = {}
+
+            self._last_updated = get_embeddings_fingerprint(self.engine.model_version)[1]
+            user_ids = self.engine.user_ids()
+            started = time.perf_counter()
+            for start in range(0, len(user_ids), REBUILD_CHUNK):
+                with conn:
+                    self._materialize(cursor, user_ids[start:start + REBUILD_CHUNK])
+                logging.info(f"Rebuilt neighbour lists for {min(start + REBUILD_CHUNK, len(user_ids))}/{len(user_ids)} users")
+            with conn:
+                self._store_fingerprint(cursor)
+        logging.info(f"Neighbour lists rebuilt in {time.perf_counter() - started:.1f}s")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_neighbor_store() -> NeighborStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # The engine registers its listener first, so it is up to date
+                # by the time the store handles the same event
+                store = NeighborStore(get_engine())
+                store.load()
+                add_profile_listener(store.on_profile_event)
+                _store = store
+    return _store
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python neighbors.py rebuild")
+    db.init_db()
+    NeighborStore(get_engine()).rebuild()
@@ -0,0 +1,308 @@
+"""
+Outbound send queue with Telegram-aware rate shaping.
+
+OutboundMiddleware is installed on the bot session, so every Bot API call
+that targets a chat (message.answer, edit_text, send_message, ...) passes
+through one OutboundQueue without handlers changing:
+
+- a per-chat token bucket (OUTBOUND_CHAT_RATE/s, bursts of
+  OUTBOUND_CHAT_BURST) and a global one (OUTBOUND_GLOBAL_RATE/s), below
+  Telegram's flood limits;
+- sends to one chat go out one at a time and in order;
+- edits and deletions of messages already sent (paging, report buttons) don't
+  spend the chat's send budget and don't queue behind its paced sends, so a
+  handler editing its own message isn't held up by the chat rate;
+- a 429 "retry after N" pauses that chat for N seconds and the send is
+  retried, up to OUTBOUND_MAX_RETRIES times;
+- interactive replies go before bulk notifications (send those with
+  notify(), or inside `with bulk_sends():`);
+- consecutive plain text messages waiting for the same chat are merged into
+  one message (up to Telegram's 4096 characters); each caller gets the
+  merged message back.
+
+Calls without a chat (getUpdates, answerCallbackQuery, ...) pass straight
+through. stats() reports queue depth, send counts and latencies; they are
+also logged every OUTBOUND_STATS_INTERVAL seconds while the bot is sending.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (DeleteMessage, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup,
+                             EditMessageText, SendMessage, TelegramMethod)
+
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_STATS_INTERVAL = float(os.getenv("OUTBOUND_STATS_INTERVAL", "300")) # seconds between stats log lines
+MAX_MESSAGE_LENGTH = 4096
+
+# Changes to existing messages; paced only by the global bucket
+EDITS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption, EditMessageMedia, DeleteMessage)
+
+INTERACTIVE, BULK = 0, 1
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+@contextmanager
+def bulk_sends():
+    """Sends made inside the block yield to interactive replies."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self, now: float) -> float:
+        """Seconds until a token is available; 0 if one is now."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Send:
+    __slots__ = ("make_request", "bot", "method", "priority", "seq", "queued_at", "future")
+
+    def __init__(self, make_request, bot: Bot, method: TelegramMethod, priority: int, seq: int):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class _Chat:
+    __slots__ = ("pending", "edits", "bucket", "busy", "paused_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.pending: Deque[_Send] = deque()
+        self.edits: Deque[_Send] = deque()
+        self.bucket = bucket
+        self.busy = False # a send to this chat is in flight
+        self.paused_until = 0.0
+
+def _can_merge(first: SendMessage, second: TelegramMethod) -> bool:
+    if not isinstance(second, SendMessage) or first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if len(first.text) + 2 + len(second.text) > MAX_MESSAGE_LENGTH:
+        return False
+    # Same chat, formatting and options; only the text (and the last keyboard) differ
+    return first.model_dump(exclude={"text", "reply_markup"}) == second.model_dump(exclude={"text", "reply_markup"})
+
+class OutboundQueue:
+    def __init__(self, chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: int = OUTBOUND_CHAT_BURST,
+                 global_rate: float = OUTBOUND_GLOBAL_RATE, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats: Dict[int, _Chat] = {}
+        self._seq = 0
+        self._depth = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._sending = set()
+        self._reported_at = time.monotonic()
+        # Metrics
+        self.sent = self.merged = self.retries = self.failed = 0
+        self._waits: Deque[float] = deque(maxlen=1000) # queued -> handed to the session
+        self._latencies: Deque[float] = deque(maxlen=1000) # queued -> sent
+
+    def __len__(self):
+        return self._depth
+
+    async def submit(self, make_request, bot: Bot, method: TelegramMethod):
+        if self._scheduler is None:
+            self._wakeup = asyncio.Event()
+            self._scheduler = asyncio.create_task(self._schedule())
+        chat_id = method.chat_id
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst))
+        self._seq += 1
+        send = _Send(make_request, bot, method, _priority.get(), self._seq)
+        (chat.edits if isinstance(method, EDITS) else chat.pending).append(send)
+        self._depth += 1
+        self._wakeup.set()
+        return await send.future
+
+    def _next_ready(self, now: float):
+        """The waiting chat to serve next and, if none can send yet, how long to sleep."""
+        best, best_key, sleep = None, None, math.inf
+        for chat_id, chat in self._chats.items():
+            if chat.busy or not (chat.pending or chat.edits):
+                continue
+            if chat.edits:
+                wait, head = chat.paused_until - now, chat.edits[0]
+            else:
+                wait, head = max(chat.paused_until - now, chat.bucket.wait(now)), chat.pending[0]
+            if wait > 0:
+                sleep = min(sleep, wait)
+                continue
+            key = (head.priority, head.seq)
+            if best_key is None or key < best_key:
+                best, best_key = chat_id, key
+        return best, sleep
+
+    async def _schedule(self):
+        while True:
+            now = time.monotonic()
+            chat_id, sleep = self._next_ready(now)
+            if chat_id is not None:
+                global_wait = self.global_bucket.wait(now)
+                if global_wait > 0:
+                    await asyncio.sleep(global_wait)
+                    continue
+                self.global_bucket.take()
+                self._dispatch(chat_id)
+                continue
+
+            if now - self._reported_at >= OUTBOUND_STATS_INTERVAL:
+                self._reported_at = now
+                self.log_stats()
+            # Idle chats are forgotten once their bucket is full again
+            if not self._depth:
+                idle = [chat_id for chat_id, chat in self._chats.items()
+                        if not chat.busy and chat.bucket.wait(now) == 0 and chat.bucket.tokens >= chat.bucket.burst]
+                for chat_id in idle:
+                    del self._chats[chat_id]
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if sleep == math.inf else sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, chat_id: int):
+        chat = self._chats[chat_id]
+        chat.busy = True
+        if chat.edits:
+            sends = [chat.edits.popleft()]
+        else:
+            chat.bucket.take()
+            sends = [chat.pending.popleft()]
+        method = sends[0].method
+        while chat.pending and isinstance(method, SendMessage) and _can_merge(method, chat.pending[0].method):
+            following = chat.pending.popleft()
+            method = method.model_copy(update={"text": f"{method.text}\n\n{following.method.text}",
+                                               "reply_markup": following.method.reply_markup})
+            sends.append(following)
+        self._depth -= len(sends)
+        self.merged += len(sends) - 1
+        now = time.monotonic()
+        self._waits.extend(now - send.queued_at for send in sends)
+        task = asyncio.create_task(self._send(chat, sends, method))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat: _Chat, sends: List[_Send], method: TelegramMethod):
+        first = sends[0]
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await first.make_request(first.bot, method)
+                    break
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    logging.warning(f"Flood limit on chat {method.chat_id}, retrying in {e.retry_after}s")
+                    chat.paused_until = time.monotonic() + e.retry_after
+                    await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            self.failed += len(sends)
+            for send in sends:
+                if not send.future.done():
+                    send.future.set_exception(e)
+        else:
+            self.sent += 1
+            now = time.monotonic()
+            for send in sends:
+                self._latencies.append(now - send.queued_at)
+                if not send.future.done():
+                    send.future.set_result(result)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        def percentile(values, q):
+            values = sorted(values)
+            return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+        return {
+            "depth": self._depth, "in_flight": len(self._sending), "chats": len(self._chats),
+            "sent": self.sent, "merged": self.merged, "retries": self.retries, "failed": self.failed,
+            "wait_p50_ms": percentile(self._waits, 0.5), "wait_p95_ms": percentile(self._waits, 0.95),
+            "send_p50_ms": percentile(self._latencies, 0.5), "send_p95_ms": percentile(self._latencies, 0.95),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Outbound queue: depth {stats['depth']}, {stats['sent']} sent, {stats['merged']} merged, "
+                     f"{stats['retries']} retries, {stats['failed']} failed; wait p50 {stats['wait_p50_ms']:.0f}ms "
+                     f"p95 {stats['wait_p95_ms']:.0f}ms, send p50 {stats['send_p50_ms']:.0f}ms p95 {stats['send_p95_ms']:.0f}ms")
+
+    async def close(self, timeout: float = 10):
+        """Waits (up to timeout) for queued and in-flight sends, then stops the scheduler."""
+        deadline = time.monotonic() + timeout
+        while (self._depth or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            await asyncio.gather(self._scheduler, return_exceptions=True)
+            self._scheduler = None
+        if self._depth:
+            logging.warning(f"Outbound queue closed with {self._depth} unsent messages")
+        self.log_stats()
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    def __init__(self, queue: "OutboundQueue"):
+        self.queue = queue
+
+    async def __call__(self, make_request, bot: Bot, method: TelegramMethod):
+        if getattr(method, "chat_id", None) is None:
+            return await make_request(bot, method)
+        return await self.queue.submit(make_request, bot, method)
+
+_queue: Optional[OutboundQueue] = None
+
+def get_outbound_queue() -> OutboundQueue:
+    global _queue
+    if _queue is None:
+        _queue = OutboundQueue()
+    return _queue
+
+def install(bot: Bot):
+    """Routes the bot's chat-bound API calls through the outbound queue."""
+    bot.session.middleware(OutboundMiddleware(get_outbound_queue()))
+
+async def notify(bot: Bot, chat_id: int, text: str, **kwargs):
+    """Sends a bulk notification, queued behind interactive replies."""
+    with bulk_sends():
+        return await bot.send_message(chat_id, text, **kwargs)
+
+def stats() -> dict:
+    return get_outbound_queue().stats()
+
+async def close():
+    if _queue is not None:
+        await _queue.close()
@@ -0,0 +1,193 @@
+"""
+In-memory per-(user, command) rate limiting.
+
+Each command gets a fixed window ("window": at most N uses per period,
+counted from the first use) or a token bucket ("bucket": bursts of up to N,
+refilling N per period). Both keep two numbers per key, so a check is a dict
+lookup and a little arithmetic. Changed state is written to the rate_limits
+table in batches every RATE_LIMIT_FLUSH_INTERVAL seconds and on shutdown, and
+restored on startup, so restarts don't reset limits.
+
+Handlers check a limit before doing the work and charge it only once the work
+succeeded (check/charge), so a /matches without results or a failed save is
+free; hit does both at once. Limits are configured with RATE_LIMITS, e.g.
+    RATE_LIMITS="matches=bucket:10/3600,profile_save=bucket:30/3600,stats=bucket:5/60"
+Commands without a limit are never limited.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import db
+from async_db import run_read, save_rate_limits
+
+@dataclass(frozen=True)
+class Limit:
+    kind: str # "window" or "bucket"
+    uses: int
+    period: float # seconds
+
+# Bursts of 10 /matches (one more every 6 minutes) and 30 profile saves an hour
+DEFAULT_RATE_LIMITS = "matches=bucket:10/3600,profile_save=bucket:30/3600,stats=bucket:5/60"
+RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv("RATE_LIMIT_FLUSH_INTERVAL", "30"))
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """Parses "command=kind:uses/seconds,..." into a limit per command."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        command, rule = item.split("=", 1)
+        kind, amount = rule.split(":", 1)
+        uses, period = amount.split("/", 1)
+        if kind not in ("window", "bucket"):
+            raise ValueError(f"Unknown rate limit kind for {command}: {kind}")
+        limits[command.strip()] = Limit(kind, int(uses), float(period))
+    return limits
+
+RATE_LIMITS = parse_limits(os.getenv("RATE_LIMITS", DEFAULT_RATE_LIMITS))
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Limit]):
+        self.limits = limits
+        # (user_id, command) -> (used, since). For a window, `used` uses since
+        # the window opened at `since`; for a bucket, tokens taken as of `since`.
+        self._state: Dict[Tuple[int, str], Tuple[float, float]] = {}
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._state)
+
+    def _current(self, key: Tuple[int, str], limit: Limit, now: float) -> Tuple[float, float]:
+        used, since = self._state.get(key, (0.0, now))
+        if limit.kind == "window":
+            return (0.0, now) if now - since >= limit.period else (used, since)
+        # Taken tokens drain back at uses/period
+        return max(0.0, used - (now - since) * limit.uses / limit.period), now
+
+    def check(self, user_id: int, command: str, now: Optional[float] = None) -> Optional[int]:
+        """
+        Returns None if one more use of command is allowed, otherwise the
+        seconds until it will be. Nothing is recorded.
+        """
+        limit = self.limits.get(command)
+        if limit is None:
+            return None
+        now = time.time() if now is None else now
+        used, since = self._current((user_id, command), limit, now)
+        if used + 1 <= limit.uses:
+            return None
+        if limit.kind == "window":
+            wait = since + limit.period - now
+        else:
+            wait = (used + 1 - limit.uses) * limit.period / limit.uses
+        # Rounded first so float error in the refill doesn't add a second
+        return max(1, math.ceil(round(wait, 6)))
+
+    def charge(self, user_id: int, command: str, now: Optional[float] = None):
+        """Records one use of command, e.g. after check allowed it and the work succeeded."""
+        limit = self.limits.get(command)
+        if limit is None:
+            return
+        now = time.time() if now is None else now
+        key = (user_id, command)
+        used, since = self._current(key, limit, now)
+        self._state[key] = (used + 1, since)
+        self._dirty.add(key)
+
+    def hit(self, user_id: int, command: str, now: Optional[float] = None) -> Optional[int]:
+        """
+        Checks and records one use of command. Returns None if it is allowed,
+        otherwise the seconds until it will be (and nothing is recorded).
+        """
+        wait = self.check(user_id, command, now)
+        if wait is None:
+            self.charge(user_id, command, now)
+        return wait
+
+    def forget(self, user_id: int):
+        """Drops a user's state, e.g. with their profile, so it isn't written back."""
+        for key in [key for key in self._state if key[0] == user_id]:
+            del self._state[key]
+        self._dirty = {key for key in self._dirty if key[0] != user_id}
+
+    def restore(self, rows):
+        """Loads (user_id, command, used, since) rows saved by a previous run."""
+        now = time.time()
+        for user_id, command, used, since in rows:
+            limit = self.limits.get(command)
+            if limit is None or used is None or since is None:
+                continue
+            key = (user_id, command)
+            self._state[key] = (used, since)
+            used, since = self._current(key, limit, now)
+            if used <= 0:
+                del self._state[key]
+        logging.info(f"Rate limiter restored {len(self._state)} entries")
+
+    def take_dirty(self):
+        """
+        Returns the changed (user_id, command, used, since) rows since the last
+        call, and drops entries that have fully recovered.
+        """
+        now = time.time()
+        rows = [(user_id, command, *self._state[(user_id, command)]) for user_id, command in self._dirty if (user_id, command) in self._state]
+        self._dirty = set()
+        for key in list(self._state):
+            limit = self.limits.get(key[1])
+            if limit is None or self._current(key, limit, now)[0] <= 0:
+                del self._state[key]
+        return rows
+
+_limiter = RateLimiter(RATE_LIMITS)
+_flush_task: Optional[asyncio.Task] = None
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
+
+def hit(user_id: int, command: str) -> Optional[int]:
+    """Shortcut for get_rate_limiter().hit; returns seconds to wait or None."""
+    return _limiter.hit(user_id, command)
+
+def check(user_id: int, command: str) -> Optional[int]:
+    return _limiter.check(user_id, command)
+
+def charge(user_id: int, command: str):
+    _limiter.charge(user_id, command)
+
+def forget(user_id: int):
+    _limiter.forget(user_id)
+
+async def flush():
+    """Queues changed limiter state as one batched write."""
+    rows = _limiter.take_dirty()
+    if rows:
+        await save_rate_limits(rows)
+
+async def _flush_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush()
+        except Exception as e:
+            logging.error(f"Rate limiter flush failed: {e}")
+
+async def start(interval: float = RATE_LIMIT_FLUSH_INTERVAL):
+    """Restores saved state and starts the periodic flush."""
+    global _flush_task
+    _limiter.restore(await run_read(db.load_rate_limits))
+    _flush_task = asyncio.create_task(_flush_loop(interval))
+
+async def stop():
+    """Stops the periodic flush and writes the remaining changes."""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush()
@@ -0,0 +1,128 @@
+"""
+Background re-embedding after a model change.
+
+Every stored embedding carries the model_version that produced it
+(matching.MODEL_VERSION, set by EMBEDDING_BACKEND and EMBEDDING_MODEL). When
+the model changes, this job walks the profiles whose embedding is from another
+version (or missing) in user_id order, encodes them with the current model
+and swaps the new vectors in, one batch per transaction. A swap is skipped for a user who saved their
+profile while the batch was being encoded; the wizard already stored a
+current embedding for them.
+
+Until a user is re-embedded, matching compares their vector only with vectors
+of the same version (see match_engine.find_matches), so the bot stays up and
+consistent throughout. Progress is the data itself: after a restart the job
+simply finds the profiles that are still stale.
+
+Random stand-in vectors from `import_profiles.py --embeddings random` are left
+alone unless REEMBED_INCLUDE_RANDOM is set (or --include-random is given): a
+synthetic cohort is usually loaded to be matched as it is.
+
+The bot runs the job at REEMBED_RATE profiles per second (0 disables it).
+To re-embed everything at once, e.g. before starting the bot:
+
+    python reembed.py --rate 0
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import async_db
+import db
+from matching import build_profile_text, get_embeddings, MODEL_VERSION
+
+REEMBED_RATE = float(os.getenv("REEMBED_RATE", "20"))
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "64"))
+REEMBED_IDLE = float(os.getenv("REEMBED_IDLE", "3600"))
+REEMBED_INCLUDE_RANDOM = os.getenv("REEMBED_INCLUDE_RANDOM", "0") == "1"
+
+# Encoding gets its own thread, so a sweep never holds up the reader pool
+_encode_executor = ThreadPoolExecutor(1, thread_name_prefix="reembed")
+_task: Optional[asyncio.Task] = None
+
+async def reembed_stale(rate: float = REEMBED_RATE, batch_size: int = REEMBED_BATCH_SIZE,
+                        include_random: bool = REEMBED_INCLUDE_RANDOM) -> int:
+    """
+    One pass over the stale profiles. rate caps profiles per second (0 for no
+    cap). Returns the number of embeddings swapped in.
+    """
+    batch_size = min(batch_size, 500) # one IN (...) list per swap
+    loop = asyncio.get_running_loop()
+    stale = await async_db.run_read(db.count_stale_profiles, MODEL_VERSION, include_random)
+    if not stale:
+        return 0
+    logging.info(f"Re-embedding {stale} profiles with {MODEL_VERSION}")
+
+    after_id = -1
+    swapped = failed = 0
+    started = time.perf_counter()
+    while True:
+        profiles = await async_db.run_read(db.get_stale_profiles, MODEL_VERSION, after_id, batch_size, include_random)
+        if not profiles:
+            break
+        after_id = profiles[-1].user_id
+        batch_started = time.perf_counter()
+
+        texts = [build_profile_text(p.university, p.skills, p.interests, p.goals) for p in profiles]
+        embeddings = await loop.run_in_executor(_encode_executor, get_embeddings, texts)
+        updates = [(profile.user_id, embedding, MODEL_VERSION, profile.last_updated)
+                   for profile, embedding in zip(profiles, embeddings) if embedding]
+        failed += len(profiles) - len(updates)
+        if updates:
+            await async_db.swap_embeddings(updates)
+            swapped += len(updates)
+
+        logging.info(f"Re-embedded {swapped}/{stale} profiles ({failed} failed)")
+        if rate > 0:
+            await asyncio.sleep(max(0.0, len(profiles) / rate - (time.perf_counter() - batch_started)))
+
+    logging.info(f"Re-embedding pass finished: {swapped} swapped, {failed} failed in {time.perf_counter() - started:.1f}s")
+    return swapped
+
+async def _reembed_loop(rate: float, batch_size: int, idle: float):
+    while True:
+        try:
+            await reembed_stale(rate, batch_size)
+        except Exception as e:
+            logging.error(f"Re-embedding failed: {e}")
+        await asyncio.sleep(idle)
+
+def start(rate: float = REEMBED_RATE, batch_size: int = REEMBED_BATCH_SIZE, idle: float = REEMBED_IDLE):
+    """Starts the background job, unless rate is 0."""
+    global _task
+    if rate > 0:
+        _task = asyncio.create_task(_reembed_loop(rate, batch_size, idle))
+
+async def stop():
+    """Cancels the job; a batch being encoded is dropped and redone next time."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=0, help="profiles per second (default: 0, no cap)")
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    parser.add_argument("--include-random", action="store_true", default=REEMBED_INCLUDE_RANDOM,
+                        help="also replace random stand-in vectors from import_profiles.py")
+    args = parser.parse_args()
+
+    await async_db.init_db()
+    try:
+        await reembed_stale(args.rate, args.batch_size, args.include_random)
+    finally:
+        await async_db.shutdown()
+        _encode_executor.shutdown()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
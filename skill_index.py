@@ -0,0 +1,122 @@
+"""
+Inverted index from canonical skill/interest terms to user ids.
+
+Serves three purposes: a cheap candidate generator (users sharing at least one
+term), a lexical similarity that is blended with the embedding cosine, and
+shared-term lookups for match reasons.
+"""
+import logging
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from db import add_profile_listener, canonical_term, get_all_terms
+
+KINDS = ("skills", "interests")
+
+class SkillIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[Tuple[str, str], Set[int]] = {} # (kind, term) -> user ids
+        self._user_terms: Dict[int, Dict[Tuple[str, str], str]] = {} # user id -> (kind, term) -> display text
+
+    def __len__(self):
+        return len(self._user_terms)
+
+    def load(self, rows):
+        """Replaces the index with (user_id, skills, interests) rows."""
+        with self._lock:
+            self._postings, self._user_terms = {}, {}
+            for user_id, skills, interests in rows:
+                self._add(user_id, {"skills": skills, "interests": interests})
+        logging.info(f"Skill index loaded {len(self._user_terms)} users, {len(self._postings)} terms")
+
+    def _add(self, user_id: int, lists: Dict[str, List[str]]):
+        terms = {}
+        for kind in KINDS:
+            for text in lists.get(kind) or []:
+                term = canonical_term(text)
+                if term:
+                    terms.setdefault((kind, term), text.strip())
+        if not terms:
+            return
+        self._user_terms[user_id] = terms
+        for key in terms:
+            self._postings.setdefault(key, set()).add(user_id)
+
+    def _remove(self, user_id: int):
+        for key in self._user_terms.pop(user_id, {}):
+            users = self._postings.get(key)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._postings[key]
+
+    def update(self, user_id: int, skills: List[str], interests: List[str]):
+        with self._lock:
+            self._remove(user_id)
+            self._add(user_id, {"skills": skills, "interests": interests})
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._remove(user_id)
+
+    def candidates(self, user_id: int) -> Counter:
+        """Users sharing at least one term with user_id, with the number of shared terms."""
+        counts = Counter()
+        with self._lock:
+            for key in self._user_terms.get(user_id, {}):
+                counts.update(self._postings[key])
+        counts.pop(user_id, None)
+        return counts
+
+    def lexical_scores(self, user_id: int) -> Dict[int, float]:
+        """
+        Cosine similarity of the binary term vectors: shared / sqrt(|A| * |B|).
+        Symmetric and in [0, 1], like the embedding cosine it is blended with.
+        """
+        counts = self.candidates(user_id)
+        with self._lock:
+            own = len(self._user_terms.get(user_id, {}))
+            return {other_id: shared / math.sqrt(own * len(self._user_terms[other_id]))
+                    for other_id, shared in counts.items() if other_id in self._user_terms}
+
+    def lexical_score(self, user_id: int, other_id: int) -> float:
+        with self._lock:
+            own = self._user_terms.get(user_id, {})
+            other = self._user_terms.get(other_id, {})
+            if not own or not other:
+                return 0.0
+            return len(own.keys() & other.keys()) / math.sqrt(len(own) * len(other))
+
+    def shared_terms(self, user_id: int, other_id: int, kind: str) -> List[str]:
+        """Terms of the given kind both users list, as user_id wrote them."""
+        with self._lock:
+            own = self._user_terms.get(user_id, {})
+            other = self._user_terms.get(other_id, {})
+            return [text for key, text in own.items() if key[0] == kind and key in other]
+
+    def users_with(self, kind: str, text: str) -> Set[int]:
+        with self._lock:
+            return set(self._postings.get((kind, canonical_term(text)), ()))
+
+    def on_profile_event(self, event: str, user_id: int, profile=None):
+        if event == "save" and profile is not None and not profile.is_blocked:
+            self.update(user_id, profile.skills, profile.interests)
+        else:
+            self.remove(user_id)
+
+_index: Optional[SkillIndex] = None
+_index_lock = threading.Lock()
+
+def get_skill_index() -> SkillIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = SkillIndex()
+                index.load(get_all_terms())
+                add_profile_listener(index.on_profile_event)
+                _index = index
+    return _index
@@ -45,14 +45,20 @@ STRINGS = {
         "enter_interests": "🌟 Enter your new interests (separated by commas):",
         "enter_goals": "🎯 Enter your new primary goal:",
         "matches_found": "🎯 *Found {count} matches for you:*",
+        "matches_top": "🎯 *Your top {count} matches:*",
         "no_matches": "No matching found yet. Try updating your profile or check back later!",
         "match_reason_uni": "you both study at {uni}",
         "match_reason_skills": "you both know {skills}",
         "match_reason_interests": "you are both interested in {interests}",
         "match_reason_default": "your goals and interests align well",
+        "matches_page": "📄 Page {page}/{pages}",
+        "page_prev": "⬅️ Back",
+        "page_next": "Next ➡️",
         "report_user": "🚩 Report User",
         "user_reported": "User reported. Thank you for keeping our community safe!",
         "lang_changed": "Language changed to English! 🇺🇸",
+        "rate_limited": "⏳ Too many requests. Please try again in {minutes} min.",
+        "model_warming_up": "⚙️ The bot has just restarted, saving your profile may take a few seconds...",
     },
     "ru": {
         "welcome": "👋 *Добро пожаловать в Student Match Bot!*\n\nЯ помогу вам найти единомышленников на основе ваших навыков и интересов.",
@@ -97,13 +103,19 @@ STRINGS = {
         "enter_interests": "🌟 Введите новые интересы (через запятую):",
         "enter_goals": "🎯 Введите вашу новую основную цель:",
         "matches_found": "🎯 *Найдено {count} совпадений:*",
+        "matches_top": "🎯 *Ваши лучшие {count} совпадений:*",
         "no_matches": "Совпадений пока нет. Попробуйте обновить профиль позже!",
         "match_reason_uni": "вы оба учитесь в {uni}",
         "match_reason_skills": "вы оба знаете {skills}",
         "match_reason_interests": "вы оба интересуетесь {interests}",
         "match_reason_default": "ваши цели и интересы хорошо совпадают",
+        "matches_page": "📄 Страница {page}/{pages}",
+        "page_prev": "⬅️ Назад",
+        "page_next": "Далее ➡️",
         "report_user": "🚩 Пожаловаться",
         "user_reported": "Пользователь зарепорчен. Спасибо за помощь в безопасности сообщества!",
         "lang_changed": "Язык изменен на Русский! 🇷🇺",
+        "rate_limited": "⏳ Слишком много запросов. Попробуйте снова через {minutes} мин.",
+        "model_warming_up": "⚙️ Бот только что перезапустился, сохранение профиля может занять несколько секунд...",
     }
 }
@@ -0,0 +1,345 @@
+"""
+Scale-out across processes (BOT_MODE=supervisor).
+
+The supervisor long-polls Telegram and hands each update to one of
+SUPERVISOR_WORKERS worker processes, chosen by the sender's user id (the chat
+id, or the update id, for updates without a sender). A user's updates
+therefore always reach the same worker, in the order they were polled, so
+their wizard session, rate limits and cached profile stay local to it. Like
+polling in a single process, the worker handles updates concurrently
+(WEBHOOK_WORKERS at a time), so two quick updates of one user may finish out
+of order. Each worker runs the dispatcher and handlers of main.py on its own
+core, with its own outbound queue, and replies to Telegram directly.
+
+Updates travel to workers as JSON lines on their stdin. Workers share the
+SQLite database (WAL, with busy waits across processes) and the matching
+embeddings through the memory-mapped store (EMBEDDING_STORE_DIR, set to
+./embedding_store if empty), so each sees profiles saved by the others.
+Workers report the users whose writes they commit as JSON lines on stdout,
+and the supervisor passes them to the other workers, which drop those users
+from their profile and language caches.
+Matching state built in memory from profile events (neighbour lists, the ANN
+index, the skill index behind lexical scoring) would miss other workers'
+saves, so workers always run exact scans over the shared store without
+lexical blending (SHARED_MATCH_SETTINGS); other configured values are
+overridden with a warning. Worker 0 is the primary: it alone runs background
+re-embedding. A worker that dies is restarted; updates queued in it are lost.
+
+On SIGINT/SIGTERM the supervisor stops polling and closes the workers'
+stdin; they finish their queued updates and exit.
+
+Runs locally without Telegram against a stubbed feed:
+
+    python supervisor.py --workers 4 --stub --updates 5000
+    python -m benchmarks.scale_out --workers 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Update
+
+import async_db
+import db
+from outbound import OUTBOUND_GLOBAL_RATE
+
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+SUPERVISOR_POLL_TIMEOUT = 30
+RESTART_DELAY = 1.0
+# Matching settings that only read state shared between worker processes
+SHARED_MATCH_SETTINGS = {"MATCH_MODE": "exact", "MATCH_WEIGHT_LEXICAL": "0", "MATCH_CANDIDATES": "all"}
+
+def shard(update: Update, workers: int) -> int:
+    """The worker handling an update: by sender, else by chat, else by update id."""
+    try:
+        event = update.event
+    except Exception: # update type this aiogram version doesn't know
+        event = None
+    user = getattr(event, "from_user", None)
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    key = user.id if user else chat.id if chat else update.update_id
+    return key % workers
+
+class Worker:
+    """One worker process, the pipe feeding it updates and the one it reports on."""
+
+    def __init__(self, index: int, command: List[str], env: dict,
+                 on_invalidate: Optional[Callable[["Worker", List[int]], Awaitable[None]]] = None):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.on_invalidate = on_invalidate
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stats: dict = {}
+        self.sent = 0
+        self.restarts = 0
+        self._ready = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._ready.clear()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=self.env)
+        self._reader = asyncio.create_task(self._read(self.process))
+
+    async def _read(self, process: asyncio.subprocess.Process):
+        """Handles the JSON lines the worker prints: ready, invalidate and its final stats."""
+        while line := await process.stdout.readline():
+            if not line.startswith(b"{"):
+                continue
+            message = json.loads(line)
+            if message.get("ready"):
+                self._ready.set()
+            elif "invalidate" in message:
+                if self.on_invalidate is not None:
+                    await self.on_invalidate(self, message["invalidate"])
+            elif "worker" in message:
+                self.stats = message
+        self._ready.set() # exited before warming up
+
+    async def ready(self):
+        """Waits until the worker has finished warming up."""
+        await self._ready.wait()
+
+    async def write(self, line: bytes):
+        self.process.stdin.write(line)
+        await self.process.stdin.drain()
+
+    async def send(self, line: bytes):
+        await self.write(line)
+        self.sent += 1
+
+    async def stop(self):
+        """Closes stdin and waits for the worker to handle what it has and exit."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        await self.process.wait()
+        await self._reader
+
+class Supervisor:
+    def __init__(self, workers: int, worker_args: Optional[List[str]] = None, env: Optional[dict] = None):
+        workers = max(1, workers)
+        env = {**os.environ, **(env or {})}
+        env["EMBEDDING_STORE_DIR"] = env.get("EMBEDDING_STORE_DIR") or "embedding_store"
+        for name, value in SHARED_MATCH_SETTINGS.items():
+            configured = (env.get(name) or value).strip()
+            if (float(configured) != 0) if name == "MATCH_WEIGHT_LEXICAL" else configured != value:
+                logging.warning(f"{name}={configured} keeps per-process state other workers' saves don't reach; "
+                                f"workers use {name}={value}")
+            env[name] = value
+        # Telegram's global flood limit is per bot, so the workers split it
+        env["OUTBOUND_GLOBAL_RATE"] = str(float(env.get("OUTBOUND_GLOBAL_RATE", OUTBOUND_GLOBAL_RATE)) / workers)
+        script = os.path.abspath(__file__)
+        self.workers = [
+            Worker(i, [sys.executable, script, "--worker", str(i), *(worker_args or [])], env, self.broadcast)
+            for i in range(workers)
+        ]
+        self.stopping = False
+        self._watchers: List[asyncio.Task] = []
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.start()
+        self._watchers = [asyncio.create_task(self._watch(worker)) for worker in self.workers]
+        logging.info(f"Started {len(self.workers)} bot workers")
+
+    async def _watch(self, worker: Worker):
+        while True:
+            process = worker.process
+            await process.wait()
+            if self.stopping:
+                return
+            logging.error(f"Worker {worker.index} exited with {process.returncode}, restarting")
+            await asyncio.sleep(RESTART_DELAY)
+            worker.restarts += 1
+            await worker.start()
+
+    async def route(self, update: Update):
+        worker = self.workers[shard(update, len(self.workers))]
+        line = update.model_dump_json(by_alias=True, exclude_unset=True).encode() + b"\n"
+        try:
+            await worker.send(line)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.error(f"Worker {worker.index} is down, update {update.update_id} dropped")
+
+    async def broadcast(self, source: Worker, user_ids: List[int]):
+        """Tells the other workers to drop their cached entries of users source wrote to."""
+        line = json.dumps({"invalidate": user_ids}).encode() + b"\n"
+        for worker in self.workers:
+            if worker is source or worker.process is None:
+                continue
+            try:
+                await worker.write(line)
+            except (BrokenPipeError, ConnectionResetError):
+                pass # a restarted worker starts with empty caches
+
+    async def stop(self):
+        self.stopping = True
+        for watcher in self._watchers:
+            watcher.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        for worker in self.workers:
+            logging.info(f"Worker {worker.index}: {worker.sent} updates routed, "
+                         f"{worker.stats.get('handled', 0)} handled, {worker.stats.get('failed', 0)} failed, "
+                         f"{worker.restarts} restarts")
+
+async def poll(bot: Bot, supervisor: Supervisor, stop: asyncio.Event, allowed_updates: Optional[List[str]] = None,
+               timeout: int = SUPERVISOR_POLL_TIMEOUT):
+    """Long-polls bot and routes updates until stop is set."""
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await supervisor.route(update)
+            offset = update.update_id + 1
+
+async def supervise(bot: Bot, workers: int = SUPERVISOR_WORKERS, allowed_updates: Optional[List[str]] = None,
+                    worker_args: Optional[List[str]] = None, stop: Optional[asyncio.Event] = None):
+    """Runs workers and feeds them from getUpdates until stop is set (or SIGINT/SIGTERM)."""
+    supervisor = Supervisor(workers, worker_args)
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError): # Windows, or not the main thread
+            pass
+
+    await supervisor.start()
+    polling = asyncio.create_task(poll(bot, supervisor, stop, allowed_updates))
+    try:
+        await stop.wait()
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        await supervisor.stop()
+        await bot.session.close()
+    return supervisor
+
+async def run_worker(index: int, stub_rtt_ms: Optional[float] = None):
+    """Worker process: handles updates read from stdin until it is closed."""
+    from main import BOT_TOKEN, dp, serving # the handlers, registered as in a single process
+    from webhook import UpdateQueue
+
+    if stub_rtt_ms is not None:
+        from benchmarks.telegram_stub import stub_bot
+        bot = stub_bot(stub_rtt_ms)
+    else:
+        bot = Bot(token=BOT_TOKEN)
+
+    # Ctrl-C reaches the whole process group; the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    # Users this worker wrote to, reported once per loop iteration so the
+    # supervisor can drop them from the other workers' caches
+    committed = set()
+
+    def report_committed():
+        print(json.dumps({"invalidate": sorted(committed)}), flush=True)
+        committed.clear()
+
+    def on_commit(user_id: int):
+        if not committed:
+            loop.call_soon(report_committed)
+        committed.add(user_id)
+
+    async_db.add_commit_listener(on_commit)
+
+    async with serving(bot, primary=index == 0) as warming_up:
+        await dp.emit_startup(bot=bot)
+        updates = UpdateQueue(dp, bot)
+        updates.start()
+        # Handles updates while warming up, like a single process; the signal is for benchmarks
+        warming_up.add_done_callback(lambda _: print(json.dumps({"ready": True}), flush=True))
+        while line := await reader.readline():
+            message = json.loads(line)
+            if "invalidate" in message:
+                for user_id in message["invalidate"]:
+                    async_db.invalidate(user_id)
+            else:
+                await updates.put(message)
+        await updates.drain()
+        finished = time.time()
+        await dp.emit_shutdown(bot=bot)
+    print(json.dumps({"worker": index, "handled": updates.accepted - updates.failed,
+                      "failed": updates.failed, "finished": finished}), flush=True)
+
+async def run_stub(args) -> dict:
+    """Feeds recorded or synthetic updates through a stubbed getUpdates; returns throughput."""
+    from benchmarks.telegram_stub import recorded_updates, stub_bot
+
+    updates = list(recorded_updates(args.replay, args.updates, args.users))
+    bot = stub_bot()
+    bot.session.feed(updates)
+    stop = asyncio.Event()
+    worker_args = ["--stub", "--rtt-ms", str(args.rtt_ms), "--db", args.db]
+    # The stub has no flood limits; pacing would only measure the outbound queue
+    env = {"EMBEDDING_STORE_DIR": args.db + ".embeddings", "OUTBOUND_GLOBAL_RATE": "1000000",
+           "OUTBOUND_CHAT_RATE": "1000000", "OUTBOUND_CHAT_BURST": "1000000"}
+    # Workers are started and warmed up before the clock starts
+    supervisor = Supervisor(args.workers, worker_args, env)
+    await supervisor.start()
+    await asyncio.gather(*(worker.ready() for worker in supervisor.workers))
+    started = time.time()
+    polling = asyncio.create_task(poll(bot, supervisor, stop, timeout=0))
+    while sum(worker.sent for worker in supervisor.workers) < len(updates):
+        await asyncio.sleep(0.05)
+    stop.set()
+    await polling
+    await supervisor.stop()
+    handled = sum(worker.stats.get("handled", 0) for worker in supervisor.workers)
+    elapsed = max(worker.stats.get("finished", started) for worker in supervisor.workers) - started
+    return {"workers": args.workers, "updates": handled, "seconds": elapsed, "per_second": handled / max(elapsed, 1e-9)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=SUPERVISOR_WORKERS)
+    parser.add_argument("--stub", action="store_true", help="stubbed Telegram instead of BOT_TOKEN")
+    parser.add_argument("--updates", type=int, default=5000, help="synthetic updates to feed with --stub")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--replay", help="JSONL file of recorded updates to feed with --stub")
+    parser.add_argument("--rtt-ms", type=float, default=30, help="simulated Bot API round trip with --stub")
+    parser.add_argument("--db", help=f"database (default: {db.DB_PATH}, or bench_supervisor.db with --stub)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.db = args.db or ("bench_supervisor.db" if args.stub else db.DB_PATH)
+
+    if args.worker is not None:
+        db.DB_PATH = args.db
+        asyncio.run(run_worker(args.worker, args.rtt_ms if args.stub else None))
+    elif args.stub:
+        result = asyncio.run(run_stub(args))
+        print(f"{result['workers']} workers: {result['updates']} updates in {result['seconds']:.1f}s, "
+              f"{result['per_second']:.0f} updates/s")
+    else:
+        from main import BOT_TOKEN, dp
+        asyncio.run(supervise(Bot(token=BOT_TOKEN), args.workers, allowed_updates=dp.resolve_used_update_types(),
+                              worker_args=["--db", args.db]))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
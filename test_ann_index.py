@@ -0,0 +1,85 @@
+import numpy as np
+
+import ann_index
+import db
+from ann_index import IVFIndex
+from match_engine import MatchEngine
+from matching import MODEL_VERSION
+from vector_format import encode_vector
+
+def clustered(count: int, dim: int = 16, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    return (centers[rng.integers(0, clusters, count)] + 0.3 * rng.standard_normal((count, dim))).astype(np.float32)
+
+def profile(user_id: int, vector: np.ndarray, last_updated: str = "2026-01-01T00:00:00") -> db.UserProfile:
+    return db.UserProfile(user_id=user_id, username=None, university="U", year_course="", skills=["x"], interests=[],
+                          goals="", last_updated=last_updated, embedding=encode_vector(vector),
+                          model_version=MODEL_VERSION)
+
+def wait_background():
+    ann_index._background.submit(lambda: None).result()
+
+def test_recall_against_exact_scan():
+    data = clustered(3000)
+    exact, index = MatchEngine(), IVFIndex(nprobe=8)
+    exact.load_arrays(np.arange(len(data)), data)
+    index.load_arrays(np.arange(len(data)), data)
+    index.train()
+
+    queries = clustered(50, seed=1)
+    found = [len({u for u, _ in index.top_k(q, 10, -1)} & {u for u, _ in exact.top_k(q, 10, -1)}) for q in queries]
+    assert sum(found) / (10 * len(queries)) >= 0.9
+    assert index.top_k(queries[0], 10, -1, nprobe=len(index.centroids)) == exact.top_k(queries[0], 10, -1)
+
+def test_trains_and_retrains_as_it_grows(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_MIN_SIZE", 50)
+    monkeypatch.setattr(ann_index, "ANN_SAVE_INTERVAL", float("inf"))
+    data = clustered(500)
+    index = IVFIndex()
+    for user_id in range(60):
+        index.on_profile_event("save", user_id, profile(user_id, data[user_id]))
+    wait_background()
+    assert index.trained and index.trained_size >= 50
+
+    for user_id in range(60, 500):
+        index.on_profile_event("save", user_id, profile(user_id, data[user_id]))
+    index.on_profile_event("delete", 3)
+    wait_background()
+    assert index.trained_size > 4 * 50
+    # Every row sits in exactly the list of its label, after moves and removals during training
+    assert sum(len(rows) for rows in index._lists) == len(index) == 499
+    for label, rows in enumerate(index._lists):
+        assert all(index._labels[row] == label for row in rows)
+
+def test_save_and_load_round_trip(database, tmp_path):
+    path = str(tmp_path / "ann.npz")
+    data = clustered(200)
+    db.save_user_profiles([profile(user_id, data[user_id]) for user_id in range(200)])
+    index = IVFIndex()
+    index.build()
+    index.train(nlist=8)
+    index._dirty = True
+    index.save(path)
+
+    loaded = IVFIndex()
+    assert loaded.load_file(path)
+    assert loaded.top_k(data[0], 5, -1) == index.top_k(data[0], 5, -1)
+
+    # A profile saved without the index seeing it makes the snapshot stale
+    db.save_user_profiles([profile(500, data[1], last_updated="")])
+    assert not IVFIndex().load_file(path)
+
+def test_snapshot_fingerprint_follows_events(database, tmp_path):
+    path = str(tmp_path / "ann.npz")
+    data = clustered(20)
+    db.save_user_profiles([profile(user_id, data[user_id]) for user_id in range(10)])
+    index = IVFIndex()
+    index.build()
+
+    saved = profile(10, data[10])
+    db.save_user_profile(saved)
+    saved = db.get_user_profile(10)
+    index.on_profile_event("save", 10, saved)
+    index.save(path)
+    assert IVFIndex().load_file(path)
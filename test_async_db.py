@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import async_db
+import db
+from db import UserProfile
+
+def profile(user_id: int, **changes) -> UserProfile:
+    fields = dict(user_id=user_id, username=f"u{user_id}", university="STANKIN", year_course="1st Year",
+                  skills=["Python"], interests=["AI"], goals="", last_updated="", language="ru")
+    return UserProfile(**{**fields, **changes})
+
+@pytest.fixture(params=["commit", "queued"])
+def durability(request, database, monkeypatch):
+    monkeypatch.setattr(async_db, "DB_WRITE_DURABILITY", request.param)
+    return request.param
+
+def test_reads_see_pending_writes(durability):
+    async def main():
+        await async_db.save_user_profile(profile(1))
+        await async_db.save_user_profile(profile(2))
+        await async_db.flush()
+        assert (await async_db.get_user_profile(1)).university == "STANKIN" # cached now
+
+        # With "queued" durability none of these is committed before the reads
+        await async_db.save_user_profile(profile(1, university="MSU"))
+        await async_db.set_user_language(1, "en")
+        await async_db.report_user(2)
+        await async_db.delete_user_profile(3)
+        seen = (
+            await async_db.get_user_profile(1),
+            await async_db.get_user_language(1),
+            (await async_db.get_profiles_by_ids([1, 2]))[2].is_blocked,
+            await async_db.get_user_profile(3),
+        )
+        await async_db.flush()
+        return seen, await async_db.get_user_profile(1), await async_db.get_user_profile(2)
+
+    (pending, lang, blocked, deleted), after, reported = asyncio.run(main())
+    assert (pending.university, lang, blocked, deleted) == ("MSU", "en", True, None)
+    assert (after.university, after.language, reported.is_blocked) == ("MSU", "en", True)
+    assert async_db._in_flight == {} and async_db._pending_profiles == {}
+    assert db.get_user_profile(1).university == "MSU"
+
+def test_deleted_profile_reads_as_missing(durability):
+    async def main():
+        await async_db.save_user_profile(profile(7))
+        await async_db.delete_user_profile(7)
+        pending = await async_db.get_user_profile(7), await async_db.get_user_language(7)
+        await async_db.flush()
+        return pending, await async_db.get_user_profile(7)
+
+    assert asyncio.run(main()) == ((None, "en"), None)
+    assert db.get_user_profile(7) is None
+
+def test_lone_write_skips_the_batch_wait(database, monkeypatch):
+    monkeypatch.setattr(async_db, "DB_WRITE_BATCH_WAIT_MS", 60_000)
+
+    async def main():
+        await asyncio.wait_for(async_db.save_user_profile(profile(1)), 5)
+
+    asyncio.run(main())
+    assert db.get_user_profile(1).university == "STANKIN"
+
+def test_commits_are_reported_and_remote_writes_invalidate(database, monkeypatch):
+    committed = []
+    monkeypatch.setattr(async_db, "_commit_listeners", [committed.append])
+
+    async def main():
+        await async_db.save_user_profile(profile(1))
+        await async_db.set_user_language(2, "en")
+        assert (await async_db.get_user_profile(1)).university == "STANKIN" # cached now
+
+        db.save_user_profile(profile(1, university="MSU")) # another process
+        stale = (await async_db.get_user_profile(1)).university
+        async_db.invalidate(1)
+        return stale, (await async_db.get_user_profile(1)).university
+
+    assert asyncio.run(main()) == ("STANKIN", "MSU")
+    assert committed == [1, 2]
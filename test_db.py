@@ -0,0 +1,29 @@
+import sqlite3
+
+import db
+from matching import MODEL_VERSION
+
+# users as created by the bot before embeddings carried a model_version
+BASELINE_USERS = '''
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY, username TEXT, university TEXT, year_course TEXT, skills TEXT,
+        interests TEXT, goals TEXT, last_updated TEXT, embedding BLOB, is_blocked BOOLEAN DEFAULT 0,
+        language TEXT DEFAULT 'en'
+    )
+'''
+
+def test_init_db_upgrades_a_baseline_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(BASELINE_USERS)
+        conn.execute('INSERT INTO users (user_id, university, skills, interests, embedding) VALUES (1, ?, ?, ?, ?)',
+                     ("MSU", '["Python"]', "[]", b"\0" * 8))
+    monkeypatch.setattr(db, "DB_PATH", path)
+    try:
+        db.init_db()
+        db.init_db() # the migration runs once
+        assert db.get_all_embeddings() == [(1, b"\0" * 8)]
+        assert db.get_user_profile(1).model_version is None
+        assert db.count_stale_profiles(MODEL_VERSION) == 1
+    finally:
+        db.close_connections()
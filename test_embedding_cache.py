@@ -0,0 +1,58 @@
+import numpy as np
+
+import db
+import embedding_cache
+import matching
+from embedding_cache import cache_key, flush_touches, get_many, normalize_text, put_many
+
+def last_used(key: str) -> float:
+    return db.get_connection().execute('SELECT last_used FROM embedding_cache WHERE key = ?', (key,)).fetchone()[0]
+
+def test_keys_ignore_whitespace_and_width():
+    assert normalize_text("  Python,\tＳＱＬ \n") == "Python, SQL"
+    assert cache_key("m", "float32", "a") != cache_key("m", "float16", "a") != cache_key("n", "float32", "a")
+
+def test_put_and_get(database):
+    put_many([("a", b"1"), ("b", b"2")])
+    assert get_many(["a", "b", "c", "a"]) == {"a": b"1", "b": b"2"}
+    assert get_many([]) == {}
+
+def test_hits_are_touched_in_batches(database, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "TOUCH_BATCH_SIZE", 3)
+    put_many([("a", b"1"), ("b", b"2"), ("c", b"3")])
+    before = last_used("a")
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: before + 100)
+
+    get_many(["a", "b"])
+    assert last_used("a") == before # pending, not committed per lookup
+    get_many(["c"])
+    assert last_used("a") == last_used("c") == before + 100
+
+    get_many(["b"])
+    flush_touches()
+    assert last_used("b") == before + 100 and embedding_cache.stats()["pending_touches"] == 0
+
+def test_least_recently_used_entries_are_evicted(database, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "EMBED_CACHE_SIZE", 2)
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    put_many([("a", b"1")])
+    put_many([("b", b"2")])
+    get_many(["a"]) # b is now the least recently used
+    put_many([("c", b"3")]) # writes a's pending touch first
+    assert get_many(["a", "b", "c"]) == {"a": b"1", "c": b"3"}
+
+def test_get_embeddings_encodes_each_text_once(database, monkeypatch):
+    calls = []
+
+    class Backend:
+        def encode(self, texts):
+            calls.append(list(texts))
+            return [np.full(4, len(text), dtype=np.float32) for text in texts]
+
+    monkeypatch.setattr(matching, "get_backend", Backend)
+    first = matching.get_embeddings(["Python", "Python ", "SQL"])
+    second = matching.get_embeddings(["SQL", "Go"])
+
+    assert calls == [["Python", "SQL"], ["Go"]]
+    assert first[0] == first[1] and first[2] == second[0]
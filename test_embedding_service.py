@@ -0,0 +1,64 @@
+import asyncio
+
+import embedding_service
+from embedding_service import EmbeddingService
+
+class Encoder:
+    """Fake model call recording its batches."""
+
+    def __init__(self, fail_on: str = None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if self.fail_on in texts:
+            raise RuntimeError("model failed")
+        return [text.encode() for text in texts]
+
+def run(service: EmbeddingService, texts):
+    async def main():
+        results = await asyncio.gather(*(service.embed(text) for text in texts))
+        await service.close()
+        return results
+    return asyncio.run(main())
+
+def test_concurrent_texts_share_one_model_call():
+    encoder = Encoder()
+    results = run(EmbeddingService(batch_size=32, max_wait_ms=50, encode=encoder), ["a", "b", "c"])
+    assert results == [b"a", b"b", b"c"]
+    assert encoder.batches == [["a", "b", "c"]]
+
+def test_batches_are_capped_at_batch_size():
+    encoder = Encoder()
+    texts = [str(i) for i in range(10)]
+    assert run(EmbeddingService(batch_size=4, max_wait_ms=50, encode=encoder), texts) == [t.encode() for t in texts]
+    assert [len(batch) for batch in encoder.batches] == [4, 4, 2]
+
+def test_failed_batch_resolves_to_none():
+    encoder = Encoder(fail_on="bad")
+    assert run(EmbeddingService(batch_size=2, max_wait_ms=50, encode=encoder), ["bad", "x", "y"]) == [None, None, b"y"]
+
+def test_texts_wait_for_warm_up(monkeypatch):
+    class Backend:
+        version, timings = "fake", {}
+
+        def load(self):
+            pass
+
+        def encode(self, texts):
+            return texts
+
+    monkeypatch.setattr(embedding_service, "get_backend", Backend)
+
+    async def main():
+        service = EmbeddingService(max_wait_ms=1, encode=Encoder())
+        warming = asyncio.create_task(service.warm_up())
+        await asyncio.sleep(0)
+        ready_during = service.is_ready()
+        result = await service.embed("late")
+        await warming
+        await service.close()
+        return ready_during, result, service.is_ready()
+
+    assert asyncio.run(main()) == (False, b"late", True)
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+import db
+from embedding_store import EmbeddingStore
+from match_engine import MatchEngine, load_candidates
+from matching import MODEL_VERSION
+from vector_format import encode_vector
+
+DIM = 8
+
+def vector(user_id: int) -> np.ndarray:
+    return np.random.default_rng(user_id).standard_normal(DIM).astype(np.float32)
+
+def save(user_id: int) -> db.UserProfile:
+    """Saves a profile like the wizard does and returns it as stored."""
+    db.save_user_profile(db.UserProfile(user_id=user_id, username=None, university="U", year_course="", skills=["x"],
+                                        interests=[], goals="", last_updated="", embedding=encode_vector(vector(user_id)),
+                                        model_version=MODEL_VERSION))
+    return db.get_user_profile(user_id)
+
+class Worker:
+    """One bot process: its own engine, attached to the shared store directory."""
+
+    def __init__(self, path: str, rebuild: bool = True):
+        self.engine = MatchEngine(weight_dense=1.0, weight_lexical=0.0)
+        self.store = EmbeddingStore(path)
+        self.store.attach(self.engine, self.load if rebuild else self.no_rebuild)
+
+    def load(self):
+        self.engine.load_arrays(*load_candidates(MODEL_VERSION))
+
+    def no_rebuild(self):
+        raise AssertionError("store was rebuilt from the database")
+
+    def ids(self):
+        self.store.sync()
+        return sorted(self.engine.user_ids())
+
+@pytest.fixture
+def path(database, tmp_path):
+    for user_id in range(1, 6):
+        save(user_id)
+    return str(tmp_path / "store")
+
+def test_saves_blocks_and_deletes_reach_the_other_worker(path):
+    a, b = Worker(path), Worker(path, rebuild=False)
+    assert a.ids() == b.ids() == [1, 2, 3, 4, 5]
+
+    a.store.on_profile_event("save", 10, save(10))
+    assert b.ids() == [1, 2, 3, 4, 5, 10]
+    assert b.engine.top_k(vector(10), 1, -1)[0][0] == 10
+
+    db.report_user(2)
+    a.store.on_profile_event("save", 2, db.get_user_profile(2))
+    b.store.on_profile_event("delete", 3)
+    assert a.ids() == b.ids() == [1, 4, 5, 10]
+
+def test_compaction_while_the_other_worker_lags(path):
+    a, b = Worker(path), Worker(path, rebuild=False)
+    a.store.on_profile_event("save", 11, save(11))
+    a.store.compact()
+    a.store.on_profile_event("save", 12, save(12))
+    a.store.on_profile_event("delete", 1)
+    assert (a.store.generation, b.store.generation) == (2, 1)
+
+    # b never replayed log-1; generation 2 already holds 11, log-2 the rest
+    assert b.ids() == [2, 3, 4, 5, 11, 12]
+    assert b.store.generation == 2
+    np.testing.assert_allclose(b.engine.vector(12), a.engine.vector(12))
+
+    a.store.compact()
+    b.store.on_profile_event("save", 13, save(13))
+    assert a.ids() == b.ids() == [2, 3, 4, 5, 11, 12, 13]
+    # The previous generation stays for lagging readers, older ones are removed
+    files = set(os.listdir(path))
+    assert {"ids-2.npy", "matrix-2.npy", "log-2", "ids-3.npy", "log-3"} <= files
+    assert not {"ids-1.npy", "matrix-1.npy", "log-1"} & files
+
+def test_restart_replays_the_log(path):
+    a = Worker(path)
+    a.store.on_profile_event("save", 20, save(20))
+    a.store.compact()
+    a.store.on_profile_event("save", 21, save(21))
+    a.store.on_profile_event("save", 4, save(4))
+    db.delete_user_profile(5)
+    a.store.on_profile_event("delete", 5)
+
+    restarted = Worker(path, rebuild=False)
+    assert restarted.store.generation == 2 and restarted.store._offset > 0
+    assert restarted.ids() == a.ids() == [1, 2, 3, 4, 20, 21]
+    assert restarted.store.last_updated == db.get_embeddings_fingerprint(MODEL_VERSION)[1]
+
+    # A database write the store never saw makes the next start rebuild
+    save(30)
+    rebuilt = Worker(path)
+    assert rebuilt.ids() == [1, 2, 3, 4, 20, 21, 30] and rebuilt.store.generation == 3
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import async_db
+from fsm_storage import FSM_COMPRESS_MIN, SQLiteStorage, pack, storage_key, unpack
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=3)
+
+def test_pack_round_trip():
+    assert pack({}) is None and unpack(None) == {}
+    small = {"lang": "ru", "skills": ["Python", "Дизайн"]}
+    assert pack(small).startswith(b"{") and unpack(pack(small)) == small
+    large = {"goals": "Find a co-founder. " * 50}
+    assert len(pack(large)) < FSM_COMPRESS_MIN and unpack(pack(large)) == large
+
+def test_storage_key():
+    assert storage_key(KEY) == "1:2:3"
+    assert storage_key(StorageKey(bot_id=1, chat_id=2, user_id=3, thread_id=4)) == "1:2:3:4::default"
+
+def test_sessions_survive_a_new_storage(database):
+    async def main():
+        storage = SQLiteStorage(sweep_interval=0)
+        await storage.set_state(KEY, "ProfileStates:waiting_for_skills")
+        await storage.set_data(KEY, {"university": "STANKIN"})
+        await async_db.flush()
+
+        restarted = SQLiteStorage(sweep_interval=0)
+        state, data = await restarted.get_state(KEY), await restarted.get_data(KEY)
+        await restarted.set_state(KEY, None)
+        await restarted.set_data(KEY, {})
+        await async_db.flush()
+        return state, data, await async_db.get_fsm_session(storage_key(KEY))
+
+    assert asyncio.run(main()) == ("ProfileStates:waiting_for_skills", {"university": "STANKIN"}, None)
+
+def test_abandoned_sessions_read_empty_and_are_swept(database):
+    stale = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+    async def main():
+        await async_db.save_fsm_session(storage_key(stale), "ProfileStates:waiting_for_goals", pack({"a": 1}),
+                                        time.time() - 120)
+        storage = SQLiteStorage(ttl=60, sweep_interval=0)
+        await storage.set_state(KEY, "ProfileStates:waiting_for_university")
+        read = await storage.get_state(stale), await storage.get_data(stale)
+        evicted = await storage.evict_stale()
+        return read, evicted, await async_db.get_fsm_session(storage_key(stale)), await storage.get_state(KEY)
+
+    assert asyncio.run(main()) == ((None, {}), 1, None, "ProfileStates:waiting_for_university")
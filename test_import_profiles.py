@@ -0,0 +1,18 @@
+import db
+from import_profiles import import_profiles
+
+RECORDS = [{"user_id": 1, "university": "MSU", "skills": "Python, SQL"},
+           {"user_id": 2, "university": "HSE", "skills": "Go", "language": "en"}]
+
+def test_reimport_keeps_blocks_and_language(database):
+    import_profiles(RECORDS, "first", embeddings="random")
+    db.report_user(1)
+    db.set_user_language(1, "ru")
+    db.set_user_language(2, "ru")
+
+    import_profiles([dict(record, university="STANKIN") for record in RECORDS], "second", embeddings="random")
+    first, second = db.get_user_profile(1), db.get_user_profile(2)
+    assert (first.university, first.is_blocked, first.language) == ("STANKIN", True, "ru")
+    # A record that names a language still sets it
+    assert (second.university, second.is_blocked, second.language) == ("STANKIN", False, "en")
+    assert db.get_import_progress("second") == 2
@@ -0,0 +1,66 @@
+import numpy as np
+
+import db
+import embedding_store
+import match_engine
+import skill_index
+from match_engine import MatchEngine, find_matches
+from vector_format import encode_vector
+
+class Overlap:
+    """Lexical index stub: every other user fully overlaps."""
+
+    def lexical_scores(self, user_id):
+        return {other_id: 1.0 for other_id in (1, 2, 3) if other_id != user_id}
+
+    def lexical_score(self, user_id, other_id):
+        return 1.0
+
+def engine(**weights) -> MatchEngine:
+    engine = MatchEngine(lexical=Overlap(), **weights)
+    engine.load_arrays(np.array([1, 2, 3]), np.array([[1, 0], [0.6, 0.8], [-1, 0]]))
+    return engine
+
+def test_scores_are_dense_cosine_without_lexical_weight():
+    matches = engine(weight_dense=1.0, weight_lexical=0.0).top_k(np.array([1, 0]), 5, 0.1, exclude={1}, user_id=1)
+    assert matches == [(2, np.float32(0.6))]
+    assert engine(weight_dense=1.0, weight_lexical=0.0).score_pair(1, 3) == -1.0
+
+def test_lexical_weight_blends_scores():
+    matches = engine(weight_dense=0.5, weight_lexical=0.5).top_k(np.array([1, 0]), 5, 0.1, exclude={1}, user_id=1)
+    assert [user_id for user_id, _ in matches] == [2]
+    np.testing.assert_allclose(matches[0][1], 0.8)
+
+def test_load_empty():
+    engine = MatchEngine()
+    engine.load_arrays(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+    assert len(engine) == 0 and engine.dim is None
+    assert engine.top_k(np.ones(4), 5) == []
+    engine.load([])
+    assert len(engine) == 0
+
+def test_old_version_engine_sees_other_workers_writes(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_store, "EMBEDDING_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setattr(embedding_store, "_store", None)
+    monkeypatch.setattr(match_engine, "_engines", {})
+    monkeypatch.setattr(match_engine, "_engine_fingerprints", {})
+    monkeypatch.setattr(skill_index, "_index", None)
+    monkeypatch.setattr(db, "_profile_listeners", [])
+
+    def profile(user_id, vector):
+        return db.UserProfile(user_id=user_id, username=None, university="U", year_course="", skills=["x"], interests=[],
+                              goals="", last_updated="", embedding=encode_vector(np.array(vector)), model_version="old")
+
+    def worker_a(write, *args):
+        """A write by another process: none of this process's listeners run."""
+        with monkeypatch.context() as m:
+            m.setattr(db, "_profile_listeners", [])
+            write(*args)
+
+    worker_a(db.save_user_profile, profile(1, [1, 0]))
+    assert find_matches(1, np.array([1, 0]), 5, model_version="old") == [] # worker B loads the old engine
+
+    worker_a(db.save_user_profile, profile(2, [0.8, 0.6]))
+    assert [user_id for user_id, _ in find_matches(1, np.array([1, 0]), 5, model_version="old")] == [2]
+    worker_a(db.report_user, 2)
+    assert find_matches(1, np.array([1, 0]), 5, model_version="old") == []
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import async_db
+import db
+from match_engine import MatchEngine
+from neighbors import NeighborStore
+
+K = 4
+
+@pytest.fixture
+def store(database):
+    rng = np.random.default_rng(0)
+    engine = MatchEngine(weight_dense=1.0, weight_lexical=0.0)
+    engine.load_arrays(np.arange(1, 41), rng.standard_normal((40, 8)))
+    store = NeighborStore(engine, k=K)
+    store.rebuild()
+    return store
+
+def assert_exact(store: NeighborStore):
+    exact = store.engine.top_k_batch(store.engine.user_ids(), K)
+    conn = db.get_connection()
+    for user_id, ranked in exact.items():
+        stored = conn.execute('SELECT neighbor_id, score FROM user_neighbors WHERE user_id = ? ORDER BY score DESC',
+                              (user_id,)).fetchall()
+        assert [n for n, _ in stored] == [n for n, _ in ranked], user_id
+        np.testing.assert_allclose([s for _, s in stored], [s for _, s in ranked], rtol=1e-5)
+        assert store._bounds[user_id] == (len(stored), stored[-1][1] if stored else None)
+
+def test_incremental_updates_match_exact_top_k(store):
+    rng = np.random.default_rng(1)
+    assert_exact(store)
+    for step in range(60):
+        user_id = int(rng.integers(1, 50))
+        if step % 4 == 3:
+            store.engine.remove(user_id)
+            store.on_profile_event("delete", user_id)
+        else:
+            store.engine.upsert(user_id, rng.standard_normal(8))
+            store.on_profile_event("save", user_id)
+        assert_exact(store)
+
+def test_fingerprint_tracks_events(store):
+    before = store._fingerprint()
+    store.engine.upsert(100, np.ones(8))
+    store.on_profile_event("save", 100, db.UserProfile(
+        user_id=100, username="u", university="", year_course="", skills=[], interests=[], goals="",
+        last_updated="9999-01-01T00:00:00"))
+
+    stored = db.get_connection().execute('SELECT value FROM neighbor_meta WHERE key = ?', ('fingerprint',)).fetchone()[0]
+    assert stored == store._fingerprint() != before
+    assert '"9999-01-01T00:00:00"' in stored
+
+def test_missing_list_is_scanned_and_stored_by_the_writer(store):
+    with db.get_connection() as conn:
+        conn.execute('DELETE FROM user_neighbors WHERE user_id = 5')
+    del store._bounds[5]
+    exact = store.engine.top_k_batch([5], K)[5]
+
+    assert store.get_neighbors(5, store.engine.vector(5), 2) == exact[:2]
+    async_db.submit_write(lambda: None).result() # the materialization queued before it has run
+    assert store._bounds[5] == (len(exact), exact[-1][1])
+    assert store.get_neighbors(5, store.engine.vector(5), K) == [tuple(pair) for pair in exact]
+
+def test_load_on_the_writer_thread_clears_inline(store):
+    with db.get_connection() as conn:
+        conn.execute('UPDATE neighbor_meta SET value = ? WHERE key = ?', ("stale", "fingerprint"))
+    async_db.submit_write(store.load).result(timeout=5)
+    assert store._bounds == {}
+    assert db.get_connection().execute('SELECT COUNT(*) FROM user_neighbors').fetchone()[0] == 0
@@ -0,0 +1,99 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+
+from outbound import MAX_MESSAGE_LENGTH, OutboundQueue, bulk_sends
+
+class Session:
+    """Records requests; fails the first `flood` of them with a retry-after."""
+
+    def __init__(self, flood: int = 0):
+        self.requests = []
+        self.flood = flood
+
+    async def __call__(self, bot, method):
+        self.requests.append(method)
+        if self.flood:
+            self.flood -= 1
+            raise TelegramRetryAfter(method, "Too Many Requests", 0)
+        return getattr(method, "text", True)
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+def test_waiting_texts_to_one_chat_are_merged():
+    async def main():
+        queue, session = OutboundQueue(global_rate=1000), Session()
+        results = await asyncio.gather(*(queue.submit(session, None, SendMessage(chat_id=1, text=text))
+                                         for text in ("a", "b", "c")))
+        await queue.close()
+        return queue, session, results
+
+    queue, session, results = run(main())
+    assert [method.text for method in session.requests] == ["a\n\nb\n\nc"]
+    assert results == ["a\n\nb\n\nc"] * 3
+    assert (queue.sent, queue.merged) == (1, 2)
+
+def test_merging_respects_length_and_options():
+    async def main():
+        queue, session = OutboundQueue(global_rate=1000), Session()
+        await asyncio.gather(
+            queue.submit(session, None, SendMessage(chat_id=1, text="x" * (MAX_MESSAGE_LENGTH - 1))),
+            queue.submit(session, None, SendMessage(chat_id=1, text="y")),
+            queue.submit(session, None, SendMessage(chat_id=1, text="z", parse_mode="Markdown")),
+        )
+        await queue.close()
+        return session
+
+    assert [method.text[-1] for method in run(main()).requests] == ["x", "y", "z"]
+
+def test_retry_after_pauses_the_chat_and_retries():
+    async def main():
+        queue, session = OutboundQueue(global_rate=1000, max_retries=2), Session(flood=2)
+        result = await queue.submit(session, None, SendMessage(chat_id=1, text="hi"))
+        await queue.close()
+        return queue, session, result
+
+    queue, session, result = run(main())
+    assert result == "hi" and len(session.requests) == 3
+    assert (queue.retries, queue.failed, queue.sent) == (2, 0, 1)
+
+def test_retry_after_gives_up_after_max_retries():
+    async def main():
+        queue, session = OutboundQueue(global_rate=1000, max_retries=1), Session(flood=5)
+        try:
+            await queue.submit(session, None, SendMessage(chat_id=1, text="hi"))
+        except TelegramRetryAfter:
+            pass
+        else:
+            raise AssertionError("expected TelegramRetryAfter")
+        await queue.close()
+        return queue
+
+    assert run(main()).failed == 1
+
+def test_edits_skip_the_chat_send_budget():
+    async def main():
+        queue, session = OutboundQueue(chat_rate=0.001, chat_burst=1, global_rate=1000), Session()
+        await queue.submit(session, None, SendMessage(chat_id=1, text="page 1"))
+        blocked = asyncio.ensure_future(queue.submit(session, None, SendMessage(chat_id=1, text="more")))
+        edited = await queue.submit(session, None, EditMessageText(chat_id=1, message_id=1, text="page 2"))
+        pending = not blocked.done()
+        blocked.cancel()
+        await queue.close(timeout=0)
+        return edited, pending
+
+    assert run(main()) == ("page 2", True)
+
+def test_interactive_sends_go_before_bulk():
+    async def main():
+        queue, session = OutboundQueue(global_rate=1000), Session()
+        with bulk_sends():
+            bulk = [asyncio.ensure_future(queue.submit(session, None, SendMessage(chat_id=chat_id, text="news")))
+                    for chat_id in (1, 2)]
+        await asyncio.gather(*bulk, queue.submit(session, None, SendMessage(chat_id=3, text="reply")))
+        await queue.close()
+        return session
+
+    assert [method.chat_id for method in run(main()).requests] == [3, 1, 2]
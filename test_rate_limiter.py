@@ -0,0 +1,48 @@
+import pytest
+
+from rate_limiter import Limit, RateLimiter, parse_limits
+
+def test_parse_limits():
+    assert parse_limits("matches=window:2/60, stats=bucket:3/10") == {
+        "matches": Limit("window", 2, 60.0), "stats": Limit("bucket", 3, 10.0)}
+    with pytest.raises(ValueError):
+        parse_limits("matches=leaky:1/60")
+
+def test_window_opens_at_first_use_and_resets_after_period():
+    limiter = RateLimiter(parse_limits("matches=window:2/60"))
+    assert limiter.hit(1, "matches", now=100) is None
+    assert limiter.hit(1, "matches", now=130) is None
+    assert limiter.hit(1, "matches", now=140) == 20
+    assert limiter.hit(2, "matches", now=140) is None # per user
+    assert limiter.hit(1, "matches", now=160) is None # the window opened at 100
+
+def test_bucket_refills_gradually():
+    limiter = RateLimiter(parse_limits("save=bucket:3/30"))
+    assert [limiter.hit(1, "save", now=0) for _ in range(3)] == [None] * 3
+    assert limiter.hit(1, "save", now=0) == 10 # one token every 10s
+    assert limiter.hit(1, "save", now=4) == 6
+    assert limiter.hit(1, "save", now=10) is None
+    assert limiter.hit(1, "save", now=10) == 10
+
+def test_check_does_not_charge():
+    limiter = RateLimiter(parse_limits("matches=window:1/60"))
+    assert limiter.check(1, "matches", now=0) is None
+    assert limiter.check(1, "matches", now=0) is None
+    limiter.charge(1, "matches", now=0)
+    assert limiter.check(1, "matches", now=1) == 59
+    assert limiter.check(1, "other", now=1) is None
+
+def test_forget_drops_state_and_pending_rows():
+    limiter = RateLimiter(parse_limits("matches=window:1/60,stats=bucket:1/60"))
+    limiter.hit(1, "matches")
+    limiter.hit(1, "stats")
+    limiter.hit(2, "matches")
+    limiter.forget(1)
+    assert limiter.check(1, "matches") is None
+    assert [row[:2] for row in limiter.take_dirty()] == [(2, "matches")]
+
+def test_take_dirty_drops_recovered_entries():
+    limiter = RateLimiter(parse_limits("stats=bucket:2/1"))
+    limiter.hit(1, "stats", now=0)
+    assert limiter.take_dirty() == [(1, "stats", 1.0, 0)]
+    assert len(limiter) == 0 # fully refilled by now
@@ -0,0 +1,22 @@
+import asyncio
+
+import db
+import reembed
+from matching import MODEL_VERSION
+from vector_format import encode_vector
+
+def profile(user_id: int, model_version: str) -> db.UserProfile:
+    return db.UserProfile(user_id=user_id, username=None, university="U", year_course="", skills=["x"], interests=[],
+                          goals="", last_updated="", embedding=encode_vector([1.0, 0.0]), model_version=model_version)
+
+def test_random_stand_ins_are_only_reembedded_on_request(database, monkeypatch):
+    monkeypatch.setattr(reembed, "get_embeddings", lambda texts: [encode_vector([0.0, 1.0])] * len(texts))
+    db.save_user_profiles([profile(1, "old-model"), profile(2, "random-2"), profile(3, MODEL_VERSION)])
+
+    async def main():
+        swapped = await reembed.reembed_stale(rate=0)
+        versions = [db.get_user_profile(user_id).model_version for user_id in (1, 2)]
+        return swapped, versions, await reembed.reembed_stale(rate=0, include_random=True)
+
+    assert asyncio.run(main()) == (1, [MODEL_VERSION, "random-2"], 1)
+    assert db.count_stale_profiles(MODEL_VERSION, include_random=True) == 0
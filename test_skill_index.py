@@ -0,0 +1,43 @@
+import pytest
+
+import db
+from db import UserProfile, canonical_term
+from skill_index import SkillIndex
+
+def profile(user_id: int, skills, interests=(), university="STANKIN") -> UserProfile:
+    return UserProfile(user_id=user_id, username=None, university=university, year_course="", skills=list(skills),
+                       interests=list(interests), goals="", last_updated="")
+
+def test_canonical_term():
+    assert canonical_term("  Machine   LEARNING ") == "machine learning"
+    assert canonical_term("Ｐｙｔｈｏｎ") == "python"
+
+def test_terms_are_normalized_and_queryable(database):
+    db.save_user_profiles([profile(1, ["Python", "SQL"], ["AI"]), profile(2, ["python "], ["Chess"]),
+                           profile(3, ["Go"], ["python"], university="MSU")])
+    assert sorted(db.get_users_with_term("PYTHON")) == [1, 2]
+    assert db.get_users_with_term("python", "interests") == [3]
+
+    db.report_user(2)
+    assert db.get_users_with_term("python") == [1]
+    stats = db.get_stats()
+    assert (stats["total_users"], stats["top_skill"], stats["universities"][0]) == (3, "Python", ("STANKIN", 2))
+
+def test_resaving_replaces_terms(database):
+    db.save_user_profile(profile(1, ["Python"]))
+    db.save_user_profile(profile(1, ["Rust"]))
+    assert db.get_users_with_term("python") == [] and db.get_users_with_term("rust") == [1]
+    assert db.get_all_terms() == [(1, ["Rust"], [])]
+
+def test_skill_index_scores_and_shared_terms():
+    index = SkillIndex()
+    index.load([(1, ["Python", "SQL"], ["AI"]), (2, ["python"], ["Chess"]), (3, ["Go"], ["ai"]), (4, [], [])])
+    assert index.candidates(1) == {2: 1, 3: 1}
+    assert index.lexical_scores(1)[2] == pytest.approx(1 / (3 * 2) ** 0.5)
+    assert index.lexical_score(1, 2) == index.lexical_score(2, 1)
+    assert index.shared_terms(2, 1, "skills") == ["python"]
+    assert index.users_with("skills", " PYTHON") == {1, 2}
+
+    index.on_profile_event("save", 2, profile(2, ["Go"]))
+    index.on_profile_event("delete", 3)
+    assert index.candidates(1) == {} and index.users_with("skills", "go") == {2}
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import sys
+
+from aiogram.types import Update
+
+import supervisor
+from supervisor import Supervisor, shard
+
+def update(**fields) -> Update:
+    return Update.model_validate({"update_id": 1001, **fields})
+
+USER = {"id": 42, "is_bot": False, "first_name": "A"}
+CHAT = {"id": -1007, "type": "channel", "title": "C"}
+MESSAGE = {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "from": USER, "text": "/matches"}
+
+def test_shard_by_sender():
+    assert shard(update(message=MESSAGE), 4) == 42 % 4
+    callback = {"id": "1", "from": {**USER, "id": 43}, "chat_instance": "x", "data": "matches_page_1", "message": MESSAGE}
+    assert shard(update(callback_query=callback), 4) == 43 % 4
+
+def test_shard_by_chat_then_update_id():
+    channel_post = {"message_id": 1, "date": 0, "chat": CHAT, "text": "news"}
+    assert shard(update(channel_post=channel_post), 4) == -1007 % 4
+    assert shard(update(), 4) == 1001 % 4 # no event this aiogram version knows
+
+def test_shard_is_stable_and_in_range():
+    for workers in (1, 2, 3, 8):
+        assert {shard(update(message=MESSAGE), workers) for _ in range(5)} == {42 % workers}
+
+def test_workers_match_on_shared_state_only(caplog):
+    with caplog.at_level(logging.WARNING):
+        env = Supervisor(2, env={"MATCH_MODE": "materialized", "MATCH_WEIGHT_LEXICAL": "0.0",
+                                 "OUTBOUND_GLOBAL_RATE": "30"}).workers[0].env
+    assert {name: env[name] for name in supervisor.SHARED_MATCH_SETTINGS} == supervisor.SHARED_MATCH_SETTINGS
+    assert env["OUTBOUND_GLOBAL_RATE"] == "15.0"
+    assert "MATCH_MODE=materialized" in caplog.text and "MATCH_WEIGHT_LEXICAL" not in caplog.text
+
+# Stands in for run_worker: reports each handled update's id as a committed user
+FAKE_WORKER = """
+import json, sys
+print(json.dumps({"ready": True}), flush=True)
+handled, invalidated = 0, []
+for line in sys.stdin:
+    message = json.loads(line)
+    if "invalidate" in message:
+        invalidated += message["invalidate"]
+    else:
+        handled += 1
+        print(json.dumps({"invalidate": [message["update_id"]]}), flush=True)
+print(json.dumps({"worker": int(sys.argv[1]), "handled": handled, "invalidated": invalidated}), flush=True)
+"""
+
+def test_commits_in_one_worker_invalidate_the_others():
+    async def main():
+        supervisor = Supervisor(3)
+        for worker in supervisor.workers:
+            worker.command = [sys.executable, "-c", FAKE_WORKER, str(worker.index)]
+        broadcasts = asyncio.Queue()
+        broadcast = supervisor.broadcast
+
+        async def counted(source, user_ids):
+            await broadcast(source, user_ids)
+            broadcasts.put_nowait(user_ids)
+
+        for worker in supervisor.workers:
+            worker.on_invalidate = counted
+        await supervisor.start()
+        await asyncio.gather(*(worker.ready() for worker in supervisor.workers))
+        await supervisor.route(update(message=MESSAGE)) # user 42, worker 0
+        await asyncio.wait_for(broadcasts.get(), 10)
+        await supervisor.stop()
+        return [worker.stats for worker in supervisor.workers]
+
+    stats = asyncio.run(asyncio.wait_for(main(), 30))
+    assert [(s["handled"], s["invalidated"]) for s in stats] == [(1, []), (0, [1001]), (0, [1001])]
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from vector_format import HEADER_SIZE, decode_matrix, decode_vector, encode_vector, is_encoded, read_header
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 0), ("float16", 1e-3), ("int8", 1e-2)])
+def test_round_trip(dtype, tolerance):
+    vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    blob = encode_vector(vector, dtype)
+
+    assert is_encoded(blob)
+    assert read_header(blob)[2] == 384
+    np.testing.assert_allclose(decode_vector(blob), vector, atol=tolerance)
+
+def test_matrix_matches_single_vectors():
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((5, 16)).astype(np.float32)
+    blobs = [encode_vector(v, dtype) for v, dtype in zip(vectors, ["float32", "float16", "int8", "float32", "int8"])]
+
+    indices, matrix = decode_matrix(blobs)
+
+    assert indices.tolist() == [0, 1, 2, 3, 4]
+    for i, blob in enumerate(blobs):
+        np.testing.assert_allclose(matrix[i], decode_vector(blob))
+
+def test_matrix_skips_bad_blobs():
+    good = encode_vector(np.arange(8), "float32")
+    truncated = encode_vector(np.ones(8), "float32")[:-5]
+    header_only = encode_vector(np.ones(8), "int8")[:HEADER_SIZE]
+    other_dim = encode_vector(np.ones(4), "float32")
+
+    indices, matrix = decode_matrix([truncated, good, None, b"garbage", header_only, other_dim, good])
+
+    assert indices.tolist() == [1, 6]
+    np.testing.assert_array_equal(matrix, [np.arange(8)] * 2)
+
+def test_single_truncated_vector_raises():
+    with pytest.raises(ValueError):
+        decode_vector(encode_vector(np.ones(8))[:-1])
+
+def test_empty_input():
+    indices, matrix = decode_matrix([])
+    assert indices.size == 0 and matrix.shape == (0, 0)
@@ -0,0 +1,43 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, UpdateQueue, build_app
+
+class Dispatcher:
+    """Records fed updates; update_id 13 fails."""
+
+    def __init__(self):
+        self.handled = []
+        self.release = asyncio.Event()
+
+    async def feed_raw_update(self, bot, update):
+        await self.release.wait()
+        if update["update_id"] == 13:
+            raise RuntimeError("handler failed")
+        self.handled.append(update["update_id"])
+
+def test_requests_are_checked_queued_and_drained():
+    async def main():
+        dp = Dispatcher()
+        updates = UpdateQueue(dp, None, size=2, workers=1)
+        updates.start()
+        async with TestClient(TestServer(build_app(updates, "s3cret"))) as client:
+            post = lambda body, secret="s3cret": client.post("/webhook", data=body, headers={SECRET_HEADER: secret})
+            statuses = [
+                (await post('{"update_id": 1}', secret="wrong")).status,
+                (await post("not json")).status,
+                (await post('{"update_id": 1}')).status,
+            ]
+            await asyncio.sleep(0.01) # the worker takes update 1 and waits on it
+            for update_id in (13, 2, 3): # the queue holds two
+                statuses.append((await post(f'{{"update_id": {update_id}}}')).status)
+            dp.release.set()
+            await updates.drain(timeout=5)
+            statuses.append((await post('{"update_id": 4}')).status)
+        return statuses, dp.handled, updates
+
+    statuses, handled, updates = asyncio.run(main())
+    assert statuses == [401, 400, 200, 200, 200, 503, 503]
+    assert handled == [1, 2]
+    assert (updates.accepted, updates.rejected, updates.failed) == (3, 2, 1)
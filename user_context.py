@@ -0,0 +1,62 @@
+"""
+Per-update user context for aiogram handlers.
+
+UserContextMiddleware runs as an outer middleware on every update and injects
+a UserContext as the `user` handler argument. The context loads the sender's
+profile and language lazily, at most once per update, so handlers and the
+helpers they call can ask for them freely.
+"""
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import async_db
+from db import UserProfile
+
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))
+
+_MISSING = object()
+
+class UserContext:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._profile = _MISSING
+        self._language: Optional[str] = None
+
+    async def profile(self) -> Optional[UserProfile]:
+        if self._profile is _MISSING:
+            self._profile = await async_db.get_user_profile(self.user_id)
+        return self._profile
+
+    async def language(self) -> str:
+        """The profile's language if a profile is already loaded, else the stored language."""
+        if self._language is None:
+            if self._profile is not _MISSING and self._profile is not None:
+                self._language = self._profile.language
+            else:
+                self._language = await async_db.get_user_language(self.user_id)
+        return self._language
+
+    def forget(self):
+        """Drops loaded values after this update changed them."""
+        self._profile = _MISSING
+        self._language = None
+
+class UserContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            data["user"] = UserContext(from_user.id)
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            if elapsed > SLOW_UPDATE_MS:
+                logging.warning(f"Slow update {getattr(event, 'update_id', '?')}: {elapsed:.0f}ms")
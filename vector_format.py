@@ -0,0 +1,127 @@
+"""
+Compact binary format for stored embeddings.
+
+Layout (little-endian):
+    magic   2 bytes  b"EV"
+    version uint8
+    dtype   uint8    1 = float32, 2 = float16, 3 = int8 (quantized)
+    dim     uint32
+    scale   float32  dequantization scale for int8, 1.0 otherwise
+    data    dim * itemsize bytes
+"""
+import struct
+from collections import Counter
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"EV"
+VERSION = 1
+HEADER = struct.Struct("<2sBBIf")
+HEADER_SIZE = HEADER.size # 12 bytes, keeps float32 data 4-byte aligned
+
+DTYPE_CODES = {
+    "float32": 1,
+    "float16": 2,
+    "int8": 3,
+}
+NUMPY_DTYPES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2"),
+    3: np.dtype("i1"),
+}
+
+def is_encoded(blob: bytes) -> bool:
+    return blob is not None and len(blob) >= HEADER_SIZE and bytes(blob[:2]) == MAGIC
+
+def encode_vector(vector: np.ndarray, dtype: str = "float32") -> bytes:
+    """
+    Serializes a 1-D vector with a header describing version, dtype and dimension.
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    code = DTYPE_CODES[dtype]
+    scale = 1.0
+
+    if dtype == "int8":
+        max_abs = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        data = np.clip(np.rint(vector / scale), -127, 127).astype(NUMPY_DTYPES[code])
+    else:
+        data = vector.astype(NUMPY_DTYPES[code])
+
+    return HEADER.pack(MAGIC, VERSION, code, vector.shape[0], scale) + data.tobytes()
+
+def read_header(blob: bytes):
+    """
+    Returns (version, dtype code, dim, scale) of an encoded blob.
+    """
+    magic, version, code, dim, scale = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded embedding")
+    if version != VERSION:
+        raise ValueError(f"Unsupported embedding format version: {version}")
+    if code not in NUMPY_DTYPES:
+        raise ValueError(f"Unknown embedding dtype code: {code}")
+    return version, code, dim, scale
+
+def read_vector(blob: bytes) -> np.ndarray:
+    """
+    Returns a read-only view over the stored data in its storage dtype, without copying.
+    """
+    _, code, dim, _ = read_header(blob)
+    return np.frombuffer(blob, dtype=NUMPY_DTYPES[code], count=dim, offset=HEADER_SIZE)
+
+def decode_vector(blob: bytes) -> Optional[np.ndarray]:
+    """
+    Returns the stored vector as float32. float32 data is returned as a
+    zero-copy view; float16 and int8 are widened (and dequantized).
+    """
+    _, code, dim, scale = read_header(blob)
+    data = np.frombuffer(blob, dtype=NUMPY_DTYPES[code], count=dim, offset=HEADER_SIZE)
+    if code == DTYPE_CODES["float32"]:
+        return data
+    if code == DTYPE_CODES["int8"]:
+        return data.astype(np.float32) * np.float32(scale)
+    return data.astype(np.float32)
+
+def decode_matrix(blobs: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes many encoded blobs into one contiguous float32 matrix.
+
+    Payloads are concatenated and read with a single np.frombuffer per dtype
+    instead of one array per row. Only blobs with the most common dimension
+    are kept; blobs with a bad header or a truncated payload are skipped.
+    Returns (indices into blobs that were decoded, matrix).
+    """
+    headers = {}
+    for i, blob in enumerate(blobs):
+        if is_encoded(blob):
+            try:
+                _, code, dim, scale = read_header(blob)
+            except ValueError:
+                continue
+            # A truncated payload is skipped like a bad header, not fatal to the batch
+            if len(blob) < HEADER_SIZE + dim * NUMPY_DTYPES[code].itemsize:
+                continue
+            headers[i] = (code, dim, scale)
+    if not headers:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+    dim = Counter(dim for _, dim, _ in headers.values()).most_common(1)[0][0]
+    indices = np.fromiter((i for i, header in headers.items() if header[1] == dim), dtype=np.int64)
+    matrix = np.empty((len(indices), dim), dtype=np.float32)
+    codes = np.fromiter((headers[i][0] for i in indices.tolist()), dtype=np.int64, count=len(indices))
+    for code, dtype in NUMPY_DTYPES.items():
+        rows = np.flatnonzero(codes == code)
+        if not rows.size:
+            continue
+        payload = b"".join(memoryview(blobs[i])[HEADER_SIZE:HEADER_SIZE + dim * dtype.itemsize] for i in indices[rows].tolist())
+        data = np.frombuffer(payload, dtype=dtype).reshape(len(rows), dim)
+        if code == DTYPE_CODES["int8"]:
+            scales = np.fromiter((headers[i][2] for i in indices[rows].tolist()), dtype=np.float32, count=len(rows))
+            matrix[rows] = data * scales[:, None]
+        else:
+            matrix[rows] = data
+    return indices, matrix
@@ -0,0 +1,165 @@
+"""
+Webhook serving mode (BOT_MODE=webhook), an alternative to long polling.
+
+Telegram POSTs each update to WEBHOOK_PATH on an aiohttp server. Requests
+without the right X-Telegram-Bot-Api-Secret-Token header are rejected. An
+accepted update is answered at once and put on a bounded queue, which
+WEBHOOK_WORKERS tasks feed to the dispatcher. When the queue is full the
+request gets a 503 and Telegram redelivers the update later, so a burst
+cannot pile up unbounded work in the process.
+
+On SIGINT/SIGTERM the server stops taking requests, waits up to
+WEBHOOK_DRAIN_TIMEOUT seconds for queued updates to be handled, then returns.
+The webhook stays registered, so Telegram keeps updates for the next start.
+
+With WEBHOOK_URL set, the webhook is registered on startup (with
+WEBHOOK_SECRET, or a random secret per start if that is empty). Without it the
+server just listens, e.g. behind a proxy configured elsewhere or for local
+testing:
+
+    BOT_MODE=webhook WEBHOOK_SECRET=test python main.py
+    python -m benchmarks.webhook_vs_polling
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import time
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "") # public base URL, e.g. https://bot.example.org
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateQueue:
+    """Bounded queue of raw updates, handled by a fixed number of worker tasks."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.dp = dp
+        self.bot = bot
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self._tasks = []
+        self.accepting = False
+        self.accepted = self.rejected = self.failed = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self.accepting = True
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def offer(self, update: dict) -> bool:
+        """Queues an update; False if the queue is full or draining."""
+        if not self.accepting:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def put(self, update: dict):
+        """Queues an update, waiting while the queue is full."""
+        await self._queue.put(update)
+        self.accepted += 1
+
+    async def _work(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"Update {update.get('update_id')} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Stops accepting, waits for queued updates (up to timeout), then stops the workers."""
+        self.accepting = False
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook drain timed out with {len(self)} updates left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logging.info(f"Webhook queue drained in {time.perf_counter() - started:.2f}s "
+                     f"({self.accepted} accepted, {self.rejected} rejected, {self.failed} failed)")
+
+def build_app(updates: UpdateQueue, secret: str, path: str = WEBHOOK_PATH) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Bad update")
+        if not updates.offer(update):
+            # Telegram redelivers after a failed request
+            return web.Response(status=503, text="Busy")
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                      secret: str = WEBHOOK_SECRET, stop: Optional[asyncio.Event] = None):
+    """
+    Serves updates until stop is set (or SIGINT/SIGTERM), then drains the
+    queue. Returns once everything accepted has been handled; the bot session
+    is left open for queued replies, the caller closes it.
+    """
+    secret = secret or secrets.token_urlsafe(32)
+    updates = UpdateQueue(dp, bot)
+    runner = web.AppRunner(build_app(updates, secret))
+    await runner.setup()
+
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError): # Windows, or not the main thread
+            pass
+
+    await dp.emit_startup(bot=bot)
+    updates.start()
+    await web.TCPSite(runner, host, port).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types(), max_connections=100)
+        logging.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    logging.info(f"Webhook server listening on {host}:{port}{WEBHOOK_PATH} "
+                 f"(queue {WEBHOOK_QUEUE_SIZE}, {updates.workers} workers)")
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Webhook server stopping")
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        updates.accepting = False
+        await runner.cleanup() # closes the listener and finishes in-flight requests
+        await updates.drain()
+        await dp.emit_shutdown(bot=bot)